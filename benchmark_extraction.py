@@ -0,0 +1,49 @@
+import codecs
+import contextlib
+import io
+import re
+import sys
+import time
+
+from c4de.sources.engine import load_template_types
+from c4de.sources.extract import extract_item
+
+
+def load_lines(path):
+    """ Loads the citation lines from a saved copy of a masterlist page, skipping headers and separators. """
+    lines = []
+    with codecs.open(path, mode="r", encoding="utf-8") as f:
+        for line in f.read().splitlines():
+            if not line or line.startswith("==") or line.startswith("----") or "/Header}}" in line:
+                continue
+            x = re.search(r"[*#]([RP]: )?(?P<d>.*?):(?P<r><ref.*?(</ref>|/>))? (D: )?(?P<t>.*?)$", line)
+            lines.append(x.group("t") if x else line)
+    return lines
+
+
+def benchmark(path, rounds=5):
+    """ Reports the average cost of extract_item per masterlist line. Run it against the same saved masterlist before
+    and after a change to extract.py to compare the two. """
+    types = load_template_types(None)
+    lines = load_lines(path)
+    if not lines:
+        print(f"No lines found in {path}")
+        return
+
+    results = []
+    for _ in range(rounds):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for line in lines:
+                extract_item(line, False, "Benchmark", types)
+            results.append(time.perf_counter() - start)
+
+    best = min(results)
+    print(f"{len(lines)} lines, {rounds} rounds: best {best:.3f}s, {best / len(lines) * 1000000:.1f} µs/line")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python benchmark_extraction.py <saved masterlist> [rounds]")
+    else:
+        benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -0,0 +1,128 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial, wraps
+from threading import Condition
+
+from c4de.common import log
+
+BLOCKING_WORKERS = 8
+DEFAULT_LIMIT = 2
+# maximum number of calls of each kind that may run at once
+BLOCKING_LIMITS = {
+    "sources": 1,
+    "analysis": 2,
+    "edelweiss": 1,
+    "scripts": 1,
+    "wiki": 4,
+    "web": 4,
+}
+SLOW_CALL = 60
+
+
+class BlockingRunner:
+    """ Runs blocking pywikibot, requests and subprocess calls from the bot's task loops on a bounded thread pool, so
+    that they don't hold up the event loop. Calls are grouped by key, and each key has its own concurrency limit.
+    The time taken by each call is recorded in timings, and calls slower than SLOW_CALL seconds are logged.
+
+    :type timings: dict[str, dict[str, float]]
+    """
+
+    def __init__(self, workers=BLOCKING_WORKERS, limits=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blocking")
+        self.limits = BLOCKING_LIMITS if limits is None else limits
+        self.semaphores = {}
+        self.timings = {}
+        self.closed = False
+
+    def semaphore(self, key) -> asyncio.Semaphore:
+        if key not in self.semaphores:
+            self.semaphores[key] = asyncio.Semaphore(self.limits.get(key, DEFAULT_LIMIT))
+        return self.semaphores[key]
+
+    async def run(self, key, func, *args, **kwargs):
+        """ Runs func(*args, **kwargs) on the pool once a slot for the given key is free, and returns its result. """
+        if self.closed:
+            raise asyncio.CancelledError(f"Cannot run {func.__name__} after shutdown")
+        async with self.semaphore(key):
+            start = time.monotonic()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+            finally:
+                self.record(key, getattr(func, "__name__", str(func)), time.monotonic() - start)
+
+    def record(self, key, name, elapsed):
+        t = self.timings.setdefault(f"{key}:{name}", {"calls": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+        t["calls"] += 1
+        t["total"] += elapsed
+        t["last"] = elapsed
+        t["max"] = max(t["max"], elapsed)
+        if elapsed > SLOW_CALL:
+            log(f"Blocking call {name} ({key}) took {elapsed:.1f}s")
+
+    def shutdown(self):
+        """ Stops accepting new calls and cancels the ones that haven't started yet. Calls that are already running
+        finish in the background, but their results are discarded. """
+        self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ReadWriteLock:
+    """ Lets any number of readers hold the lock at once, or a single writer. Waiting writers go first, so that a
+    steady stream of readers can't hold off a rebuild forever. """
+
+    def __init__(self):
+        self.condition = Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def shared(self):
+        with self.condition:
+            while self.writer or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self.condition:
+            self.waiting_writers += 1
+            try:
+                while self.writer or self.readers:
+                    self.condition.wait()
+            finally:
+                self.waiting_writers -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+
+def reads(func):
+    """ Runs the method while holding its object's lock as a reader. """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.lock.shared():
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def writes(func):
+    """ Runs the method while holding its object's lock as the only writer. """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.lock.exclusive():
+            return func(self, *args, **kwargs)
+    return wrapper
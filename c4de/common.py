@@ -1,12 +1,15 @@
 import re
 import time
+from collections import OrderedDict
+from threading import Lock
+from bisect import bisect_left, insort
 
 import requests
 import traceback
 from json import JSONDecodeError
 from pywikibot import Page, Category, pagegenerators, showDiff
 from datetime import datetime
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 
 import urllib3.exceptions
 import waybackpy
@@ -86,6 +89,100 @@ def is_redirect(page, title=None):
         return False
 
 
+REDIRECT_BATCH_SIZE = 50
+REDIRECT_CACHE_SIZE = 20000
+REDIRECT_CACHE_TTL = 3600
+
+
+class RedirectResolver:
+    """ Resolves the immediate redirect targets of pages in batches of titles, caching the results (including pages
+    that aren't redirects) for an hour so that consecutive analyses don't look up the same links again. """
+
+    def __init__(self, max_size=REDIRECT_CACHE_SIZE, ttl=REDIRECT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache = OrderedDict()
+        self.lock = Lock()
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def cached(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return False, None
+            target, added = entry
+            if time.monotonic() - added > self.ttl:
+                del self.cache[key]
+                return False, None
+            self.cache.move_to_end(key)
+            return True, target
+
+    def store(self, key, target):
+        with self.lock:
+            self.cache[key] = (target, time.monotonic())
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def query(self, site, titles: List[str]) -> Dict[str, Optional[str]]:
+        data = site.simple_request(action="query", titles=titles, redirects=1).submit()
+        query = data.get("query", {})
+        normalized = {n["from"]: n["to"] for n in query.get("normalized", [])}
+        redirects = {}
+        for r in query.get("redirects", []):
+            if "tointerwiki" in r:
+                continue
+            redirects[r["from"]] = f"{r['to']}#{r['tofragment']}" if r.get("tofragment") else r["to"]
+        return {t: redirects.get(normalized.get(t, t)) for t in titles}
+
+    def resolve(self, site, titles: List[str]) -> Dict[str, Optional[str]]:
+        """ Returns the redirect target for each of the given titles, or None for pages that aren't redirects. """
+        results, missing = {}, []
+        for t in titles:
+            found, target = self.cached((site.sitename, t))
+            if found:
+                results[t] = target
+            elif t not in missing:
+                missing.append(t)
+
+        for n in range(0, len(missing), REDIRECT_BATCH_SIZE):
+            batch = missing[n:n + REDIRECT_BATCH_SIZE]
+            try:
+                resolved = self.query(site, batch)
+            except Exception as e:
+                error_log(f"Unable to resolve redirects: {type(e)}: {e}")
+                resolved = {t: None for t in batch}
+            else:
+                for t, target in resolved.items():
+                    self.store((site.sitename, t), target)
+            results.update(resolved)
+        return results
+
+
+REDIRECT_RESOLVER = RedirectResolver()
+
+
+REVISION_BATCH_SIZE = 50
+
+
+def latest_revision_ids(site, titles: List[str]) -> Dict[str, int]:
+    """ Returns the latest revision ID of each of the given pages; pages that don't exist are recorded as 0. The pages
+    are checked in batches, with one info query per batch. """
+    results = {}
+    for n in range(0, len(titles), REVISION_BATCH_SIZE):
+        batch = titles[n:n + REVISION_BATCH_SIZE]
+        data = site.simple_request(action="query", prop="info", titles=batch).submit()
+        query = data.get("query", {})
+        normalized = {x["to"]: x["from"] for x in query.get("normalized", [])}
+        pages = query.get("pages", {})
+        for p in (pages.values() if isinstance(pages, dict) else pages):
+            results[normalized.get(p["title"], p["title"])] = p.get("lastrevid", 0)
+    return results
+
+
 TOP_ORDER = [
     ["fa", "pfa", "ffa", "ga", "pga", "fga", "ca", "pca", "fca"],
     ["fprot", "sprot", "ssprot", "mprot"],
@@ -184,9 +281,11 @@ def build_redirects(page: Page, manual: str = None):
         #         pages.append(Page(page.site, x))
         #         pagenames.append(x)
 
-    for i, r in enumerate(pages):
-        if is_redirect(r, pagenames[i]):
-            t = r.getRedirectTarget().title()
+    titles = [r.title() for r, n in zip(pages, pagenames) if "w:c:" not in n.lower()]
+    targets = REDIRECT_RESOLVER.resolve(page.site, titles)
+    for r in pages:
+        t = targets.get(r.title())
+        if t:
             if t.startswith("File:"):
                 results[r.title().replace(" ", "_")] = t.replace(" ", "_")
             elif not t.startswith("Category:"):
@@ -280,32 +379,135 @@ def handle_multiple_issues(text: Union[List[str], str]):
     return lines
 
 
+REDIRECT_DELIMITERS = ["[[", "{{", "|", "="]
+REDIRECT_TERMINATORS = re.compile(r"[|\[\]{}\n]")
+UNESCAPED_TITLE_CHARS = ".^$*+[]{}\\|"
+
+
+def redirect_key(title: str):
+    """ The IndexedText lookup key for the given title: the part of it that prepare_title's pattern matches literally,
+    or None if that can't be used to narrow down the lines. """
+    prefix = REDIRECT_TERMINATORS.split(title, 1)[0]
+    for i, c in enumerate(prefix):
+        if c in UNESCAPED_TITLE_CHARS:
+            prefix = prefix[:i]
+            break
+    if not prefix or len({prefix[0].casefold(), prefix[0].capitalize().casefold(), prefix[0].lower().casefold()}) > 1:
+        return None
+    return prefix.casefold().replace("_", " ")
+
+
+class IndexedText:
+    """ Page text split into lines, and indexed by the text after every link, template and parameter delimiter, so that
+    each redirect is only checked against and applied to the lines that can contain it. None of the redirect patterns
+    span lines, so applying them line by line gives the same result as applying them to the whole text. """
+
+    def __init__(self, text: str):
+        parts = text.split("\n")
+        self.lines = [f"{p}\n" for p in parts[:-1]] + parts[-1:]
+        self.keys = [set() for _ in self.lines]
+        self.index = {}
+        self.tokens = []
+        self.dirty = None
+        self.joined = text
+        for i in range(len(self.lines)):
+            self.reindex(i)
+
+    def reindex(self, i):
+        for k in self.keys[i]:
+            self.index[k].discard(i)
+        n = self.lines[i].casefold().replace("_", " ")
+        keys = set()
+        for d in REDIRECT_DELIMITERS:
+            x = n.find(d)
+            while x >= 0:
+                keys.add(REDIRECT_TERMINATORS.split(n[x + len(d):], 1)[0])
+                x = n.find(d, x + 1)
+        for k in keys:
+            if k not in self.index:
+                self.index[k] = set()
+                insort(self.tokens, k)
+            self.index[k].add(i)
+        self.keys[i] = keys
+
+    def text(self) -> str:
+        if self.joined is None:
+            self.joined = "".join(self.lines)
+        return self.joined
+
+    def candidates(self, key) -> List[int]:
+        if key is None:
+            return list(range(len(self.lines)))
+        lines = set()
+        for i in range(bisect_left(self.tokens, key), len(self.tokens)):
+            if not self.tokens[i].startswith(key):
+                break
+            lines.update(self.index[self.tokens[i]])
+        return sorted(lines)
+
+    def check_text(self, lines, r, lower=False):
+        return any(check_text(r, self.lines[i].lower() if lower else self.lines[i]) for i in lines)
+
+    def contains(self, lines, value):
+        return any(value in self.lines[i].lower().replace("_", " ") for i in lines)
+
+    def update(self, lines, func):
+        results = [(i, func(self.lines[i])) for i in lines]
+        for i, new in results:
+            if new != self.lines[i]:
+                self.lines[i] = new
+                self.joined = None
+                if self.dirty is not None:
+                    self.dirty.add(i)
+                self.reindex(i)
+
+    def sub(self, lines, pattern, repl):
+        self.update(lines, lambda ln: pattern.sub(repl, ln))
+
+    def replace(self, lines, old, new):
+        self.update(lines, lambda ln: ln.replace(old, new))
+
+    def collapse_spaces(self):
+        """ Removes runs of four spaces from every line changed since the last time this ran, which leaves the same
+        text as removing them from the entire page. """
+        lines = range(len(self.lines)) if self.dirty is None else sorted(self.dirty)
+        self.update(lines, lambda ln: ln.replace("    ", ""))
+        self.dirty = set()
+
+
 def fix_redirects(redirects: Dict[str, str], text, section_name, disambigs, remap, file=False, overwrite=False,
                   appearances: Dict[str, List[Item]] = None, sources: Dict[str, List[Item]] = None, canon=False) -> str:
+    indexed = IndexedText(text)
     for r, t in redirects.items():
         if t in disambigs or "(disambiguation)" in t:
-            fix_disambigs(r, t, text)
+            fix_disambigs(r, t, indexed.text())
             continue
         elif t in remap and "Free Comic Book" not in t:
             log(f"Skipping remap redirect {t}")
             continue
         if r in CONSOLES:
-            text = text.replace(f"[[{r}]]", f"[[Wikipedia:{r}|{r}]]").replace(f"[[{r}|", f"[[Wikipedia:{r}|")
+            lines = indexed.candidates(redirect_key(r))
+            indexed.replace(lines, f"[[{r}]]", f"[[Wikipedia:{r}|{r}]]")
+            indexed.replace(lines, f"[[{r}|", f"[[Wikipedia:{r}|")
 
         elif r.startswith("Template:"):
-            if r.replace("Template:", "{{").lower() not in text.lower().replace("_", " "):
+            lines = indexed.candidates(redirect_key(r.replace("Template:", "")) if r.count("Template:") == 1 else None)
+            if not indexed.contains(lines, r.replace("Template:", "{{").lower()):
                 continue
             if section_name:
                 print(f"Fixing {section_name} redirect {r} to {t}")
             x = prepare_title(r.replace("Template:", "")).replace(" ", "[ _]")
             tx = t.replace("Template:", "").replace(" ", "_")
-            text = re.sub(r"\{\{" + x + " *([\n|}])", f"{{{{{tx}\\1", text)
+            indexed.sub(lines, re.compile(r"\{\{" + x + " *([\n|}])"), f"{{{{{tx}\\1")
 
         elif canon and "/Legends" in t and "/Legends" not in r:
             continue
 
-        elif check_text(r.lower(), text.lower()):
-            if r.lower() == t.lower() and not (check_text(r, text) or check_text(f"{r[0].lower()}{r[1:].lower()}", text)):
+        else:
+            lines = indexed.candidates(redirect_key(r))
+            if not indexed.check_text(lines, r.lower(), lower=True):
+                continue
+            if r.lower() == t.lower() and not (indexed.check_text(lines, r) or indexed.check_text(lines, f"{r[0].lower()}{r[1:].lower()}")):
                 continue
             if section_name:
                 print(f"Fixing {section_name} redirect {r} to {t}")
@@ -322,41 +524,43 @@ def fix_redirects(redirects: Dict[str, str], text, section_name, disambigs, rema
                     rep = f"[[{y[0].target}|{y[0].format_text}]]"
                 elif "(" in y[0].target:
                     rep = f"[[{y[0].target}|''{y[0].target.split(' (')[0]}'']]"
-                text = re.sub(r"'?'?\[\[" + x + "(\|.*?)?]]'?'?", rep, text)
+                indexed.sub(lines, re.compile(r"'?'?\[\[" + x + "(\|.*?)?]]'?'?"), rep)
             elif y and not y[0].template:
-                text = re.sub(r"'?'?\[\[" + x + "(\|.*?)?]]'?'?", y[0].original, text)
+                indexed.sub(lines, re.compile(r"'?'?\[\[" + x + "(\|.*?)?]]'?'?"), y[0].original)
             else:
                 if "Ltd" in r or "Limited" in r or " Inc" in r or " LLC" in r or " Co" in r:
                     if re.sub(r",? (Ltd|Limited|Inc|LLC)\.?", "", r) == t:
-                        text = re.sub(r"\[\[" + x + "(\|" + prepare_title(t) + ")?]]", f"[[{t}]]", text)
+                        indexed.sub(lines, re.compile(r"\[\[" + x + "(\|" + prepare_title(t) + ")?]]"), f"[[{t}]]")
 
                 if r == f"{t}s":
-                    text = text.replace(f"[[{r}]]", f"[[{t}]]s")
+                    indexed.replace(lines, f"[[{r}]]", f"[[{t}]]s")
 
-                text = re.sub(r"(''')?('')?\[\[" + x + "\|('')?(" + prepare_title(t) + ")('')?]](s)?(''')?('')?", f"\\1\\2\\3[[\\4]]\\6\\2\\3", text)
+                indexed.sub(lines, re.compile(r"(''')?('')?\[\[" + x + "\|('')?(" + prepare_title(t) + ")('')?]](s)?(''')?('')?"), f"\\1\\2\\3[[\\4]]\\6\\2\\3")
                 if r.startswith("File:"):
-                    text = re.sub(r"\[\[(" + x + ")(\|.*?)?]]", f"[[{t}\\2]]", text)
+                    indexed.sub(lines, re.compile(r"\[\[(" + x + ")(\|.*?)?]]"), f"[[{t}\\2]]")
                 elif file or r.replace("Star Wars: Republic: ", "Star Wars: ") == t \
                         or r.startswith("File:") or (overwrite and "/Legends" not in t and "/Canon" not in t):
-                    text = re.sub(r"\[\[(" + x + ")(s)?]]", f"[[{t}]]\\2", text)
-                    text = re.sub(r"\[\[" + x + "(\|.*?)]](s)?", f"[[{t}]]\\2", text)
+                    indexed.sub(lines, re.compile(r"\[\[(" + x + ")(s)?]]"), f"[[{t}]]\\2")
+                    indexed.sub(lines, re.compile(r"\[\[" + x + "(\|.*?)]](s)?"), f"[[{t}]]\\2")
                 else:
-                    text = re.sub(r"(''')?('')?\[\[(" + x + ")]]([A-Za-z']*)", f"\\1[[{t}|\\2\\3\\4]]\\1", text)
-                    text = re.sub(r"\[\[" + x + "(\|.*?)]](s)?", f"[[{t}\\1\\2]]", text)
+                    indexed.sub(lines, re.compile(r"(''')?('')?\[\[(" + x + ")]]([A-Za-z']*)"), f"\\1[[{t}|\\2\\3\\4]]\\1")
+                    indexed.sub(lines, re.compile(r"\[\[" + x + "(\|.*?)]](s)?"), f"[[{t}\\1\\2]]")
             if "/" not in r:
                 try:
-                    text = re.sub(r"(\{\{(?!(WP|1stID))[A-Za-z0-9]+\|)" + x + "}}", "\\1    " + t + "}}", text).replace("    ", "")
+                    indexed.sub(lines, re.compile(r"(\{\{(?!(WP|1stID))[A-Za-z0-9]+\|)" + x + "}}"), "\\1    " + t + "}}")
+                    indexed.collapse_spaces()
                 except Exception as e:
                     print(e, x, t)
             if r.split(" (")[0] != t.split(" (")[0]:
-                text = text.replace(f"set={r}|", f"set={t}|").replace(f"set={r}}}", f"set={t}}}")
+                indexed.replace(lines, f"set={r}|", f"set={t}|")
+                indexed.replace(lines, f"set={r}}}", f"set={t}}}")
             if t.startswith(f"{r} ("):
-                text = re.sub(r"book=" + x + "([|}])", f"book={r}\\1", text)
+                indexed.sub(lines, re.compile(r"book=" + x + "([|}])"), f"book={r}\\1")
             else:
-                text = text.replace(f"book={r}", f"book={t}")
-            text = text.replace(f"story={r}|", f"story={t}|")
-            text = text.replace(f"story={r}" + "}", f"story={t}|" + "}")
-    return text
+                indexed.replace(lines, f"book={r}", f"book={t}")
+            indexed.replace(lines, f"story={r}|", f"story={t}|")
+            indexed.replace(lines, f"story={r}" + "}", f"story={t}|" + "}")
+    return indexed.text()
 
 
 def handle_repeated_references(text, status):
@@ -1,3 +1,4 @@
+import asyncio
 import codecs
 import re
 import emoji
@@ -7,6 +8,7 @@ import sys
 import traceback
 import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from urllib import parse
 from typing import List, Tuple
 from datetime import datetime, timedelta
@@ -24,7 +26,10 @@ ssl._create_default_https_context = ssl._create_unverified_context
 from pywikibot import Site, Page, Category, User, FilePage
 from pywikibot.exceptions import NoPageError, LockedPageError, OtherPageSaveError
 
+from c4de.blocking import BlockingRunner
 from c4de.common import log, error_log, archive_url
+from c4de.jobs import AnalysisQueue, INTERACTIVE, NOMINATION, BACKGROUND
+from c4de.state import StateStore
 from c4de.data.filenames import *
 from c4de.version_reader import report_version_info
 
@@ -34,18 +39,12 @@ from c4de.protocols.edelweiss import run_edelweiss_protocol, calculate_isbns_for
 from c4de.protocols.rss import check_rss_feed, check_latest_url, check_wookieepedia_feeds, check_sw_news_page, \
     check_review_board_nominations, check_policy, check_consensus_duration, check_user_rights_nominations, \
     check_blog_list, check_ea_news, check_unlimited, check_ubisoft_news, compare_site_map, handle_site_map, \
-    check_target_url, compile_tracked_urls, check_title_formatting, check_hunters_news, check_ilm, check_audible
-
-from c4de.sources.analysis import get_analysis_from_page
-from c4de.sources.archive import create_archive_categories
-from c4de.sources.build import analyze_target_page
-from c4de.sources.domain import FullListData
-from c4de.sources.engine import load_full_sources, load_full_appearances, load_remap, reload_auto_categories, \
-    load_auto_categories, load_template_types, reload_templates, LIST_AT_END, LIST_AT_START
-from c4de.sources.index import create_index, prepare_ordered_list
-from c4de.sources.infoboxer import reload_infoboxes, load_infoboxes
-from c4de.sources.parsing import fix_template_redirects
-from c4de.sources.updates import get_future_products_list, handle_results, search_for_missing
+    check_target_url, compile_tracked_urls, check_title_formatting, check_hunters_news, check_ilm, check_audible, \
+    isolate_cache, merge_cache, FEEDS, BoundedSet, load_rss_cache, dump_rss_cache
+
+from c4de.sources.archive import ArchiveCache, create_archive_categories
+from c4de.sources.updates import get_future_products_list, handle_results
+from c4de.sources.worker import SourcesEngine, SourcesClient
 
 import logging
 
@@ -70,6 +69,13 @@ UPDATES = "star-wars-news"
 SITE_URL = "https://starwars.fandom.com/wiki"
 SIMPLE_TITLE = "<h1.*?>(.*?)</h1>"
 
+RSS_WORKERS = 8
+RSS_HOST_LIMIT = 2
+RSS_SITE_TIMEOUT = 180
+# StarWars.com's check includes the full site map comparison
+RSS_SITE_MAP_TIMEOUT = 400
+RSS_SWEEP_BUDGET = 420
+
 THUMBS_UP = "👍"
 THUMBS_DOWN = "👎"
 TIMER = "⏲️"
@@ -85,6 +91,17 @@ REPOSTS = ["Ahsoka", "Skeleton Crew", "Obi-Wan Kenobi", "Rebels", "Resistance",
            "Rogue One", "Rogue One: A Story", "LEGO Star Wars: Rebuild the Galaxy"]
 
 
+# kept apart from the sources engine's cache, since that may be running in a separate process
+SITE_ARCHIVES = ArchiveCache("c4de/data/site_archive_cache.json")
+
+
+def parse_site_archive(text, _):
+    archive = {}
+    for u, d in re.findall(r"\[['\"](.*?)['\"]] ?= ?['\"]?([0-9]+)/?['\"]?", text):
+        archive[u.replace("\\'", "'")] = d
+    return archive
+
+
 # noinspection PyPep8Naming
 class C4DE_Bot(commands.Bot):
     """
@@ -92,17 +109,16 @@ class C4DE_Bot(commands.Bot):
     :type channels: dict[str, GuildChannel]
     :type emoji_storage: dict[str, int]
     :type rss_data: dict[str, dict]
-    :type internal_rss_cache: dict[str, list[str]]
-    :type external_rss_cache: dict[str, dict[str, list[str]]]
+    :type internal_rss_cache: dict[str, BoundedSet]
+    :type external_rss_cache: dict[str, dict[str, BoundedSet]]
     :type board_nominations: dict[str, dict]
     :type policy_updates: dict[str, list[str]]
     :type rights_cache: dict[str, list[str]]
-    :type appearances: FullListData
-    :type sources: FullListData
+    :type engine: SourcesEngine | SourcesClient
     :type report_dm: discord.DMChannel
     """
 
-    def __init__(self, *, rss_only=False, loop=None, **options):
+    def __init__(self, *, rss_only=False, sources_worker: SourcesClient = None, loop=None, **options):
         intents = Intents.default()
         intents.members = True
         super().__init__("", loop=loop, intents=intents, log_handler=None, **options)
@@ -138,45 +154,29 @@ class C4DE_Bot(commands.Bot):
         self.should_archive = True
 
         self.report_dm = None
-
-        with open(INTERNAL_RSS_CACHE, "r") as f:
-            self.internal_rss_cache = json.load(f)
-
-        with open(EXTERNAL_RSS_CACHE, "r") as f:
-            self.external_rss_cache = json.load(f)
-
-        with open(BOARD_CACHE, "r") as f:
-            self.board_nominations = json.load(f)
-
-        with open(POLICY_CACHE, "r") as f:
-            self.policy_updates = json.load(f)
-
-        with open(RIGHTS_CACHE, "r") as f:
-            self.rights_cache = json.load(f)
-
-        with open(ADMIN_CACHE, "r") as f:
-            self.admin_messages = {int(k): v for k, v in json.load(f).items()}
-
-        with open(EDELWEISS_CACHE, "r") as f:
-            self.edelweiss_cache = json.load(f)
-
-        with open(INDEX_CACHE, "r") as f:
-            self.index_cache = json.load(f)
+        self.rss_executor = ThreadPoolExecutor(max_workers=RSS_WORKERS, thread_name_prefix="rss")
+        self.rss_host_limits = {}
+        self.blocking = BlockingRunner()
+        self.analysis_queue = AnalysisQueue(self.blocking)
+
+        self.state = StateStore()
+        self.internal_rss_cache = load_rss_cache(self.state.load("internal_rss", INTERNAL_RSS_CACHE, 2))
+        self.external_rss_cache = load_rss_cache(self.state.load("external_rss", EXTERNAL_RSS_CACHE, 2))
+        self.board_nominations = self.state.load("board", BOARD_CACHE)
+        self.policy_updates = self.state.load("policy", POLICY_CACHE)
+        self.rights_cache = self.state.load("rights", RIGHTS_CACHE)
+        self.admin_messages = {int(k): v for k, v in self.state.load("admin", ADMIN_CACHE).items()}
+        self.edelweiss_cache = self.state.load("edelweiss", EDELWEISS_CACHE)
+        self.index_cache = self.state.load("index", INDEX_CACHE)
 
         self.overdue_cts = []
         self.project_data = {}
         self.files_to_be_renamed = []
-        self.source_rev_ids = {}
 
-        self.infoboxes = {}
-        self.templates = {}
-        self.disambigs = []
+        # the sources engine runs in this process, unless a client for a separate worker process is given
+        self.engine = sources_worker or SourcesEngine(self.site)
         self.tracked_urls = []
         self.redirect_messages = {}
-        self.appearances = None
-        self.sources = None
-        self.remap = None
-        self.auto_cats = []
         self.maintenance_cats = []
 
         self.last_ran = {}
@@ -184,8 +184,16 @@ class C4DE_Bot(commands.Bot):
     def reload_site(self):
         self.site = Site(user="C4-DE Bot")
         self.site.login()
+        if isinstance(getattr(self, "engine", None), SourcesEngine):
+            self.engine.site = self.site
         return self.site
 
+    async def close(self):
+        self.analysis_queue.stop()
+        self.blocking.shutdown()
+        self.rss_executor.shutdown(wait=False, cancel_futures=True)
+        await super().close()
+
     async def on_ready(self):
         log(f'C4-DE on as {self.user}!')
 
@@ -239,7 +247,8 @@ class C4DE_Bot(commands.Bot):
                 self.manage_archive.start()
                 self.check_edelweiss.start()
                 self.check_audible.start()
-                await self.build_sources()
+                if not await self.blocking.run("sources", self.engine.is_loaded):
+                    await self.build_sources()
                 self.check_index_requests.start()
             log("Startup process completed.")
             self.ready = True
@@ -328,6 +337,7 @@ class C4DE_Bot(commands.Bot):
         "rebuild sources": "build_sources",
         "reload sources": "build_sources",
         "future products": "handle_future_products",
+        "analysis queue": "report_analysis_queue",
     }
 
     @staticmethod
@@ -457,12 +467,12 @@ class C4DE_Bot(commands.Bot):
         channel = self.text_channel("bot-requests") if dm else message.channel
         if "edelweiss" in message.content.lower():
             self.run_edelweiss = False
-            messages, _ = run_edelweiss_protocol(self.site, self.edelweiss_cache)
+            messages, _ = await self.blocking.run("edelweiss", run_edelweiss_protocol, self.site, self.edelweiss_cache)
             for m in messages:
                 await channel.send(m)
             return True
         if "audible" in message.content.lower():
-            messages = check_audible(self.external_rss_cache["sites"])
+            messages = await self.blocking.run("web", check_audible, self.external_rss_cache["sites"])
             for m in messages:
                 await channel.send(m)
             return True
@@ -686,16 +696,6 @@ class C4DE_Bot(commands.Bot):
             raise Exception("Cannot load RSS data")
         self.project_data = data
 
-    def reload_infoboxes(self):
-        log("Loading infoboxes")
-        self.infoboxes = reload_infoboxes(self.site)
-
-    def reload_templates(self):
-        self.templates = reload_templates(self.site)
-
-    def reload_auto_categories(self):
-        self.auto_cats = reload_auto_categories(self.site)
-
     def reload_maintenance_categories(self):
         self.maintenance_cats = [c.title() for c in Category(self.site, f"Category:Articles with maintenance templates").subcategories()]
         for cx in ["High", "Medium", "Low"]:
@@ -765,7 +765,7 @@ class C4DE_Bot(commands.Bot):
             for message in channel.history(limit=250).flatten():
                 if message.id == message_id:
                     if any("bb8thumbsup" in str(r.emoji) for r in message.reactions):
-                        subprocess.run(f"""cd {PROJECT_DIR}/robo & C:/Users/Michael/Envs/C4DE/Scripts/python replace.py {cmd} -summary:"Redirect fixes" -always""", shell=True)
+                        await self.blocking.run("scripts", subprocess.run, f"""cd {PROJECT_DIR}/robo & C:/Users/Michael/Envs/C4DE/Scripts/python replace.py {cmd} -summary:"Redirect fixes" -always""", shell=True)
                         await channel.send(f"Beginning replacement for {redirect} --> {target}")
                         self.redirect_messages.pop(message.id)
 
@@ -808,9 +808,9 @@ class C4DE_Bot(commands.Bot):
         if not (now.weekday() == 0 and now.hour == 4):
             return
 
-        category = Category(self.site, "Category:Articles with /Canon")
-        messages = [f"Beginning Canon/Legends swap for {len(list(category.articles()))} articles:", ""]
-        for page in category.articles():
+        articles = await self.blocking.run("wiki", lambda: list(Category(self.site, "Category:Articles with /Canon").articles()))
+        messages = [f"Beginning Canon/Legends swap for {len(articles)} articles:", ""]
+        for page in articles:
             y = f"- {page.title()}"
             if len(y) + len(messages[-1]) > 500:
                 messages.append(y)
@@ -819,14 +819,14 @@ class C4DE_Bot(commands.Bot):
 
         for m in messages:
             await self.text_channel("admin-help").send(m)
-        subprocess.run(f"""cd {PROJECT_DIR}/robo & {ENVIRONMENT_DIR}/Scripts/python switch_canon_legends.py""", shell=True)
+        await self.blocking.run("scripts", subprocess.run, f"""cd {PROJECT_DIR}/robo & {ENVIRONMENT_DIR}/Scripts/python switch_canon_legends.py""", shell=True)
 
     @staticmethod
     def is_check_archive_command(message: Message):
         return re.search(r"(check|manage|handle|store|retrieve) archive(date)?s", message.content.lower())
 
     async def handle_check_archive_command(self, message: Message, _):
-        self._manage_archive()
+        await self.blocking.run("scripts", self._manage_archive)
         await message.add_reaction(THUMBS_UP)
 
     @tasks.loop(minutes=60)
@@ -835,7 +835,7 @@ class C4DE_Bot(commands.Bot):
         if not now.hour == 15:
             return
 
-        self._manage_archive()
+        await self.blocking.run("scripts", self._manage_archive)
 
     def _manage_archive(self):
         log("Beginning archival cleanup")
@@ -887,84 +887,18 @@ class C4DE_Bot(commands.Bot):
         await message.remove_reaction(TIMER, self.user)
         await message.add_reaction(THUMBS_UP)
 
-    async def build_sources(self, _=None):
+    async def build_sources(self, message=None):
         try:
-            for p in Category(self.site, "Category:Wookieepedia Sources Project").articles():
-                self.source_rev_ids[p.title()] = p.latest_revision_id
-            self.templates = load_template_types(self.site)
-            self.auto_cats = load_auto_categories(self.site)
-            self.infoboxes = load_infoboxes(self.site)
-            self.disambigs = [p.title() for p in Category(self.site, "Disambiguation pages").articles() if "(disambiguation)" not in p.title()]
-            self.appearances = load_full_appearances(self.site, self.templates, False)
-            self.sources = load_full_sources(self.site, self.templates, False)
-            self.remap = load_remap(self.site)
-
-            self.build_missing_page()
+            await self.blocking.run("sources", self.engine.build, message is not None)
         except Exception as e:
             traceback.print_exc()
             await self.report_error("Sources rebuild", type(e), e)
 
-    def build_missing_page(self):
-        skip = LIST_AT_END + LIST_AT_START
-        skip += [c.title() for c in Category(self.site, "Category:Real-world attractions").articles(recurse=True)]
-        skip += [c.title() for c in Category(self.site, "Category:Real-world arcade games").articles()]
-        # skip += [c.title() for c in Category(self.site, "Category:Mobile games").articles(recurse=True)]
-        skip += [c.title() for c in Category(self.site, "Category:Web-based games").articles()]
-        skip += [c.title() for c in Category(self.site, "Category:Commercials").articles()]
-        skip += [c.title() for c in Category(self.site, "Category:RPGA adventures").articles()]
-
-        page = Page(self.site, "User:C4-DE Bot/Canon Missing")
-        text = "" if not page.exists() else page.get()
-        pages1, pages2 = [], []
-        for i in self.appearances.no_canon_index:
-            (pages2 if i.target in skip else pages1).append(i)
-
-        new_text = "\n".join(f"#{x.date}: {x.original}" for x in pages1)
-        if pages2:
-            new_text += "\n\n==Other==\n"
-            new_text += "\n".join(f"#{x.date}: {x.original}" for x in pages2)
-
-        if new_text != text:
-            page.put(new_text, "Recording items missing from the canon media timeline", botflag=False)
-
-        page = Page(self.site, "User:C4-DE Bot/Legends Missing")
-        text = "" if not page.exists() else page.get()
-        pages1, pages2 = [], []
-        for i in self.appearances.no_legends_index:
-            (pages2 if i.target in skip else pages1).append(i)
-
-        ex_rpg = [c.title() for c in Category(self.site, "Category:West End Games adventure supplements").articles()]
-        main, fiction, rpg = [], [], []
-        for x in pages1:
-            if x.target in ex_rpg:
-                rpg.append(f"#{x.date}: {x.original}")
-            elif x.template in ["WEGCite", "DarkStryder", "JournalCite", "GamerCite", "LivingForce", "WizCite", "WizardsCite", "FFG", "FFGXW", "DoD"]:
-                rpg.append(f"#{x.date}: {x.original}")
-                # rpg.append(f"#{x.date}: {x.timeline or 'N/A'}: {x.original}")
-            else:
-                main.append(f"#{x.date}: {x.original}")
-                # main.append(f"#{x.date}: {x.timeline or 'N/A'}: {x.original}")
-
-        nt = ["\n".join(main)]
-        if rpg:
-            nt.append("==RPG==\n" + "\n".join(rpg))
-        if pages2:
-            nt.append("==Other==\n" + "\n".join(f"#{x.date}: {x.original}" for x in pages2))
-        new_text = re.sub(r"\|reprint=[A-z0-9]+", "", "\n\n".join(nt))
-        if new_text != text:
-            page.put(new_text, "Recording items missing from the Legends media timeline", botflag=False)
-
-    def have_sources_changed(self):
-        for p in Category(self.site, "Category:Wookieepedia Sources Project").articles():
-            if p.title() in self.source_rev_ids and p.latest_revision_id != self.source_rev_ids[p.title()]:
-                return True
-
     @tasks.loop(minutes=30)
     async def check_for_sources_rebuild(self):
         try:
             log("Checking for source changes")
-            if self.have_sources_changed():
-                await self.build_sources()
+            await self.blocking.run("sources", self.engine.rebuild_changed_sources)
         except Exception as e:
             traceback.print_exc()
             await self.report_error("Sources rebuild", type(e), e)
@@ -1029,10 +963,11 @@ class C4DE_Bot(commands.Bot):
             old_text = target.get()
 
             await message.add_reaction(TIMER)
-            old_text, redirects = fix_template_redirects(target, old_text)
-            results = analyze_target_page(target, self.infoboxes, self.templates, self.disambigs, self.appearances,
-                                          self.sources, self.auto_cats, self.remap, old_text=old_text,
-                                          save=True, include_date=False, use_index=True, redirects=redirects)
+            # the revision ID stands in for old_text, so nominations of different revisions aren't coalesced
+            job = self.analysis_queue.submit(("nomination", target.title(), rev_id), NOMINATION,
+                                             f"Nomination: {target.title()}", self.engine.analyze_nomination,
+                                             target.title(), old_text)
+            old_text, results = await asyncio.shield(job.future)
             mcx = [c.title() for c in target.categories() if c.title() in self.maintenance_cats]
             await message.remove_reaction(TIMER, self.user)
             await message.add_reaction(self.emoji_by_name("bb8thumbsup"))
@@ -1066,6 +1001,14 @@ class C4DE_Bot(commands.Bot):
             await message.add_reaction(EXCLAMATION)
             await message.channel.send("Encountered error while analyzing page")
 
+    async def report_queue_position(self, message: Message, job):
+        ahead = self.analysis_queue.position(job)
+        if job.started is None and ahead:
+            await message.channel.send(f"Request queued behind {ahead} other job{'s' if ahead > 1 else ''}")
+
+    async def report_analysis_queue(self, message: Message):
+        await message.channel.send(self.analysis_queue.report())
+
     def add_objections(self, command: dict, mcx):
         try:
             nom_page = Page(self.site, command['nom_page'])
@@ -1096,9 +1039,11 @@ class C4DE_Bot(commands.Bot):
             use_index = command.get('text') is None
 
             await message.add_reaction(TIMER)
-            results = analyze_target_page(target, self.infoboxes, self.templates, self.disambigs, self.appearances,
-                                          self.sources, self.auto_cats, self.remap,
-                                          save=True, include_date=use_date, use_index=use_index)
+            job = self.analysis_queue.submit(
+                ("analyze", target.title(), use_date, use_index), INTERACTIVE, f"Analyze sources: {target.title()}",
+                self.engine.analyze, target.title(), include_date=use_date, use_index=use_index)
+            await self.report_queue_position(message, job)
+            results = await asyncio.shield(job.future)
             await message.remove_reaction(TIMER, self.user)
 
             rev = next(target.revisions(content=False, total=1))
@@ -1134,14 +1079,10 @@ class C4DE_Bot(commands.Bot):
                 target = target.getRedirectTarget()
 
             await message.add_reaction(TIMER)
-            analysis = get_analysis_from_page(target, self.infoboxes, self.templates, self.disambigs, self.appearances,
-                                              self.sources, self.auto_cats, self.remap, False, False)
-
-            results = prepare_ordered_list(analysis)
-            page = Page(self.site, f"User:C4-DE Bot/Timeline Request")
-            text = f"This is an listing of all Appearances and Sources for [[{target.title()}]], ordered by chronological release date.\n"
-            text += "\n".join(results)
-            page.put(text, "Completing ordering request", botflag=False)
+            job = self.analysis_queue.submit(("list", target.title()), INTERACTIVE, f"Create list: {target.title()}",
+                                             self.engine.build_ordered_list, target.title())
+            await self.report_queue_position(message, job)
+            await asyncio.shield(job.future)
             await message.remove_reaction(TIMER, self.user)
             await message.add_reaction(THUMBS_UP)
         except Exception as e:
@@ -1151,18 +1092,22 @@ class C4DE_Bot(commands.Bot):
             await message.add_reaction(EXCLAMATION)
             await message.channel.send("Encountered error while analyzing page")
 
+    def find_index_requests(self):
+        pages = []
+        for page in Category(self.site, "Index requests").articles():
+            if page.exists():
+                pages.append(page.getRedirectTarget() if page.isRedirectPage() else page)
+        return pages
+
     @tasks.loop(minutes=5)
     async def check_index_requests(self):
-        for page in Category(self.site, "Index requests").articles():
+        pages = await self.blocking.run("wiki", self.find_index_requests)
+        jobs = [(page, self.analysis_queue.submit(("index", page.title()), BACKGROUND, f"Index request: {page.title()}",
+                                                  self.engine.build_index, page.title())) for page in pages]
+        for page, job in jobs:
             try:
-                if page.exists():
-                    if page.isRedirectPage():
-                        page = page.getRedirectTarget()
-                    analysis = get_analysis_from_page(page, self.infoboxes, self.templates, self.disambigs, self.appearances,
-                                                      self.sources, self.auto_cats, self.remap, False, False)
-                    create_index(self.site, page, analysis, self.appearances.target, self.sources.target, True)
-                    self.add_index_to_page(page)
-
+                await asyncio.shield(job.future)
+                await self.blocking.run("wiki", self.add_index_to_page, page)
             except Exception as e:
                 await self.report_error("Index requests", type(e), e)
 
@@ -1191,14 +1136,15 @@ class C4DE_Bot(commands.Bot):
                         return
 
             await message.add_reaction(TIMER)
-            analysis = get_analysis_from_page(target, self.infoboxes, self.templates, self.disambigs, self.appearances,
-                                              self.sources, self.auto_cats, self.remap, False, False)
-            result, old_id = create_index(self.site, target, analysis, self.appearances.target, self.sources.target, True)
+            job = self.analysis_queue.submit(("index", target.title()), INTERACTIVE, f"Create index: {target.title()}",
+                                             self.engine.build_index, target.title())
+            await self.report_queue_position(message, job)
+            result_title, old_id = await asyncio.shield(job.future)
+            result = Page(self.site, result_title)
             await message.remove_reaction(TIMER, self.user)
             if message.author != self.user:
                 self.index_cache[target.title()] = (message.author.display_name, datetime.now().strftime("%Y-%m-%d"))
-                with open(INDEX_CACHE, "w") as f:
-                    f.writelines(json.dumps(self.index_cache, indent=4))
+                self.state.save("index", self.index_cache)
 
             ux = result.full_url().replace('%2F', '/').replace('%3A', ':')
             if old_id:
@@ -1244,8 +1190,8 @@ class C4DE_Bot(commands.Bot):
 
     async def handle_future_products(self, _):
         try:
-            results = get_future_products_list(self.site)
-            handle_results(self.site, results, [])
+            results = await self.blocking.run("wiki", get_future_products_list, self.site)
+            await self.blocking.run("wiki", handle_results, self.site, results, [])
             await self.build_sources()
         except Exception as e:
             traceback.print_exc()
@@ -1253,8 +1199,7 @@ class C4DE_Bot(commands.Bot):
 
     async def handle_missing_search(self):
         try:
-            results, _, collections = search_for_missing(self.site, self.appearances, self.sources)
-            handle_results(self.site, results, collections)
+            await self.blocking.run("sources", self.engine.search_missing)
             await self.build_sources()
         except Exception as e:
             traceback.print_exc()
@@ -1377,9 +1322,9 @@ class C4DE_Bot(commands.Bot):
     @tasks.loop(hours=4)
     async def check_senate_hall_threads(self):
         log("Archiving Senate Hall threads")
-        archive_stagnant_senate_hall_threads(self.site, self.timezone_offset)
+        await self.blocking.run("wiki", archive_stagnant_senate_hall_threads, self.site, self.timezone_offset)
 
-        r = requests.get("https://www.starwars.com/star-wars-galaxy-map")
+        r = await self.blocking.run("web", requests.get, "https://www.starwars.com/star-wars-galaxy-map", timeout=60)
         # current = "https://cdnvideo.dolimg.com/cdn_assets/ff2066584bf86e5376fdfc3b26f0479b8795c403.pdf"
         current = "https://cdnvideo.dolimg.com/cdn_assets/02834527f17e4165d39a069a88161e5e330cd883.pdf"
         current_image = "https://lumiere-a.akamaihd.net/v1/images/star_wars_galaxy_map_4000x4000_20250625_ccff9272.jpeg"
@@ -1394,14 +1339,15 @@ class C4DE_Bot(commands.Bot):
         if datetime.now().hour != 6:
             return
         log("Scheduled Operation: Updating unused files and double redirects")
-        self.update_unused_files()
-        self.fix_double_redirects()
+        await self.blocking.run("wiki", self.update_unused_files)
+        await self.blocking.run("wiki", self.fix_double_redirects)
 
         log("Scheduled Operation: Checking {{Spoiler}} templates")
-        for page in Category(self.site, "Articles with expired spoiler notices").articles(namespaces=0):
+        pages = await self.blocking.run("wiki", lambda: list(Category(self.site, "Articles with expired spoiler notices").articles(namespaces=0)))
+        for page in pages:
             try:
-                tv_dates, default_show = self.extract_tv_spoiler_data()
-                remove_spoiler_tags_from_page(self.site, page, tv_dates, default_show, offset=self.timezone_offset)
+                tv_dates, default_show = await self.blocking.run("wiki", self.extract_tv_spoiler_data)
+                await self.blocking.run("wiki", remove_spoiler_tags_from_page, self.site, page, tv_dates, default_show, offset=self.timezone_offset)
             except Exception as e:
                 error_log(f"Encountered {type(e)} while removing spoiler template from {page.title()}", e)
                 await self.text_channel(COMMANDS).send(f"Encountered {type(e)} while removing expired spoiler template from {page.title()}. Please check template usage for anomalies.")
@@ -1421,9 +1367,12 @@ class C4DE_Bot(commands.Bot):
     async def load_isbns(self):
         if datetime.now().hour != 7:
             if not self.maintenance_cats:
-                self.reload_maintenance_categories()
+                await self.blocking.run("wiki", self.reload_maintenance_categories)
                 log(f"{len(self.maintenance_cats)} maintenance categories")
             return
+        await self.blocking.run("sources", self.reload_isbns)
+
+    def reload_isbns(self):
         page = Page(self.site, "Template:ISBN/data")
         last_revision = next(r for r in page.revisions(reverse=True, total=10) if r["user"] == "JocastaBot")
         time_since_last_edit = (datetime.now() + timedelta(hours=self.timezone_offset)) - last_revision['timestamp']
@@ -1432,10 +1381,10 @@ class C4DE_Bot(commands.Bot):
             return
         log("Scheduled Operation: Calculating ISBNs")
         calculate_isbns_for_all_pages(self.site)
-        self.reload_infoboxes()
-        self.reload_auto_categories()
+        self.engine.reload_infoboxes()
+        self.engine.reload_auto_categories()
         self.reload_maintenance_categories()
-        self.reload_templates()
+        self.engine.reload_templates()
         log(f"{len(self.maintenance_cats)} maintenance categories")
 
     @tasks.loop(hours=1)
@@ -1448,12 +1397,11 @@ class C4DE_Bot(commands.Bot):
             self.run_edelweiss = True
             return
         log("Scheduled Operation: Checking Edelweiss")
-        messages, reprints = run_edelweiss_protocol(self.site, self.edelweiss_cache, True)
+        messages, reprints = await self.blocking.run("edelweiss", run_edelweiss_protocol, self.site, self.edelweiss_cache, True)
         if reprints:
             messages.append("Errors encountered while adding reprint ISBNs to pages:")
             messages += reprints
-        with open(EDELWEISS_CACHE, "w") as f:
-            f.writelines(json.dumps(self.edelweiss_cache))
+        self.state.save("edelweiss", self.edelweiss_cache)
         for m in messages:
             try:
                 await self.text_channel(UPDATES).send(m)
@@ -1467,12 +1415,12 @@ class C4DE_Bot(commands.Bot):
     @tasks.loop(minutes=30)
     async def check_policy(self):
         if self.refresh == 2:
-            self.reload_site()
+            await self.blocking.run("wiki", self.reload_site)
             self.refresh = 0
         else:
             self.refresh += 1
 
-        updates = check_policy(self.site)
+        updates = await self.blocking.run("wiki", check_policy, self.site)
         messages = []
         for date, posts in updates.items():
             for post in posts:
@@ -1485,13 +1433,12 @@ class C4DE_Bot(commands.Bot):
 
         self.policy_updates = {d: [l['link'] for l in v] for d, v in updates.items()}
 
-        with open(POLICY_CACHE, "w") as f:
-            f.writelines(json.dumps(self.policy_updates, indent=4))
+        self.state.save("policy", self.policy_updates)
 
     @tasks.loop(minutes=15)
     async def check_membership_nominations(self):
         log("Checking board membership nominations")
-        current_nominations, interested = check_review_board_nominations(self.site)
+        current_nominations, interested = await self.blocking.run("wiki", check_review_board_nominations, self.site)
         messages = []
         for board, noms in current_nominations.items():
             for user in noms:
@@ -1525,13 +1472,12 @@ class C4DE_Bot(commands.Bot):
 
         self.board_nominations = {"Nominations": current_nominations, "Interested": interested}
 
-        with open(BOARD_CACHE, "w") as f:
-            f.writelines(json.dumps(self.board_nominations, indent=4))
+        self.state.save("board", self.board_nominations)
 
     @tasks.loop(minutes=15)
     async def check_rights_nominations(self):
         log("Checking user rights nominations")
-        current_nominations = check_user_rights_nominations(self.site)
+        current_nominations = await self.blocking.run("wiki", check_user_rights_nominations, self.site)
         messages = []
         for right, noms in current_nominations.items():
             for user in noms:
@@ -1547,13 +1493,12 @@ class C4DE_Bot(commands.Bot):
 
         self.rights_cache = current_nominations
 
-        with open(RIGHTS_CACHE, "w") as f:
-            f.writelines(json.dumps(self.rights_cache, indent=4))
+        self.state.save("rights", self.rights_cache)
 
     @tasks.loop(minutes=30)
     async def check_consensus_statuses(self):
         log("Checking status of active Consensus Track and Trash Compactor votes")
-        cts_and_tcs = check_consensus_duration(self.site, self.timezone_offset)
+        cts_and_tcs = await self.blocking.run("wiki", check_consensus_duration, self.site, self.timezone_offset)
         overdue = []
         for page, duration in cts_and_tcs.items():
             if page in self.overdue_cts or duration.days >= 14:
@@ -1579,14 +1524,31 @@ class C4DE_Bot(commands.Bot):
         for i in remove:
             self.admin_messages.pop(i)
 
-        with open(ADMIN_CACHE, "w") as f:
-            f.writelines(json.dumps(self.admin_messages, indent=4))
+        self.state.save("admin", self.admin_messages)
 
     CHANNEL_FILTERS = {
         "the-high-republic": ["high republic"],
         "galaxys-edge": ["galaxys edge", "galaxy's edge", "halcyon", "galactic starcruiser"]
     }
 
+    def archive_bot_requests(self, requests_to_archive):
+        page = Page(self.site, "Wookieepedia:Bot requests/Archive/Discord")
+        text = page.get() if page.exists() else ""
+        today = datetime.now().strftime("%B %d, %Y")
+        if f"=={today}==" not in text:
+            text += f"\n\n=={today}=="
+        users = {}
+        for author, created_at, content in requests_to_archive:
+            if author not in users:
+                if Page(self.site, f"User:{author}").exists():
+                    users[author] = "{{U|" + author + "}}"
+                else:
+                    users[author] = author
+            d = created_at.strftime("%H:%M, %B %d %Y")
+            t = f"*{d}: '''{users[author]}''': <nowiki>{content}</nowiki>"
+            text += f"\n{t}"
+        page.put(text, "Archiving completed bot requests from Discord", force=True, botflag=False)
+
     @tasks.loop(minutes=30)
     async def check_bot_requests(self):
         log("Checking bot requests")
@@ -1600,30 +1562,16 @@ class C4DE_Bot(commands.Bot):
                     await self.report_error(f"Bot Request Archival: {e}", type(e), e)
 
             if messages:
-                page = Page(self.site, "Wookieepedia:Bot requests/Archive/Discord")
-                text = page.get() if page.exists() else ""
-                today = datetime.now().strftime("%B %d, %Y")
-                if f"=={today}==" not in text:
-                    text += f"\n\n=={today}=="
-                users = {}
-                for m in reversed(messages):
-                    if m.author.display_name != "Wiki-Bot" and m.author != self.user:
-                        if m.author.display_name not in users:
-                            if Page(self.site, f"User:{m.author.display_name}").exists():
-                                users[m.author.display_name] = "{{U|" + m.author.display_name + "}}"
-                            else:
-                                users[m.author.display_name] = m.author.display_name
-                        d = m.created_at.strftime("%H:%M, %B %d %Y")
-                        t = f"*{d}: '''{users[m.author.display_name]}''': <nowiki>{m.content}</nowiki>"
-                        text += f"\n{t}"
-                page.put(text, "Archiving completed bot requests from Discord", force=True, botflag=False)
+                requests_to_archive = [(m.author.display_name, m.created_at, m.content) for m in reversed(messages)
+                                       if m.author.display_name != "Wiki-Bot" and m.author != self.user]
+                await self.blocking.run("wiki", self.archive_bot_requests, requests_to_archive)
 
                 for m in messages:
                     try:
                         await m.delete()
-                        time.sleep(2)
+                        await asyncio.sleep(2)
                     except HTTPException:
-                        time.sleep(5)
+                        await asyncio.sleep(5)
                         try:
                             await m.delete()
                         except Exception:
@@ -1637,22 +1585,21 @@ class C4DE_Bot(commands.Bot):
     @tasks.loop(minutes=60)
     async def check_empty_usage_categories(self):
         try:
-            clean_up_archive_categories(self.site)
+            await self.blocking.run("wiki", clean_up_archive_categories, self.site)
         except TimeoutError:
             pass
         except Exception as e:
             await self.report_error(f"Usage Categories: {e}", type(e), e)
 
+    def find_deleted_pages(self, messages: dict):
+        return [message_id for message_id, title in messages.items() if not Page(self.site, title).exists()]
+
     @tasks.loop(minutes=15)
     async def check_deleted_pages(self):
         log("Checking deleted pages")
 
         try:
-            update = []
-            for message_id, title in self.admin_messages.items():
-                p = Page(self.site, title)
-                if not p.exists():
-                    update.append(message_id)
+            update = await self.blocking.run("wiki", self.find_deleted_pages, dict(self.admin_messages))
             if not update:
                 return
 
@@ -1662,10 +1609,10 @@ class C4DE_Bot(commands.Bot):
                         await message.edit(content=f"~~{message.content}~~ (completed)")
                         self.admin_messages.pop(message.id)
                         update.remove(message.id)
-                        time.sleep(1)
+                        await asyncio.sleep(1)
                 except discord.errors.HTTPException as e:
                     if "rate limit" in str(e):
-                        time.sleep(5)
+                        await asyncio.sleep(5)
                     elif "Maximum number of edits" in str(e):
                         await message.add_reaction(self.emoji_by_name("GNK"))
                     else:
@@ -1677,34 +1624,36 @@ class C4DE_Bot(commands.Bot):
                 log(f"Could not find messages {update} in #{ADMIN_REQUESTS} to update")
                 for k in update:
                     self.admin_messages.pop(k)
-            with open(ADMIN_CACHE, "w") as f:
-                f.writelines(json.dumps(self.admin_messages, indent=4))
+            self.state.save("admin", self.admin_messages)
         except TimeoutError:
             pass
         except Exception as e:
             await self.report_error(f"Deleted Pages: {e}", type(e), e)
 
+    @staticmethod
+    def describe_rename_request(f: Page):
+        x = re.search(r"\{\{(FileRenameRequest|FTBR)\|.*\|(.*?)}}", f.get())
+        new_name_text = f" to **{x.group(2)}**" if x else ""
+        return f"⚠️ **{f.lastNonBotUser()}** requested [**{f.title()}**](<{f.full_url()}>) be renamed{new_name_text}\n"
+
     @tasks.loop(minutes=15)
     async def check_files_to_be_renamed(self):
         log("Checking FTBR")
 
         try:
-            files = [p for p in Category(self.site, "Files to be renamed").articles()]
+            files = await self.blocking.run("wiki", lambda: list(Category(self.site, "Files to be renamed").articles()))
             new_files = []
             for f in files:
                 try:
                     if f.title() not in self.files_to_be_renamed:
-                        x = re.search(r"\{\{(FileRenameRequest|FTBR)\|.*\|(.*?)}}", f.get())
-                        new_name_text = f" to **{x.group(2)}**" if x else ""
-                        m = f"⚠️ **{f.lastNonBotUser()}** requested [**{f.title()}**](<{f.full_url()}>) be renamed{new_name_text}\n"
+                        m = await self.blocking.run("wiki", self.describe_rename_request, f)
                         msg = await self.text_channel(ADMIN_REQUESTS).send(m)
                         self.admin_messages[msg.id] = f.title()
                 except Exception as e:
                     await self.report_error(f"FTBR: {f.title()}", type(e), e)
 
             self.files_to_be_renamed = [f.title() for f in files]
-            with open(ADMIN_CACHE, "w") as f:
-                f.writelines(json.dumps(self.admin_messages, indent=4))
+            self.state.save("admin", self.admin_messages)
         except Exception as e:
             await self.report_error(f"FTBR: {e}", type(e), e)
 
@@ -1713,7 +1662,8 @@ class C4DE_Bot(commands.Bot):
         log("Checking internal RSS feeds")
 
         try:
-            messages_to_post, to_delete = check_wookieepedia_feeds(self.site, self.internal_rss_cache)
+            feeds = []
+            messages_to_post, to_delete = await self.blocking.run("wiki", check_wookieepedia_feeds, self.site, self.internal_rss_cache, feeds)
         except Exception as e:
             await self.report_error(f"Encountered {type(e)} while checking internal RSS", e)
             return
@@ -1726,10 +1676,10 @@ class C4DE_Bot(commands.Bot):
             except Exception as e:
                 await self.report_error(f"RSS: {message}", type(e), e)
 
-        with open(ADMIN_CACHE, "w") as f:
-            f.writelines(json.dumps(self.admin_messages, indent=4))
-        with open(INTERNAL_RSS_CACHE, "w") as f:
-            f.writelines(json.dumps({k: v[-50:] for k, v in self.internal_rss_cache.items()}, indent=4))
+        self.state.save("admin", self.admin_messages)
+        # the feeds' new validators are only kept once their entries are recorded as reported
+        if self.state.save("internal_rss", self.internal_rss_cache, 2, dump_rss_cache):
+            FEEDS.commit(*feeds)
 
     async def handle_target_url_check(self, message: Message, command: dict):
         if "starwars.com" not in command['url']:
@@ -1886,37 +1836,44 @@ class C4DE_Bot(commands.Bot):
             await message.add_reaction(EXCLAMATION)
         await message.remove_reaction(TIMER, self.user)
 
-    async def check_sites(self, site, site_data, messages_to_post, db_archive, templates, new_db_entries, custom_date=None):
+    def fetch_site_messages(self, site, site_data, cache):
+        """ Checks the given site for new posts. This blocks, so it runs on the RSS worker pool. """
         db = None
         title = site_data.get("title", SIMPLE_TITLE)
         if site == "StarWars.com":
-            messages = check_sw_news_page(site_data["url"], self.external_rss_cache["sites"], title)
+            messages = check_sw_news_page(site_data["url"], cache, title)
             try:
                 if not self.tracked_urls:
                     self.tracked_urls = compile_tracked_urls(self.site)
                 other, db = compare_site_map(self.site, ["star-wars-maul-shadow-lord"], messages, self.tracked_urls)
                 for x in other:
-                    if x["url"] not in self.external_rss_cache["sites"]["StarWars.com"]:
+                    if x["url"] not in cache["StarWars.com"]:
                         messages.append(x)
             except Exception as e:
                 error_log(f"Encountered {type(e).__name__} while checking site map")
         elif site_data["template"] == "UnlimitedWeb":
-            messages = check_unlimited(site, site_data["baseUrl"], site_data["rss"], self.external_rss_cache["sites"])
+            messages = check_unlimited(site, site_data["baseUrl"], site_data["rss"], cache)
         elif site_data["template"] == "AtomicMassGames":
-            messages = check_blog_list(site, site_data["baseUrl"], site_data["rss"], self.external_rss_cache["sites"])
+            messages = check_blog_list(site, site_data["baseUrl"], site_data["rss"], cache)
         elif site_data["template"] == "ILM":
-            messages = check_ilm(site, site_data["baseUrl"], site_data["rss"], self.external_rss_cache["sites"])
+            messages = check_ilm(site, site_data["baseUrl"], site_data["rss"], cache)
         elif site_data["template"] == "Ubisoft":
-            messages = check_ubisoft_news(site, site_data["baseUrl"], site_data["rss"], self.external_rss_cache["sites"])
+            messages = check_ubisoft_news(site, site_data["baseUrl"], site_data["rss"], cache)
         elif site_data["template"] == "Hunters":
-            messages = check_hunters_news(site, site_data["baseUrl"], site_data["rss"], self.external_rss_cache["sites"])
+            messages = check_hunters_news(site, site_data["baseUrl"], site_data["rss"], cache)
         elif site_data["template"] == "EA":
-            messages = check_ea_news(site, site_data["baseUrl"], site_data["rss"], self.external_rss_cache["sites"])
+            messages = check_ea_news(site, site_data["baseUrl"], site_data["rss"], cache)
         elif site_data.get("url"):
-            messages = check_latest_url(site_data["url"], self.external_rss_cache["sites"], site, title)
+            messages = check_latest_url(site_data["url"], cache, site, title)
         else:
-            messages = check_rss_feed(site_data["rss"], self.external_rss_cache["sites"], site, title,
-                                      site_data.get("nonSW", False))
+            messages = check_rss_feed(site_data["rss"], cache, site, title, site_data.get("nonSW", False))
+        return messages, db
+
+    async def check_sites(self, site, site_data, messages_to_post, db_archive, templates, new_db_entries, custom_date=None, results=None):
+        if results is None:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.rss_executor, self.fetch_site_messages, site, site_data, self.external_rss_cache["sites"])
+        messages, db = results
 
         archive = self.parse_archive(site_data["template"])
         for m in reversed(messages):
@@ -1934,14 +1891,45 @@ class C4DE_Bot(commands.Bot):
             self.tracked_urls = compile_tracked_urls(self.site)
         return db
 
+    async def run_rss_checks(self, jobs: list) -> dict:
+        """ Runs the given (key, url, timeout, function, args) checks concurrently on the RSS worker pool, at most
+        RSS_HOST_LIMIT at a time per host. Checks that fail, exceed their timeout, or haven't finished by the end of the
+        sweep's time budget are logged and left out of the results. A check that times out keeps its host's slot until
+        its thread actually finishes, even across sweeps, so hung checks can't pile up on the pool. """
+        loop = asyncio.get_running_loop()
+
+        async def run(url, timeout, func, args):
+            host = parse.urlparse(url or "").netloc
+            if host not in self.rss_host_limits:
+                self.rss_host_limits[host] = asyncio.Semaphore(RSS_HOST_LIMIT)
+            limit = self.rss_host_limits[host]
+            await limit.acquire()
+            future = loop.run_in_executor(self.rss_executor, func, *args)
+            future.add_done_callback(lambda _: limit.release())
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+        tasks = {key: asyncio.create_task(run(url, timeout, func, args)) for key, url, timeout, func, args in jobs}
+        if not tasks:
+            return {}
+        done, pending = await asyncio.wait(tasks.values(), timeout=RSS_SWEEP_BUDGET)
+        results = {}
+        for key, task in tasks.items():
+            if task in pending:
+                task.cancel()
+                error_log(f"RSS check for {key[1]} did not finish within {RSS_SWEEP_BUDGET} seconds", tb=False)
+            elif task.exception():
+                error_log(f"Encountered {type(task.exception())} while checking RSS for {key[1]}", task.exception(), tb=False)
+            else:
+                results[key] = task.result()
+        return results
+
     @tasks.loop(hours=1)
     async def check_audible(self):
         if datetime.now().hour != 13:
             return
         log("Scheduled Operation: Checking Audible")
-        messages = check_audible(self.external_rss_cache["sites"])
-        with open(EXTERNAL_RSS_CACHE, "w") as f:
-            f.writelines(json.dumps({k: {i: c[-250:] for i, c in v.items()} for k, v in self.external_rss_cache.items()}, indent=4))
+        messages = await self.blocking.run("web", check_audible, self.external_rss_cache["sites"])
+        self.state.save("external_rss", self.external_rss_cache, 2, dump_rss_cache)
         for m in messages:
             try:
                 await self.text_channel(UPDATES).send(m)
@@ -1959,20 +1947,44 @@ class C4DE_Bot(commands.Bot):
         db_archive = self.parse_archive("Databank")
         new_db_entries = []
         updated_db_entries = {}
+
+        # Each check gets its own copy of its site's cache, which is only kept if the results are posted
+        jobs, caches, urls = [], {}, {}
+        for site, site_data in self.rss_data["sites"].items():
+            caches[("sites", site)] = isolate_cache(self.external_rss_cache["sites"], site)
+            url = site_data.get("url") or site_data.get("rss") or site_data.get("baseUrl")
+            urls[("sites", site)] = url
+            timeout = RSS_SITE_MAP_TIMEOUT if site == "StarWars.com" else RSS_SITE_TIMEOUT
+            jobs.append((("sites", site), url, timeout, self.fetch_site_messages, (site, site_data, caches[("sites", site)])))
+        for site, site_data in self.rss_data["YouTube"].items():
+            caches[("YouTube", site)] = isolate_cache(self.external_rss_cache["YouTube"], site)
+            url = f"https://www.youtube.com/feeds/videos.xml?channel_id={site_data['channelId']}"
+            urls[("YouTube", site)] = url
+            jobs.append((("YouTube", site), url, RSS_SITE_TIMEOUT, check_rss_feed,
+                         (url, caches[("YouTube", site)], site, "<h1 class=\"title.*?><.*?>(.*?)</.*?></h1>", site_data.get("nonSW", False))))
+        results = await self.run_rss_checks(jobs)
+        feeds = []
+
         for site, site_data in self.rss_data["sites"].items():
+            if ("sites", site) not in results:
+                continue
+            merge_cache(self.external_rss_cache["sites"], caches[("sites", site)], site)
+            feeds += [u for u in (urls[("sites", site)], site_data.get("rss")) if u]
             try:
-                updated_db_entries = await self.check_sites(site, site_data, messages_to_post, db_archive, templates, new_db_entries)
+                updated_db_entries = await self.check_sites(site, site_data, messages_to_post, db_archive, templates,
+                                                            new_db_entries, results=results[("sites", site)])
                 if updated_db_entries:
                     break
             except Exception as e:
                 error_log(f"Encountered {type(e)} while checking RSS for {site}", e)
 
         for site, site_data in self.rss_data["YouTube"].items():
+            if ("YouTube", site) not in results:
+                continue
+            merge_cache(self.external_rss_cache["YouTube"], caches[("YouTube", site)], site)
+            feeds.append(urls[("YouTube", site)])
             archive = self.parse_archive(site_data["template"])
-            messages = check_rss_feed(
-                f"https://www.youtube.com/feeds/videos.xml?channel_id={site_data['channelId']}",
-                self.external_rss_cache["YouTube"], site, "<h1 class=\"title.*?><.*?>(.*?)</.*?></h1>", site_data.get("nonSW", False))
-            for m in reversed(messages):
+            for m in reversed(results[("YouTube", site)]):
                 try:
                     msg, d, template = await self.prepare_new_rss_message(m, "https://www.youtube.com", site_data, True, archive)
                     messages_to_post += msg
@@ -1980,9 +1992,9 @@ class C4DE_Bot(commands.Bot):
                 except Exception as e:
                     error_log(type(e), e.args)
 
-        await self.report_rss_results(messages_to_post, templates, updated_db_entries, new_db_entries)
+        await self.report_rss_results(messages_to_post, templates, updated_db_entries, new_db_entries, feeds)
 
-    async def report_rss_results(self, messages_to_post, templates, updated_db_entries, new_db_entries):
+    async def report_rss_results(self, messages_to_post, templates, updated_db_entries, new_db_entries, feeds=None):
 
         for channel, message in messages_to_post:
             try:
@@ -1996,8 +2008,8 @@ class C4DE_Bot(commands.Bot):
         if updated_db_entries:
             await self.handle_updated_db_entries(updated_db_entries)
 
-        with open(EXTERNAL_RSS_CACHE, "w") as f:
-            f.writelines(json.dumps({k: {i: c[-250:] for i, c in v.items()} for k, v in self.external_rss_cache.items()}, indent=4))
+        if self.state.save("external_rss", self.external_rss_cache, 2, dump_rss_cache) and feeds:
+            FEEDS.commit(*feeds)
 
         if templates:
             await self.update_web_sources(templates)
@@ -2186,13 +2198,18 @@ class C4DE_Bot(commands.Bot):
             result = re.sub(r"Hunters\|url=.*?arena-news/", "ArenaNews|url=", result)
         return "{{" + result + "}}"
 
-    def get_archive_for_site(self, template):
+    @staticmethod
+    def archive_titles_for_site(template):
         if "youtube" in template.lower() or template in ["ThisWeek", "HighRepublicShow" "LegoMiniMovie"]:
             template = "YouTube"
-        page = Page(self.site, f"Template:{template}/Archive")
+        return f"Template:{template}/Archive", f"Module:ArchiveAccess/{template}"
+
+    def get_archive_for_site(self, template):
+        template_title, module_title = self.archive_titles_for_site(template)
+        page = Page(self.site, template_title)
         if page.exists():
             return page
-        return Page(self.site, f"Module:ArchiveAccess/{template}")
+        return Page(self.site, module_title)
 
     def add_urls_to_archive(self, template, new_url, archivedate):
         if template == "Hunters" and "arena-news" in new_url:
@@ -2217,15 +2234,12 @@ class C4DE_Bot(commands.Bot):
         except OtherPageSaveError:
             self.site.login()
             page.put(new_text, f"Archiving {archivedate} for new URL: {new_url}", botflag=False)
+        SITE_ARCHIVES.invalidate(page.title())
 
     def parse_archive(self, template):
-        page = self.get_archive_for_site(template)
-        if not page.exists():
-            return None
-        archive = {}
-        for u, d in re.findall(r"\[['\"](.*?)['\"]] ?= ?['\"]?([0-9]+)/?['\"]?", page.get()):
-            archive[u.replace("\\'", "'")] = d
-        return archive
+        titles = self.archive_titles_for_site(template)
+        archives = SITE_ARCHIVES.get_many(self.site, titles, parse_site_archive)
+        return next((archives[t] for t in titles if archives[t] is not None), None)
 
     @staticmethod
     def build_archive_template_text(text, new_url, archivedate):
@@ -0,0 +1,122 @@
+import asyncio
+import itertools
+import time
+
+from c4de.blocking import BlockingRunner
+from c4de.common import error_log
+
+ANALYSIS_WORKERS = 2
+INTERACTIVE = 0
+NOMINATION = 1
+BACKGROUND = 2
+
+
+class AnalysisJob:
+    def __init__(self, key, priority, description, func, args, kwargs, future: asyncio.Future):
+        self.key = key
+        self.priority = priority
+        self.description = description
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.queued = time.monotonic()
+        self.order = None
+        self.started = None
+
+
+class AnalysisQueue:
+    """ Queue for page analysis and index jobs, which runs them in priority order (interactive commands before
+    nominations before background index requests) on a fixed number of workers. Submitting a job with the same key as
+    one that's still pending returns the pending job's result instead of running it twice.
+
+    :type runner: BlockingRunner
+    :type pending: dict[tuple, AnalysisJob]
+    :type running: dict[int, AnalysisJob]
+    """
+
+    def __init__(self, runner: BlockingRunner, workers=ANALYSIS_WORKERS):
+        self.runner = runner
+        self.workers = workers
+        self.queue = None
+        self.tasks = []
+        self.pending = {}
+        self.running = {}
+        self.counter = itertools.count()
+
+    def start(self):
+        if self.tasks:
+            return
+        self.queue = asyncio.PriorityQueue()
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    def stop(self):
+        for t in self.tasks:
+            t.cancel()
+        self.tasks = []
+
+    def depth(self):
+        return len(self.pending)
+
+    def position(self, job: AnalysisJob):
+        """ Returns the number of waiting jobs that will start before the given one. """
+        return sum(1 for j in self.pending.values() if (j.priority, j.order) < (job.priority, job.order))
+
+    def submit(self, key, priority, description, func, *args, **kwargs):
+        """ Queues func(*args, **kwargs) to run on the blocking pool, and returns the job, whose future can be awaited
+        for the result. Identical pending jobs are coalesced, with the pending job taking the higher priority; a job
+        that has already started isn't reused, since the page may have changed since it began. """
+        self.start()
+        if key in self.pending:
+            job = self.pending[key]
+            if priority < job.priority:
+                job.priority = priority
+                self.enqueue(job)
+            return job
+
+        job = AnalysisJob(key, priority, description, func, args, kwargs, asyncio.get_running_loop().create_future())
+        self.pending[key] = job
+        self.enqueue(job)
+        return job
+
+    def enqueue(self, job: AnalysisJob):
+        job.order = next(self.counter)
+        self.queue.put_nowait((job.priority, job.order, job.key))
+
+    async def worker(self):
+        while True:
+            _, order, key = await self.queue.get()
+            try:
+                job = self.pending.get(key)
+                # stale entry left behind when a pending job's priority was raised
+                if job is None or job.order != order:
+                    continue
+                self.pending.pop(key)
+                self.running[order] = job
+                job.started = time.monotonic()
+                try:
+                    result = await self.runner.run("analysis", job.func, *job.args, **job.kwargs)
+                except asyncio.CancelledError:
+                    job.future.cancel()
+                    raise
+                except Exception as e:
+                    job.future.set_exception(e)
+                else:
+                    job.future.set_result(result)
+                finally:
+                    self.running.pop(order, None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error_log(f"Encountered {type(e)} in analysis queue", e)
+            finally:
+                self.queue.task_done()
+
+    def report(self):
+        now = time.monotonic()
+        lines = [f"{len(self.running)} running, {len(self.pending)} waiting"]
+        for job in self.running.values():
+            lines.append(f"- Running: {job.description} ({now - job.started:.0f}s)")
+        for job in sorted(self.pending.values(), key=lambda j: (j.priority, j.order)):
+            lines.append(f"- Waiting: {job.description} ({now - job.queued:.0f}s)")
+        return "\n".join(lines)
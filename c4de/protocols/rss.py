@@ -1,22 +1,260 @@
 from urllib import parse
 
+import codecs
+import os
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from typing import Dict, List
 import xml.etree.ElementTree as ET
 import feedparser
 import json
 import re
 import requests
+from requests.adapters import HTTPAdapter
 import html
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from pywikibot import Site, Page, Category, User
 
-from c4de.common import error_log, log
+from c4de.common import error_log, log, latest_revision_ids
 
 ANNOUNCEMENTS = "announcements"
 ADMIN_REQUESTS = "automated-reports"
 
+FETCH_TIMEOUT = 20
+POOL_HOSTS = 32
+POOL_CONNECTIONS_PER_HOST = 4
+
+
+def build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_CONNECTIONS_PER_HOST)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+SESSION = build_session()
+
+
+def fetch(url, timeout=FETCH_TIMEOUT, **kwargs) -> requests.Response:
+    """ GETs the given URL through the shared connection pool, with a timeout so that a stalled site can't hold up the
+    rest of the sweep. """
+    return SESSION.get(url, timeout=timeout, **kwargs)
+
+
+DEFAULT_RETENTION = 250
+RETENTION = {
+    "StarWars.com": 1000,
+    "Audible": 500,
+    # Current state rather than history; replaced in full on every check
+    "CSD": None,
+    "Protect": None,
+    "Autoblock": None,
+    "AbuseLog": None,
+}
+
+
+class BoundedSet:
+    """ Insertion-ordered set of the URLs (or other keys) seen on a feed, which keeps only the most recently added
+    max_size entries. Membership checks are constant-time regardless of the size. """
+
+    def __init__(self, items=(), max_size=DEFAULT_RETENTION):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        for x in items:
+            self.append(x)
+
+    def __contains__(self, x):
+        return x in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def append(self, x):
+        if x in self.items:
+            self.items.move_to_end(x)
+        else:
+            self.items[x] = None
+            if self.max_size is not None and len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def copy(self):
+        return BoundedSet(self.items, self.max_size)
+
+
+def seen_urls(key, items=()):
+    return BoundedSet(items, RETENTION.get(key, DEFAULT_RETENTION))
+
+
+def load_rss_cache(data: dict):
+    """ Converts the lists in a loaded RSS cache, including those in nested per-site dicts, to BoundedSets. """
+    for k, v in data.items():
+        if isinstance(v, list):
+            data[k] = seen_urls(k, v)
+        elif isinstance(v, dict):
+            load_rss_cache(v)
+    return data
+
+
+def dump_rss_cache(v):
+    """ Converts the RSS cache back to plain JSON data, with each BoundedSet stored as a list from oldest to newest. """
+    if isinstance(v, dict):
+        return {k: dump_rss_cache(x) for k, x in v.items()}
+    elif isinstance(v, BoundedSet):
+        return list(v)
+    return v
+
+
+def isolate_cache(cache: dict, site):
+    """ Copies the cache so that the given site's entries can be updated without affecting the original. """
+    isolated = dict(cache)
+    if isinstance(isolated.get(site), (list, BoundedSet)):
+        isolated[site] = isolated[site].copy()
+    return isolated
+
+
+def merge_cache(cache: dict, isolated: dict, site):
+    if site in isolated:
+        cache[site] = isolated[site]
+
+
+FEED_VALIDATORS = "c4de/data/feed_validators.json"
+
+
+class FeedFetcher:
+    """ Downloads and parses feeds, using conditional requests with the ETag and Last-Modified validators from the last
+    download of each feed. New validators only take effect once committed, which happens after the feed's entries have
+    been recorded in the RSS cache, so a 304 response can't hide entries that were never reported. """
+
+    def __init__(self, path=FEED_VALIDATORS):
+        self.path = path
+        self.validators = {}
+        self.pending = {}
+        self.lock = Lock()
+        try:
+            with open(path, "r") as f:
+                self.validators = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            error_log(f"Unable to load feed validators: {type(e)}: {e}", tb=False)
+
+    def get(self, url, timeout=FETCH_TIMEOUT):
+        """ Returns the parsed feed, or None if it's empty or hasn't changed since the last committed download. """
+        with self.lock:
+            validators = self.validators.get(url) or {}
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("modified"):
+            headers["If-Modified-Since"] = validators["modified"]
+
+        r = fetch(url, timeout=timeout, headers=headers)
+        if r.status_code == 304 or not r.content:
+            return None
+        if r.status_code == 200 and (r.headers.get("ETag") or r.headers.get("Last-Modified")):
+            with self.lock:
+                self.pending[url] = {"etag": r.headers.get("ETag"), "modified": r.headers.get("Last-Modified")}
+
+        response_headers = {k.lower(): v for k, v in r.headers.items()}
+        response_headers["content-location"] = r.url
+        return feedparser.parse(r.content, response_headers=response_headers)
+
+    def commit(self, *urls):
+        with self.lock:
+            urls = [u for u in urls if u in self.pending]
+            if not urls:
+                return
+            for url in urls:
+                self.validators[url] = self.pending.pop(url)
+            try:
+                with open(f"{self.path}.tmp", "w") as f:
+                    f.writelines(json.dumps(self.validators, indent=4))
+                os.replace(f"{self.path}.tmp", self.path)
+            except Exception as e:
+                error_log(f"Unable to save feed validators: {type(e)}: {e}", tb=False)
+
+
+FEEDS = FeedFetcher()
+
+
+PAGE_CHUNK_SIZE = 8192
+PAGE_CACHE_SIZE = 1000
+PAGE_CACHE_TTL = 6 * 3600
+
+
+class PageCache:
+    """ Bounded cache of the metadata extracted from article pages, so that entries seen again in later sweeps (e.g.
+    ones skipped as too old) don't need to be downloaded again. """
+
+    def __init__(self, max_size=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[0]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+PAGES = PageCache()
+
+
+def read_page(url, done=None, timeout=FETCH_TIMEOUT) -> str:
+    """ Streams the page's HTML, and stops downloading as soon as done() is satisfied by the text read so far. """
+    with fetch(url, timeout=timeout, stream=True) as r:
+        decoder = codecs.getincrementaldecoder(r.encoding or "utf-8")(errors="replace")
+        text = ""
+        for chunk in r.iter_content(PAGE_CHUNK_SIZE):
+            text += decoder.decode(chunk)
+            if done and done(text):
+                return text
+        return text + decoder.decode(b"", final=True)
+
+
+def found_line(pattern):
+    """ Whether the pattern has matched and the line containing the end of the match has been read in full. Title
+    patterns don't span lines, so the match is then the same as the one in the full page. """
+    def done(text):
+        m = pattern.search(text)
+        return m is not None and "\n" in text[m.end():]
+    return done
+
+
+def fetch_title(url, title_regex, title, timeout=FETCH_TIMEOUT):
+    """ Reads the article's title with the given pattern, only downloading as much of the page as needed. """
+    found, value = PAGES.get(("title", url, title_regex))
+    if not found:
+        pattern = re.compile(title_regex)
+        m = pattern.search(read_page(url, found_line(pattern), timeout=timeout))
+        value = m.group(1) if m else None
+        PAGES.put(("title", url, title_regex), value)
+    return clean_title(value if value is not None else title)
+
+
+def fetch_redirect_url(url, timeout=FETCH_TIMEOUT):
+    """ Follows any redirects from the URL, without downloading the final page. """
+    with fetch(url, timeout=timeout, stream=True) as r:
+        return r.url
+
 
 def fix_title(title: str):
     if title.count(":") >= 2 and (title.startswith("Wookieepedia") or title.startswith("Forum")):
@@ -48,7 +286,7 @@ def check_new_pages(site: Site, cache: Dict[str, List[str]], namespace):
 
             if pt:
                 if pt not in cache:
-                    cache[pt] = []
+                    cache[pt] = seen_urls(pt)
                 if url in cache[pt]:
                     continue
                 entries_to_report.append((ch, message, z))
@@ -84,7 +322,7 @@ def check_new_pages_rss_feed(site, url, cache: Dict[str, List[str]]):
 
             if pt:
                 if pt not in cache:
-                    cache[pt] = []
+                    cache[pt] = seen_urls(pt)
                 if e.link in cache[pt]:
                     continue
                 entries_to_report.append((ch, message, z))
@@ -116,11 +354,19 @@ def did_edit_add_deletion_template(site, title, description):
     return any("{{csd" in row[-1].lower() or "{{delete|" in row[-1].lower() for row in table_content if row)
 
 
-def parse_history_rss_feed(feed_url, cache: Dict[str, List[str]], feed_type):
+def parse_history_rss_feed(feed_url, cache: Dict[str, List[str]], feed_type, feeds: list = None):
+    """ Returns the feed's unreported entries. The feed's URL is added to feeds, so that the caller can commit its
+    validators once the updated cache has been saved. """
     if feed_type not in cache:
-        cache[feed_type] = []
+        cache[feed_type] = seen_urls(feed_type)
 
-    d = feedparser.parse(feed_url)
+    try:
+        d = FEEDS.get(feed_url)
+    except Exception as e:
+        error_log(f"Encountered {type(e)} while checking {feed_url}", e, tb=False)
+        return []
+    if d is None:
+        return []
 
     entries_to_report = []
     for e in d.entries:
@@ -129,10 +375,12 @@ def parse_history_rss_feed(feed_url, cache: Dict[str, List[str]], feed_type):
         entries_to_report.append(e)
         cache[feed_type].append(e.link)
 
+    if feeds is not None:
+        feeds.append(feed_url)
     return entries_to_report
 
 
-def check_wookieepedia_feeds(site: Site, cache: Dict[str, List[str]]):
+def check_wookieepedia_feeds(site: Site, cache: Dict[str, List[str]], feeds: list = None):
     messages = []
 
     to_delete = []
@@ -163,27 +411,27 @@ def check_wookieepedia_feeds(site: Site, cache: Dict[str, List[str]]):
     except Exception as e:
         error_log(type(e), e.args)
 
-    entries = parse_history_rss_feed("https://starwars.fandom.com/wiki/Wookieepedia:Bot_requests?action=history&feed=rss", cache, "Bot Requests")
+    entries = parse_history_rss_feed("https://starwars.fandom.com/wiki/Wookieepedia:Bot_requests?action=history&feed=rss", cache, "Bot Requests", feeds)
     for e in entries:
         diff = parse_bot_request_diff(e.description)
         diff_text = f"\n{diff}" if diff else ""
         messages.append(("bot-requests", f"🔧 **WP:BR** was edited by **{e.author}**: [view change](<{e.link}>)\n{diff_text}", None))
 
-    entries = parse_history_rss_feed("https://starwars.fandom.com/wiki/Forum:SH:General_bug_thread?action=history&feed=rss", cache, "Bug Thread")
+    entries = parse_history_rss_feed("https://starwars.fandom.com/wiki/Forum:SH:General_bug_thread?action=history&feed=rss", cache, "Bug Thread", feeds)
     for e in entries:
         diff = parse_bot_request_diff(e.description)
         diff_text = f"\n{diff}" if diff else ""
         messages.append((ADMIN_REQUESTS, f"🔧 **Forum:SH:General bug thread** was edited by **{e.author}**: [view change](<{e.link}>)\n{diff_text}", None))
 
-    entries = parse_history_rss_feed("https://starwars.fandom.com/wiki/Wookieepedia:Vandalism_in_progress?action=history&feed=rss", cache, "Vandalism")
+    entries = parse_history_rss_feed("https://starwars.fandom.com/wiki/Wookieepedia:Vandalism_in_progress?action=history&feed=rss", cache, "Vandalism", feeds)
     for e in entries:
         messages.append((ADMIN_REQUESTS, f"❗ **WP:VIP** was edited by **{e.author}**: [view change](<{e.link}>)", None))
 
-    entries = parse_history_rss_feed("https://starwars.fandom.com/wiki/Wookieepedia:Spamfilter_problems?action=history&feed=rss", cache, "Spamfilter")
+    entries = parse_history_rss_feed("https://starwars.fandom.com/wiki/Wookieepedia:Spamfilter_problems?action=history&feed=rss", cache, "Spamfilter", feeds)
     for e in entries:
         messages.append((ADMIN_REQUESTS, f"⚠️ **WP:SF** was edited by **{e.author}**: [view change](<{e.link}>)", None))
 
-    entries = parse_history_rss_feed("https://starwars.fandom.com/wiki/Wookieepedia:Image_requests?action=history&feed=rss", cache, "Image")
+    entries = parse_history_rss_feed("https://starwars.fandom.com/wiki/Wookieepedia:Image_requests?action=history&feed=rss", cache, "Image", feeds)
     for e in entries:
         messages.append(("images-and-audio", f"📷  **Wookieepedia:Image requests** was edited by **{e.author}**: [view change](<{e.link}>)", None))
 
@@ -205,7 +453,7 @@ def check_autoblocks(cache):
     results = []
     new_cache = []
     try:
-        r = requests.get("https://starwars.fandom.com/api.php?action=query&format=json&list=blocks&formatversion=2&bklimit=20&bkprop=id%7Cuser%7Cby%7Ctimestamp%7Cexpiry%7Creason%7Crange%7Cflags&bkshow=")
+        r = fetch("https://starwars.fandom.com/api.php?action=query&format=json&list=blocks&formatversion=2&bklimit=20&bkprop=id%7Cuser%7Cby%7Ctimestamp%7Cexpiry%7Creason%7Crange%7Cflags&bkshow=")
         for x in r.json()['query']['blocks']:
             if not x.get("automatic"):
                 continue
@@ -229,7 +477,7 @@ def check_abuse_log(site, cache):
     results = []
     new_cache = []
     try:
-        r = requests.get("https://starwars.fandom.com/api.php?action=query&format=json&list=abusefilters%7Cabuselog&formatversion=2&abflimit=200&aflfilter=&afllimit=100&aflprop=ids%7Cuser%7Ctitle%7Caction%7Cresult%7Ctimestamp%7Chidden%7Crevid%7Cfilter")
+        r = fetch("https://starwars.fandom.com/api.php?action=query&format=json&list=abusefilters%7Cabuselog&formatversion=2&abflimit=200&aflfilter=&afllimit=100&aflprop=ids%7Cuser%7Ctitle%7Caction%7Cresult%7Ctimestamp%7Chidden%7Crevid%7Cfilter")
         filter_ids, filter_names = {}, {}
         for i in r.json()['query']['abusefilters']:
             filter_ids[i['description']] = str(i['id'])
@@ -281,8 +529,7 @@ def parse_bot_request_diff(description):
 
 
 def check_entry(*, entries, title_regex, site, link, title, content, check_star_wars, video_id):
-    r = requests.get(link).text
-    title = check_title_formatting(r, title_regex, title)
+    title = fetch_title(link, title_regex, title)
 
     if check_star_wars and "star wars" not in title.lower().replace("-", " ") and \
             "star wars" not in content.lower().replace("-", " "):
@@ -294,15 +541,29 @@ def check_entry(*, entries, title_regex, site, link, title, content, check_star_
 
 
 def get_content_from_sw_article(text):
-    soup = BeautifulSoup(text, "html.parser")
+    soup = BeautifulSoup(text, "html.parser", parse_only=SoupStrainer("div", class_="content-area"))
     content = soup.find("div", class_="content-area")
     if content:
         return content.text
     return ""
 
 
+def fetch_sw_article(url, title_regex, timeout=5):
+    """ Extracts the title, publish date and text of a StarWars.com article, which appears after the article's
+    heading. """
+    found, value = PAGES.get(("article", url, title_regex))
+    if not found:
+        text = read_page(url, timeout=timeout)
+        m = re.search(title_regex, text)
+        x = re.search(r'<div class="publish-date">(.*?)</div>', text)
+        value = {"title": m.group(1) if m else None, "date": x.group(1) if x else None,
+                 "content": get_content_from_sw_article(text)}
+        PAGES.put(("article", url, title_regex), value)
+    return value
+
+
 def check_sw_news_page(feed_url, cache: Dict[str, List[str]], title_regex):
-    page_html = requests.get(feed_url).content
+    page_html = fetch(feed_url).content
     soup = BeautifulSoup(page_html, "html.parser")
 
     site = "StarWars.com"
@@ -347,12 +608,10 @@ def check_sw_news_page(feed_url, cache: Dict[str, List[str]], title_regex):
             if site_cache and (e["url"] in site_cache or e["url"].split("starwars.com/")[-1] in site_cache):
                 continue
 
-            r_text = requests.get(e["url"], timeout=5).text
-            title = check_title_formatting(r_text, title_regex, e["title"])
-            if not e.get("date"):
-                x = re.search(r'<div class="publish-date">(.*?)</div>', r_text)
-                if x:
-                    e["date"] = x.group(1)
+            article = fetch_sw_article(e["url"], title_regex)
+            title = clean_title(article["title"] if article["title"] is not None else e["title"])
+            if not e.get("date") and article["date"]:
+                e["date"] = article["date"]
 
             if not site_cache:
                 if e.get("date") and today not in e["date"]:
@@ -371,7 +630,7 @@ def check_sw_news_page(feed_url, cache: Dict[str, List[str]], title_regex):
                     d = None
             except Exception:
                 pass
-            content = get_content_from_sw_article(r_text)
+            content = article["content"]
             final_entries.append({"site": site, "title": title, "url": e["url"], "content": content, "date": d})
         except Exception as e:
             error_log(type(e), e)
@@ -381,7 +640,7 @@ def check_sw_news_page(feed_url, cache: Dict[str, List[str]], title_regex):
 
 
 def check_ubisoft_news(site, url, feed_url, cache: Dict[str, List[str]]):
-    page_html = requests.get(feed_url).content
+    page_html = fetch(feed_url).content
     soup = BeautifulSoup(page_html, "html.parser")
 
     initial_entries = []
@@ -399,7 +658,7 @@ def check_ubisoft_news(site, url, feed_url, cache: Dict[str, List[str]]):
         try:
             u = url + e["url"]
             if site not in cache:
-                cache[site] = []
+                cache[site] = seen_urls(site)
             if cache[site] and u in cache[site]:
                 continue
 
@@ -419,7 +678,7 @@ def check_ubisoft_news(site, url, feed_url, cache: Dict[str, List[str]]):
 def check_blog_list(site, url, feed_url, cache: Dict[str, List[str]]):
     x = None
     try:
-        x = requests.get(feed_url, timeout=15).text
+        x = fetch(feed_url, timeout=15).text
     except Exception as e:
         error_log(type(e))
     if not x:
@@ -434,7 +693,7 @@ def check_blog_list(site, url, feed_url, cache: Dict[str, List[str]]):
             continue
         u = link.get('href')
         if site not in cache:
-            cache[site] = []
+            cache[site] = seen_urls(site)
         if cache[site] and u in cache[site]:
             continue
 
@@ -454,7 +713,7 @@ def check_blog_list(site, url, feed_url, cache: Dict[str, List[str]]):
 def check_ilm(site, url, feed_url, cache: Dict[str, List[str]]):
     x = None
     try:
-        x = requests.get(feed_url, timeout=15).text
+        x = fetch(feed_url, timeout=15).text
     except Exception as e:
         error_log(type(e))
     if not x:
@@ -477,7 +736,7 @@ def check_ilm(site, url, feed_url, cache: Dict[str, List[str]]):
         if u.endswith("/"):
             u = u[:-1]
         if site not in cache:
-            cache[site] = []
+            cache[site] = seen_urls(site)
         if cache[site] and u in cache[site]:
             continue
 
@@ -496,7 +755,7 @@ def check_ilm(site, url, feed_url, cache: Dict[str, List[str]]):
 def check_unlimited(site, url, feed_url, cache: Dict[str, List[str]]):
     x = None
     try:
-        x = requests.get(feed_url, timeout=15).json()
+        x = fetch(feed_url, timeout=15).json()
     except Exception as e:
         error_log(type(e))
     if not (x and x.get('data')):
@@ -505,7 +764,7 @@ def check_unlimited(site, url, feed_url, cache: Dict[str, List[str]]):
 
     results = []
     if site not in cache:
-        cache[site] = []
+        cache[site] = seen_urls(site)
 
     articles = x['data']
     # soup = BeautifulSoup(x, "html.parser")
@@ -533,7 +792,7 @@ def check_unlimited(site, url, feed_url, cache: Dict[str, List[str]]):
 def check_hunters_news(site, url, feed_url, cache: Dict[str, List[str]]):
     x = None
     try:
-        x = requests.get(feed_url, timeout=15).text
+        x = fetch(feed_url, timeout=15).text
     except Exception as e:
         error_log(type(e))
     if not x:
@@ -548,13 +807,12 @@ def check_hunters_news(site, url, feed_url, cache: Dict[str, List[str]]):
             continue
         u = url + link.get('href')
         if site not in cache:
-            cache[site] = []
+            cache[site] = seen_urls(site)
         if cache[site] and u in cache[site]:
             continue
 
         t = article.find("span", class_="font-display")
-        r = requests.get(u)
-        title = check_title_formatting(r.text, "<h[12] .*?<span.*?outline-heading__inner\">(.*?)</span>", t.text if t else "Unknown")
+        title = fetch_title(u, "<h[12] .*?<span.*?outline-heading__inner\">(.*?)</span>", t.text if t else "Unknown")
         d = article.find("span", class_="block")
         d = d.text if d else None
         try:
@@ -571,7 +829,7 @@ def check_hunters_news(site, url, feed_url, cache: Dict[str, List[str]]):
 def check_ea_news(site, url, feed_url, cache: Dict[str, List[str]]):
     x = None
     try:
-        x = requests.get(feed_url, timeout=15).text
+        x = fetch(feed_url, timeout=15).text
     except Exception as e:
         error_log(type(e))
     if not x:
@@ -589,7 +847,7 @@ def check_ea_news(site, url, feed_url, cache: Dict[str, List[str]]):
             continue
         u = url + link.get('href')
         if site not in cache:
-            cache[site] = []
+            cache[site] = seen_urls(site)
         if cache[site] and u in cache[site]:
             continue
 
@@ -608,7 +866,7 @@ def check_ea_news(site, url, feed_url, cache: Dict[str, List[str]]):
 def check_audible(cache: Dict[str, List[str]]):
     r = None
     try:
-        r = requests.get("https://www.audible.com/search?keywords=star+wars&sort=pubdate-desc-rank&pageSize=50&feature_six_browse-bin=18685580011&feature_twelve_browse-bin=18685552011", timeout=15).text
+        r = fetch("https://www.audible.com/search?keywords=star+wars&sort=pubdate-desc-rank&pageSize=50&feature_six_browse-bin=18685580011&feature_twelve_browse-bin=18685552011", timeout=15).text
     except Exception as e:
         error_log(type(e))
     if not r:
@@ -616,7 +874,7 @@ def check_audible(cache: Dict[str, List[str]]):
 
     today = datetime.today()
     if "Audible" not in cache:
-        cache["Audible"] = []
+        cache["Audible"] = seen_urls("Audible")
     data = {}
     soup = BeautifulSoup(r, "html.parser")
     for x in soup.findAll("li", class_="productListItem"):
@@ -654,18 +912,18 @@ def check_sw(s):
 
 
 def check_rss_feed(feed_url, cache: Dict[str, List[str]], site, title_regex, check_star_wars):
-    x = None
+    """ Checks the feed for new entries. The feed's validators aren't committed here; callers commit them with
+    FEEDS.commit once the updated cache has been kept. """
+    d = None
     try:
-        x = requests.get(feed_url, timeout=15).text
+        d = FEEDS.get(feed_url, timeout=15)
     except Exception as e:
         error_log(feed_url, type(e))
-    if not x:
+    if not d:
         return []
 
-    d = feedparser.parse(feed_url)
-
     if site not in cache:
-        cache[site] = []
+        cache[site] = seen_urls(site)
     site_cache = cache.get(site)
     today1 = datetime.now().strftime("%d %b %Y")
     if today1.startswith("0"):
@@ -690,8 +948,8 @@ def check_rss_feed(feed_url, cache: Dict[str, List[str]], site, title_regex, che
             continue
         elif site == "*Star Wars*" and "youtube" in e.link:
             try:
-                rx = requests.get(e.link.replace("/watch?v=", "/shorts/"))
-                if rx.url and "/shorts/" in rx.url:
+                rx = fetch_redirect_url(e.link.replace("/watch?v=", "/shorts/"))
+                if rx and "/shorts/" in rx:
                     cache[site].append(e.link)
                     continue
             except Exception:
@@ -704,11 +962,10 @@ def check_rss_feed(feed_url, cache: Dict[str, List[str]], site, title_regex, che
                 continue
 
         try:
-            r = requests.get(e.link.replace("http:", "https:")).text
+            title = fetch_title(e.link.replace("http:", "https:"), title_regex, e.title)
         except Exception as ex:
             error_log(f"Encountered {type(ex)} while checking {e.link}", ex)
-            r = ""
-        title = check_title_formatting(r, title_regex, e.title)
+            title = clean_title(e.title)
         content = ""
         if e.get("content"):
             content = e.content[0]["value"]
@@ -740,15 +997,12 @@ def check_rss_feed(feed_url, cache: Dict[str, List[str]], site, title_regex, che
                                   "videoId": e.get("yt_videoid"), "template": template})
         cache[site].append(e.link)
 
-    if cache.get(site):
-        cache[site] = cache[site][-50:]
-
     return entries_to_report
 
 
 def check_latest_url(url, cache: dict, site, title_regex):
     last_post_url = cache[site]
-    response = requests.get(url, timeout=10)
+    response = fetch(url, timeout=10)
     if response.url == url:
         error_log("Unexpected state, URL did not redirect")
         return []
@@ -919,64 +1173,158 @@ FULL_SKIP = ["jazwares-micro-galaxy", "jazwares-micro-galaxy-series-v", "news/co
              "the-high-republic-tessa-gratton", "the-high-republic-zoraida-cordova",]
 
 
-def build_site_map(full: bool):
-    t = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
-    directory = ET.fromstring(requests.get("https://www.starwars.com/sitemap.xml").text)
-    results = set()
-    for e in directory:
-        for i in e.findall(f'{t}loc'):
+def compile_skip_matcher():
+    """ Combines the skip rules for sitemap URLs into a single pattern. """
+    endings = "|".join(re.escape(s) for s in SKIPS + FULL_SKIP)
+    fragments = "|".join(re.escape(s) for s in PREFIXES + GALLERIES + ["/archived-201", "/archived-202"])
+    return re.compile(rf"\.com/(?:{endings})\Z|{fragments}|/series/[a-z0-9-]+\Z|/databank/[a-z0-9-]+-all|"
+                      rf"(?:-gallery|news/contributor)\Z")
+
+
+SKIP_MATCHER = compile_skip_matcher()
+
+SITE_MAP_INDEX = "https://www.starwars.com/sitemap.xml"
+SITE_MAP_CACHE = "c4de/data/site_map.json"
+SITE_MAP_WORKERS = 6
+SITE_MAP_NS = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+
+
+def site_map_path(loc):
+    return loc.split("starwars.com/", 1)[-1]
+
+
+class SiteMapCrawler:
+    """ Crawls the StarWars.com sitemap incrementally. The sitemap index is requested conditionally, and only the child
+    sitemaps whose lastmod has changed since the last crawl are downloaded again, concurrently. The URLs from each child
+    sitemap are kept on disk, so each crawl can report what was added to or removed from the site since the last one.
+
+    :type sitemaps: dict[str, dict]
+    """
+
+    def __init__(self, path=SITE_MAP_CACHE):
+        self.path = path
+        self.index = {}
+        self.sitemaps = {}
+        self.lock = Lock()
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            self.index = data.get("index") or {}
+            self.sitemaps = data.get("sitemaps") or {}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            error_log(f"Unable to load sitemap cache: {type(e)}: {e}", tb=False)
+
+    def save(self):
+        try:
+            with open(f"{self.path}.tmp", "w") as f:
+                f.writelines(json.dumps({"index": self.index, "sitemaps": self.sitemaps}, separators=(",", ":")))
+            os.replace(f"{self.path}.tmp", self.path)
+        except Exception as e:
+            error_log(f"Unable to save sitemap cache: {type(e)}: {e}", tb=False)
+
+    def urls(self, full: bool):
+        results = set()
+        for data in self.sitemaps.values():
+            for loc in data["urls"]:
+                if full or not SKIP_MATCHER.search(loc):
+                    results.add(site_map_path(loc))
+        return results
+
+    @staticmethod
+    def fetch_child(loc):
+        try:
+            m = fetch(loc)
+        except Exception:
+            time.sleep(2)
+            m = fetch(loc)
+        part = ET.fromstring(m.text)
+        return [x.text for u in part.findall(f"{SITE_MAP_NS}url") for x in u.findall(f"{SITE_MAP_NS}loc")]
+
+    def refresh(self):
+        """ Updates the stored child sitemaps, returning False if the sitemap index hasn't changed since the last crawl.
+        Child sitemaps that can't be downloaded keep their previous URLs, and are retried on the next crawl. """
+        headers = {}
+        if self.index.get("etag"):
+            headers["If-None-Match"] = self.index["etag"]
+        if self.index.get("modified"):
+            headers["If-Modified-Since"] = self.index["modified"]
+        r = fetch(SITE_MAP_INDEX, headers=headers)
+        if r.status_code == 304:
+            return False
+        r.raise_for_status()
+
+        children = {}
+        for e in ET.fromstring(r.text):
+            lastmod = e.find(f"{SITE_MAP_NS}lastmod")
+            for i in e.findall(f"{SITE_MAP_NS}loc"):
+                children[i.text] = lastmod.text if lastmod is not None else None
+
+        stale = [loc for loc, lastmod in children.items()
+                 if loc not in self.sitemaps or not lastmod or self.sitemaps[loc].get("lastmod") != lastmod]
+        failed = False
+        if stale:
+            with ThreadPoolExecutor(max_workers=SITE_MAP_WORKERS, thread_name_prefix="sitemap") as executor:
+                futures = {loc: executor.submit(self.fetch_child, loc) for loc in stale}
+                for loc, future in futures.items():
+                    try:
+                        self.sitemaps[loc] = {"lastmod": children[loc], "urls": future.result()}
+                    except Exception as e:
+                        failed = True
+                        error_log(f"Encountered {str(type(e))} while checking {loc}", tb=False)
+                        if loc in self.sitemaps:
+                            self.sitemaps[loc]["lastmod"] = None
+
+        for loc in list(self.sitemaps):
+            if loc not in children:
+                self.sitemaps.pop(loc)
+        # only skip the next crawl entirely if every child sitemap is up to date
+        self.index = {} if failed else {"etag": r.headers.get("ETag"), "modified": r.headers.get("Last-Modified")}
+        self.save()
+        return True
+
+    def crawl(self, full: bool):
+        """ Returns the current sitemap URLs, along with the URLs added and removed since the last crawl. """
+        with self.lock:
+            before = self.urls(full)
             try:
-                try:
-                    m = requests.get(i.text)
-                except Exception:
-                    time.sleep(2)
-                    m = requests.get(i.text)
-
-                part = ET.fromstring(m.text)
-                for u in part.findall(f"{t}url"):
-                    for loc in u.findall(f"{t}loc"):
-                        if full:
-                            results.add(loc.text.split("starwars.com/", 1)[-1])
-                            continue
-
-                        if any(loc.text.endswith(f".com/{s}") for s in SKIPS):
-                            continue
-                        elif any(loc.text.endswith(f".com/{s}") for s in FULL_SKIP):
-                            continue
-                        elif any(s in loc.text for s in PREFIXES):
-                            continue
-                        elif any(s in loc.text for s in GALLERIES):
-                            continue
-                        elif "/series/" in loc.text and re.match(r".*?/series/[a-z0-9-]+$", loc.text):
-                            continue
-                        elif "/archived-201" in loc.text or "/archived-202" in loc.text:
-                            continue
-                        elif "/databank/" in loc.text and re.search(r"/databank/[a-z0-9-]+-all", loc.text):
-                            continue
-                        elif loc.text.endswith("-gallery") or loc.text.endswith("news/contributor"):
-                            continue
-                        results.add(loc.text.split("starwars.com/", 1)[-1])
+                if not self.refresh():
+                    return before, set(), set()
             except Exception as e:
-                error_log(f"Encountered {str(type(e))} while checking {i.text}", tb=False)
+                error_log(f"Encountered {str(type(e))} while checking {SITE_MAP_INDEX}", tb=False)
+                return before, set(), set()
+            after = self.urls(full)
+            return after, after - before, before - after
+
+
+SITE_MAP = SiteMapCrawler()
+
+
+def build_site_map(full: bool):
+    results, added, removed = SITE_MAP.crawl(full)
+    if added or removed:
+        log(f"Sitemap: {len(added)} URLs added, {len(removed)} removed")
     return results
 
 
-def compile_tracked_urls(site):
+def parse_tracked_urls(text):
+    urls = []
+    for line in text.splitlines():
+        if "|sw_url=" in line:
+            urls.append(line.split("|sw_url=")[-1].split("|")[0].split("}", 1)[0])
+        elif "{{SW|" in line:
+            urls.append(line.split("|url=", 1)[-1].split("|")[0].split("}", 1)[0])
+            if "{{C|alternate: " in line or "{{C|1=alternate: " in line:
+                urls.append(line.split("alternate: ", 1)[-1].split("}", 1)[0])
+        elif "{{C|alternate" in line and "|url=" not in line:
+            urls.append(line.split("alternate: ", 1)[-1].split("}", 1)[0])
+    return urls
+
+
+def parse_databank_urls(text):
     urls = []
-    for y in [*range(1990, datetime.now().year + 1), "Current", "Publisher", "Target", "External"]:
-        p = Page(site, f"Wookieepedia:Sources/Web/{y}")
-        if p.exists():
-            for line in p.get().splitlines():
-                if "|sw_url=" in line:
-                    urls.append(line.split("|sw_url=")[-1].split("|")[0].split("}", 1)[0])
-                elif "{{SW|" in line:
-                    urls.append(line.split("|url=", 1)[-1].split("|")[0].split("}", 1)[0])
-                    if "{{C|alternate: " in line or "{{C|1=alternate: " in line:
-                        urls.append(line.split("alternate: ", 1)[-1].split("}", 1)[0])
-                elif "{{C|alternate" in line and "|url=" not in line:
-                    urls.append(line.split("alternate: ", 1)[-1].split("}", 1)[0])
-
-    for line in Page(site, "Wookieepedia:Sources/Web/Databank").get().splitlines():
+    for line in text.splitlines():
         if "{{Databank|url=" in line:
             urls.append(line.split("|url=", 1)[-1].split("|")[0].split("}", 1)[0])
         elif "{{Databank|" in line:
@@ -984,6 +1332,54 @@ def compile_tracked_urls(site):
     return urls
 
 
+class TrackedUrlCache:
+    """ Caches the URLs parsed from each Wookieepedia:Sources/Web page along with the page's revision ID. A single
+    batched info query finds the pages that changed since they were last parsed, and only those are downloaded again.
+
+    :type pages: dict[str, tuple[int, list[str]]]
+    """
+
+    def __init__(self):
+        self.pages = {}
+        self.lock = Lock()
+
+    def compile(self, site, titles: List[str], parsers: dict) -> set:
+        with self.lock:
+            try:
+                revisions = latest_revision_ids(site, titles)
+            except Exception as e:
+                error_log(f"Unable to check Sources/Web revisions: {type(e)}: {e}", tb=False)
+                revisions = None
+
+            urls = set()
+            for title in titles:
+                if revisions is not None and not revisions.get(title):
+                    self.pages.pop(title, None)
+                    continue
+                cached = self.pages.get(title)
+                if revisions is not None and cached and cached[0] == revisions[title]:
+                    urls.update(cached[1])
+                    continue
+
+                p = Page(site, title)
+                if not p.exists():
+                    continue
+                parsed = parsers[title](p.get())
+                self.pages[title] = (revisions[title] if revisions else p.latest_revision_id, parsed)
+                urls.update(parsed)
+            return urls
+
+
+TRACKED_URLS = TrackedUrlCache()
+
+
+def compile_tracked_urls(site):
+    parsers = {f"Wookieepedia:Sources/Web/{y}": parse_tracked_urls
+               for y in [*range(1990, datetime.now().year + 1), "Current", "Publisher", "Target", "External"]}
+    parsers["Wookieepedia:Sources/Web/Databank"] = parse_databank_urls
+    return TRACKED_URLS.compile(site, list(parsers), parsers)
+
+
 IGNORE = """
 ahsoka-props-costumes-sdcc-2023
 art-inspired-by-the-mandalorian
@@ -1081,40 +1477,64 @@ def compare_site_map(site, series, already_tracked, urls):
     return handle_site_map(sitemap, urls, skip, updated_db_entries, guides)
 
 
+IGNORED_URLS = frozenset(x for x in IGNORE.splitlines() if x)
+SITE_MAP_PAGE_WORKERS = 8
+
+
+def normalize_site_url(url: str):
+    """ Reduces a StarWars.com URL or path to its path, without surrounding slashes, for comparison. """
+    return url.strip().split("starwars.com/", 1)[-1].strip("/")
+
+
+def check_site_map_url(x, guides):
+    u = f"https://www.starwars.com/{x}"
+    r = fetch(u)
+    if r.url != u:
+        return None
+    elif '<section class="module image_gallery' in r.text and x not in guides:
+        print(u, "gallery")
+        return None
+    title = re.search(r"<title>(.*?)</title>", r.text)
+    if title:
+        title = title.group(1).replace(" | StarWars.com", "").strip()
+    else:
+        title = "Unable to Determine Title"
+    title = title.replace("’", "'").replace('&#39;', "'").replace('&quot;', '"')
+    s = "Databank" if x.startswith("databank/") else "StarWars.com"
+    if s == "Databank" and ("- " in title or "|" in title):
+        title = re.sub(r" ?[-|] (The Acolyte|Star Wars Databank|Databank)", "", title)
+    return {"site": s, "url": u, "title": title, "date": datetime.now().strftime('%Y-%m-%d')}
+
+
 def handle_site_map(sitemap: set, urls, skip, updated_db_entries, guides):
-    diff = []
-    ignore = IGNORE.splitlines()
+    tracked = {normalize_site_url(u) for u in urls}
+    skipped = {normalize_site_url(u) for u in skip}
+    to_check = []
     for x in sorted(sitemap):
-        if x in urls or x in ignore or x == "https://www.starwars.com":
+        if x in IGNORED_URLS or x == "https://www.starwars.com":
             continue
         # elif "-concept-art-gallery" in x or "-episode-stills" in x or "-trivia-gallery" in x or x.startswith("video/"):
         elif x.startswith("video/"):
             continue
-
-        u = f"https://www.starwars.com/{x}"
-        if x in skip or u in skip:
+        elif normalize_site_url(x) in tracked or normalize_site_url(x) in skipped:
             continue
-        try:
-            r = requests.get(u)
-            if r.url != u:
-                continue
-            elif '<section class="module image_gallery' in r.text and x not in guides:
-                print(u, "gallery")
+        to_check.append(x)
+
+    diff = []
+    if not to_check:
+        return diff, updated_db_entries
+    with ThreadPoolExecutor(max_workers=SITE_MAP_PAGE_WORKERS, thread_name_prefix="sitemap-page") as executor:
+        futures = [(x, executor.submit(check_site_map_url, x, guides)) for x in to_check]
+        for x, future in futures:
+            u = f"https://www.starwars.com/{x}"
+            try:
+                result = future.result()
+            except Exception as e:
+                error_log(f"Encountered {type(e)} while checking sitemap URL: {u}", e)
                 continue
-            title = re.search(r"<title>(.*?)</title>", r.text)
-            if title:
-                title = title.group(1).replace(" | StarWars.com", "").strip()
-            else:
-                title = "Unable to Determine Title"
-            title = title.replace("’", "'").replace('&#39;', "'").replace('&quot;', '"')
-            s = "Databank" if x.startswith("databank/") else "StarWars.com"
-            if s == "Databank" and ("- " in title or "|" in title):
-                title = re.sub(r" ?[-|] (The Acolyte|Star Wars Databank|Databank)", "", title)
-            if u in updated_db_entries:
-                updated_db_entries.pop(u)
-            diff.append({"site": s, "url": u, "title": title, "date": datetime.now().strftime('%Y-%m-%d')})
-        except Exception as e:
-            error_log(f"Encountered {type(e)} while checking sitemap URL: {u}", e)
+            if result:
+                updated_db_entries.pop(u, None)
+                diff.append(result)
     return diff, updated_db_entries
 
 
@@ -1132,14 +1552,14 @@ def augment_site_map(site, series, urls):
         urls_to_check.update(series_urls)
         series_db_entries.update(series_db)
 
-        d = requests.get(f"https://www.starwars.com/_grill/filter/series/{st}?filter=All&mod=8&slug=all")
+        d = fetch(f"https://www.starwars.com/_grill/filter/series/{st}?filter=All&mod=8&slug=all")
         if d.status_code != 200:
             continue
         data = d.json()
         for a in data['data']:
             series_db_entries[a['href'].split('.com/')[-1]] = re.sub(r" ?- ?Skeleton Crew", "", a['title'])
         while data.get('next'):
-            data = requests.get(f"https://www.starwars.com/_grill/filter/series/{st}{data['next']}").json()
+            data = fetch(f"https://www.starwars.com/_grill/filter/series/{st}{data['next']}").json()
             for a in data['data']:
                 series_db_entries[a['href'].split('.com/')[-1]] = re.sub(r" ?- ?Skeleton Crew", "", a['title'])
 
@@ -1185,7 +1605,7 @@ def check_episode(st, episode, urls, urls_to_check, db_entries):
 
 def check_series_page(url):
     urls_to_check, db_entries = set(), {}
-    r = requests.get(url)
+    r = fetch(url)
     if r.status_code == 200 and r.url == url:
         soup = BeautifulSoup(r.content, "html.parser")
         for l in [*soup.find_all("ol", class_="slider-list"), *soup.find_all("section", class_="incredibles_slider"), *soup.find_all("div", "display_filters")]:
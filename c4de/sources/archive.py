@@ -1,8 +1,16 @@
+from bisect import bisect_left
+from functools import lru_cache
+from threading import Lock
+
 from c4de.sources.engine import load_template_types
 from pywikibot import Page, Site, Category, showDiff
+import json
+import os
 import re
 import requests
-from c4de.common import archive_url
+import time
+from c4de.common import error_log, latest_revision_ids
+from c4de.wayback import WaybackQueue, DONE, FAILED
 
 YEARLY = ['news/happy-star-wars-day', 'news/star-wars-black-friday-and-cyber-week-deals', 'news/star-wars-day-deals',
           'news/star-wars-day-merchandise', 'news/star-wars-day-video-game-deals', 'news/star-wars-fathers-day-gift-guide',
@@ -41,12 +49,168 @@ __EXPECTUNUSEDCATEGORY__
         cp.put(tx, "Creating maintenance category")
 
 
-def parse_archive(site, template):
-    page = Page(site, f"Module:ArchiveAccess/{template}")
-    if not page.exists():
-        return None
+class ArchiveTable(dict):
+    """ The URL -> archivedate mapping from an ArchiveAccess module, which can also check whether any of its URLs ends
+    with a given string. That check uses the URLs reversed and sorted, built on first use, so it costs a binary search
+    rather than a scan of every URL. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.suffixes = None
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.suffixes = None
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.suffixes = None
+
+    def __ior__(self, other):
+        self.suffixes = None
+        return super().__ior__(other)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.suffixes = None
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.suffixes = None
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        self.suffixes = None
+        return super().pop(*args)
+
+    def popitem(self):
+        self.suffixes = None
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self.suffixes = None
+
+    def has_suffix(self, z: str):
+        """ Equivalent to any(y.endswith(z) for y in self). """
+        if self.suffixes is None:
+            self.suffixes = sorted(k[::-1] for k in self)
+        rz = z[::-1]
+        i = bisect_left(self.suffixes, rz)
+        return i < len(self.suffixes) and self.suffixes[i].startswith(rz)
+
+
+ARCHIVE_CACHE = "c4de/data/archive_cache.json"
+ARCHIVE_CHECK_INTERVAL = 300
+
+
+class ArchiveCache:
+    """ Caches the parsed archive tables, keyed by page title and parser, along with the revision each was parsed
+    from; the tables are also saved locally, so they survive restarts. The latest revisions of all the requested pages
+    are checked with batched queries (at most once every ARCHIVE_CHECK_INTERVAL seconds per page), and a page is only
+    downloaded and parsed again when it has changed.
+
+    :type tables: dict[str, tuple[int, ArchiveTable | None]]
+    """
+
+    def __init__(self, path=ARCHIVE_CACHE, interval=ARCHIVE_CHECK_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.tables = {}
+        self.checked = {}
+        self.generation = 0
+        self.lock = Lock()
+        try:
+            with open(path, "r") as f:
+                self.tables = {k: (v["revid"], None if v["archive"] is None else ArchiveTable(v["archive"]))
+                               for k, v in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            error_log(f"Unable to load archive cache: {type(e)}: {e}", tb=False)
+
+    def save(self):
+        try:
+            with open(f"{self.path}.tmp", "w") as f:
+                f.writelines(json.dumps({k: {"revid": r, "archive": a} for k, (r, a) in self.tables.items()},
+                                        separators=(",", ":")))
+            os.replace(f"{self.path}.tmp", self.path)
+        except Exception as e:
+            error_log(f"Unable to save archive cache: {type(e)}: {e}", tb=False)
+
+    def invalidate(self, title):
+        """ Forces the next lookup of the given page to check its revision, e.g. after the bot has edited it. """
+        with self.lock:
+            self.generation += 1
+            for key in [k for k in self.checked if k.split(":", 1)[1] == title]:
+                self.checked.pop(key)
+
+    def get_many(self, site, titles, parser) -> dict:
+        """ Returns the table parsed by parser(text, title) for each of the given pages, or None for pages that don't
+        exist. The revision check and downloads run without holding the lock, so a slow page doesn't hold up lookups
+        from other threads. """
+        now = time.monotonic()
+        keys = {t: f"{parser.__name__}:{t}" for t in titles}
+        with self.lock:
+            generation = self.generation
+            cached = {t: self.tables.get(key) for t, key in keys.items()}
+            stale = [t for t, key in keys.items() if now - self.checked.get(key, 0) > self.interval]
+
+        revisions = None
+        if stale:
+            try:
+                revisions = latest_revision_ids(site, stale)
+            except Exception as e:
+                error_log(f"Unable to check archive revisions: {type(e)}: {e}", tb=False)
+
+        results, updates, checked = {}, {}, []
+        for t in keys:
+            if t in stale and revisions is not None:
+                checked.append(t)
+                if not revisions.get(t):
+                    results[t] = None
+                    if cached[t] != (0, None):
+                        updates[t] = (0, None)
+                    continue
+                elif cached[t] and cached[t][0] == revisions[t]:
+                    results[t] = cached[t][1]
+                    continue
+            elif cached[t]:
+                # checked recently, or the revision check failed
+                results[t] = cached[t][1]
+                continue
+
+            page = Page(site, t)
+            if page.exists():
+                results[t] = ArchiveTable(parser(page.get(), t))
+                updates[t] = (page.latest_revision_id, results[t])
+            else:
+                results[t] = None
+                updates[t] = (0, None)
+            checked.append(t)
+
+        with self.lock:
+            # if a page was invalidated in the meantime, what was fetched may predate the edit, so check it again
+            if self.generation == generation:
+                for t in checked:
+                    self.checked[keys[t]] = now
+            for t, entry in updates.items():
+                self.tables[keys[t]] = entry
+            if updates:
+                self.save()
+        return results
+
+    def get(self, site, title, parser):
+        return self.get_many(site, [title], parser)[title]
+
+
+ARCHIVES = ArchiveCache()
+
+
+def parse_archive_module(text, title):
+    template = title.split("/", 1)[-1]
     archive = {}
-    for u, d, _ in re.findall(r"(?<!-- )\[['\"](.+?)/*?['\"]] ?= ?['\"]?(.*?)['\"]?[, ]*(--.*?)?\n", page.get()):
+    for u, d, _ in re.findall(r"(?<!-- )\[['\"](.+?)/*?['\"]] ?= ?['\"]?(.*?)['\"]?[, ]*(--.*?)?\n", text):
         if u.startswith("/") and u != "/":
             u = u[1:]
         if template == "Rebelscum":
@@ -55,6 +219,16 @@ def parse_archive(site, template):
     return archive
 
 
+def parse_archive(site, template):
+    return ARCHIVES.get(site, f"Module:ArchiveAccess/{template}", parse_archive_module)
+
+
+def parse_archives(site, templates) -> dict:
+    """ Returns the parsed ArchiveAccess module for each of the given templates, checking their revisions together. """
+    modules = ARCHIVES.get_many(site, [f"Module:ArchiveAccess/{t}" for t in templates], parse_archive_module)
+    return {t: modules[f"Module:ArchiveAccess/{t}"] for t in templates}
+
+
 def build_missing_and_new(page, types, archives, new_data, skip):
     if not new_data:
         new_data = {}
@@ -249,51 +423,103 @@ def build_to_check(site, data):
     return to_check
 
 
-def populate_archives(to_check, skip=False, start=None):
-    archives = {}
+def populate_archives(to_check, skip=False, start=None, queue: WaybackQueue = None):
+    """ Looks up (or, unless skip is set, saves) each URL through the durable Wayback queue, and returns the
+    archivedate found for each key. Stopping the run with Ctrl-C returns the results so far; the rest of the queue is
+    picked up by the next run. """
+    owned = queue is None
+    queue = queue or WaybackQueue()
     try:
+        urls = {}
         for t, dx in to_check.items():
             for k, v in dx.items():
-                if k in archives:
-                    continue
-                try:
-                    success, archivedate = archive_url(v, skip=skip, start=start)
-                    if success:
-                        archives[k] = archivedate
-                except KeyboardInterrupt:
-                    return archives
-                except Exception as e:
-                    print(f"Encountered {str(e)} for {v}")
-    except KeyboardInterrupt:
-        pass
-    return archives
+                if k not in urls:
+                    urls[k] = v
+                    queue.enqueue(v, start=start, save=not skip)
+        try:
+            queue.run()
+        except KeyboardInterrupt:
+            pass
+
+        archives = {}
+        for k, v in urls.items():
+            status, archivedate = queue.result(v, start)
+            if status == DONE:
+                archives[k] = archivedate
+            elif status == FAILED:
+                print(f"Encountered {archivedate} for {v}")
+        return archives
+    finally:
+        if owned:
+            queue.close()
+
+
+def normalize_archive_key(k):
+    u = k.replace('{{=}}', '=').lower()
+    if u.startswith('/') and len(u) > 1:
+        u = u[1:]
+    if u.endswith('/') and len(u) > 1:
+        u = u[:-1]
+    return u
+
+
+def parse_archive_module_lines(lines):
+    """ Locates the URL map in an ArchiveAccess module, and returns the index of its closing line, along with the line
+    index and lowercased key of each entry in it, in order; commented-out entries count as known, but not as entries
+    for positioning new ones. """
+    entries, known = [], set()
+    start, end = None, None
+    for i, line in enumerate(lines):
+        s = line.strip()
+        if start is None:
+            if s.startswith("[") or "knownArchiveDates" in s:
+                start = i
+            else:
+                continue
+        elif s.startswith("}"):
+            end = i
+            break
+        keys = re.findall(r"\[['\"](.+?)['\"]]", line)
+        if not keys:
+            continue
+        known.update(k.lower() for k in keys)
+        if s.startswith("["):
+            entries.append((i, keys[0].lower()))
+    return end, entries, known
 
 
 def build_archive_module_text(text, new_items: dict):
+    """ Merges the new URLs into the module's URL map in one pass. If the existing entries are sorted, each new entry
+    is inserted at its sorted position; otherwise, the new entries are added in order at the end of the map. """
+    lines = text.splitlines()
+    end, entries, known = parse_archive_module_lines(lines)
+    if end is None:
+        return lines
+
+    to_add = {}
+    for k, v in sorted(new_items.items()):
+        u = normalize_archive_key(k)
+        if k.lower() in known or u in known:
+            print(f"URL {k} is already archived")
+        elif u not in to_add:
+            to_add[u] = v
+    if not to_add:
+        return lines
+
+    keys = [k for _, k in entries]
+    in_order = all(a <= b for a, b in zip(keys, keys[1:]))
+    inserts = {}
+    for u, v in sorted(to_add.items()):
+        p = bisect_left(keys, u) if in_order else len(keys)
+        at = entries[p][0] if p < len(entries) else end
+        inserts.setdefault(at, []).append(f'\t["{u}"] = "{v}",')
+
     new_text = []
-    in_map, found, start = False, False, False
-    skip = []
-    for line in text.splitlines():
-        if not start:
-            start = line.strip().startswith("[") or "knownArchiveDates" in line.strip()
-        elif not found:
-            x = [k for k in new_items.keys() if f"['{k.lower()}']" in line.lower() or f'["{k.lower()}"]' in line.lower()]
-            for i in x:
-                print(f"URL {i} is already archived")
-                skip.append(i)
-            if not x and line.strip().startswith("}"):
-                if "[" in new_text[-1] and not new_text[-1].strip().endswith(","):
-                    new_text[-1] = new_text[-1].rstrip() + ","
-                for k, v in sorted(new_items.items()):
-                    if k in skip:
-                        continue
-                    u = k.replace('{{=}}', '=').lower()
-                    if u.startswith('/') and len(u) > 1:
-                        u = u[1:]
-                    if u.endswith('/') and len(u) > 1:
-                        u = u[:-1]
-                    new_text.append(f'\t["{u}"] = "{v}",')
-                found = True
+    for i, line in enumerate(lines):
+        if i in inserts:
+            if i == end and new_text and "[" in new_text[-1] and not new_text[-1].strip().endswith(","):
+                new_text[-1] = new_text[-1].rstrip() + ","
+            new_text += inserts[i]
         new_text.append(line)
     return new_text
 
@@ -310,6 +536,7 @@ def add_data_to_archive(site, data, archives, save=True):
         if text != "\n".join(new_text):
             if save:
                 p.put("\n".join(new_text), "Recording missing archivedates")
+                ARCHIVES.invalidate(p.title())
             else:
                 showDiff(text, "\n".join(new_text), context=2)
 
@@ -345,10 +572,91 @@ def is_old_or_not_in_archive(original, x, archive):
         return False
     if "http" in x:
         z = x.lower().replace("http://", "").replace("https://", "").replace("www.", "")
-        return not any(y.endswith(z) for y in archive)
+        if not isinstance(archive, ArchiveTable):
+            archive = ArchiveTable(archive)
+        return not archive.has_suffix(z)
     return True
 
 
+def archive_module_for(template):
+    if template in ["ThisWeek", "HighRepublicShow", "StarWarsShow"]:
+        return "SWYouTube"
+    elif template in ["ToppsNow", "ToppsLivingSet", "ForceAttax"]:
+        return "Topps"
+    return template
+
+
+TEMPLATE_CALL = re.compile(r"\{(?=\{([^\n{}|]*))")
+
+
+def tokenize_template_calls(text):
+    """ Splits the text into the same </ref> chunks as the cleanup rules work on, and returns the bounds of each chunk
+    along with the positions of the template calls that start in it, grouped by template name. """
+    chunks = []
+    start = 0
+    for c in text.split("</ref>"):
+        chunks.append((start, start + len(c), {}))
+        start += len(c) + len("</ref>")
+    i = 0
+    for m in TEMPLATE_CALL.finditer(text):
+        while m.start() >= chunks[i][1]:
+            i += 1
+        chunks[i][2].setdefault(m.group(1), []).append(m.start())
+    return chunks
+
+
+@lru_cache(maxsize=None)
+def is_literal(name):
+    return re.escape(name) == name
+
+
+def find_calls(pattern: str, text, chunk, name=None, keyword=None):
+    """ Equivalent to re.findall(pattern, chunk) for the rules below, which all start with {{ and never match across
+    lines, but only tries the calls with the given template name, or whose line contains the given keyword. """
+    _, end, calls = chunk
+    if not calls:
+        return
+    if name is not None and is_literal(name):
+        candidates = calls.get(name)
+        if not candidates:
+            return
+    elif len(calls) == 1:
+        candidates = next(iter(calls.values()))
+    else:
+        candidates = sorted(p for px in calls.values() for p in px)
+    pattern = re.compile(pattern)
+    last = -1
+    for p in candidates:
+        if p < last:
+            continue
+        if keyword:
+            line_end = text.find("\n", p, end)
+            if text.find(keyword, p, end if line_end < 0 else line_end) < 0:
+                continue
+        m = pattern.match(text, p, end)
+        if m:
+            last = m.end()
+            yield m.groups(default="")
+
+
+def apply_replacements(text, replacements):
+    """ Applies the (old, new) replacements in order, with the same result as calling text.replace for each one. None
+    of them span lines, so only the lines that contain one of them are rewritten, rather than copying the whole page
+    once per citation. """
+    replacements = [(old, new) for old, new in replacements if old and old != new]
+    if not replacements:
+        return text
+    pattern = re.compile("|".join(re.escape(old) for old in dict(replacements)))
+    lines = text.split("\n")
+    found = [i for i, line in enumerate(lines) if pattern.search(line)]
+    block = "\n".join(lines[i] for i in found)
+    for old, new in replacements:
+        block = block.replace(old, new)
+    for i, line in zip(found, block.split("\n")):
+        lines[i] = line
+    return "\n".join(lines)
+
+
 def clean_archive_usages(page: Page, text, archive_data: dict, redo=False):
     templates_to_check = set()
     if redo:
@@ -373,92 +681,95 @@ def clean_archive_usages(page: Page, text, archive_data: dict, redo=False):
         templates_to_check.add("HighRepublicShow")
         templates_to_check.add("StarWarsShow")
     text = re.sub(r"\|url=/([^|{}\[\]].*?)\|", "|url=\\1|", text)
-    chunks = text.split("</ref>")
+    chunks = tokenize_template_calls(text)
+    replacements = []
+    modules = {t: archive_module_for(t) for t in templates_to_check}
+    if archive_data is None:
+        archive_data = {}
+    archive_data.update(parse_archives(page.site, set(modules.values())))
     for t in templates_to_check:
-        tx = "SWYouTube" if t in ["ThisWeek", "HighRepublicShow", "StarWarsShow"] else t
-        tx = "Topps" if tx in ["ToppsNow", "ToppsLivingSet", "ForceAttax"] else tx
-        if tx not in archive_data:
-            archive_data[tx] = parse_archive(page.site, tx)
+        tx = modules[t]
         archive = archive_data.get(tx) or {}
         if not archive:
             continue
 
-        for c in chunks:
-            if archive and t == "Rebelscum":
-                for x in re.findall(r"(\{\{KennerCite\|(.*?\|)?link=(h?t?t?.*?rebelscum\.com/)?([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?\|archive(date|url)=([^\n{}|]+?) ?)(\|[^\n{}]*?)?}})", c):
+        for chunk in chunks:
+            if t == "Rebelscum":
+                for x in find_calls(r"(\{\{KennerCite\|(.*?\|)?link=(h?t?t?.*?rebelscum\.com/)?([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?\|archive(date|url)=([^\n{}|]+?) ?)(\|[^\n{}]*?)?}})", text, chunk, name="KennerCite"):
                     if is_old_or_not_in_archive(x[0], x[3], archive):
                         continue
                     # elif "nolive=" in x[0] and x[7] != archive[x[3].lower()]:
                     #     continue
-                    text = text.replace(x[5], "").replace(f"link={x[2]}{x[3]}", f"link={x[3]}")
-                for x in re.findall(r"(\{\{[A-z0-9 _]+\|(.*?\|)?(url|a?l?t?link)=([^\n{}|]*?rebelscum[^\n{}|]*?)/?(\|[^\n{}]*?)?( ?\|archive(date|url)=[^\n{}|]*? ?)(\|[^\n{}]*?)?}})", c):
+                    replacements += [(x[5], ""), (f"link={x[2]}{x[3]}", f"link={x[3]}")]
+                for x in find_calls(r"(\{\{[A-z0-9 _]+\|(.*?\|)?(url|a?l?t?link)=([^\n{}|]*?rebelscum[^\n{}|]*?)/?(\|[^\n{}]*?)?( ?\|archive(date|url)=[^\n{}|]*? ?)(\|[^\n{}]*?)?}})", text, chunk, keyword="rebelscum"):
                     if "nolive=" in x[0] or "oldversion" in x[0]:
                         continue
                     if re.sub(r"(https?://)?w*\.?rebelscum\.com/", "", x[3].lower()) not in archive:
                         continue
-                    text = text.replace(x[5], "")
-            elif archive and (tx == "Blogspot" or tx == "Tumblr"):
+                    replacements.append((x[5], ""))
+            elif tx == "Blogspot" or tx == "Tumblr":
                 blogs = []
-                for x in re.findall(r"(\{\{" + t + r"\|(.*?\|)?subdomain=([^\n{}|]*?)(\|[^\n{}]*?)?\|url=([^\n{}|]*?)(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", c):
+                for x in find_calls(r"(\{\{" + t + r"\|(.*?\|)?subdomain=([^\n{}|]*?)(\|[^\n{}]*?)?\|url=([^\n{}|]*?)(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", text, chunk, name=t):
                     blogs.append((x[0], f"{x[2]}.{tx.lower()}.com/{x[4]}", x[6]))
-                for x in re.findall(r"(\{\{" + t + r"\|(.*?\|)?url=([^\n{}|]*?)(\|[^\n{}]*?)?|subdomain=([^\n{}|]*?)(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", c):
+                # this one can also match a bare subdomain= parameter, so it has to search the whole chunk
+                for x in re.findall(r"(\{\{" + t + r"\|(.*?\|)?url=([^\n{}|]*?)(\|[^\n{}]*?)?|subdomain=([^\n{}|]*?)(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", text[chunk[0]:chunk[1]]):
                     blogs.append((x[0], f"{x[4]}.{tx.lower()}.com/{x[2]}", x[6]))
-                for x in re.findall(r"(\{\{" + t + r"\|(.*?\|)?url=([^\n{}|]*?)(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", c):
+                for x in find_calls(r"(\{\{" + t + r"\|(.*?\|)?url=([^\n{}|]*?)(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", text, chunk, name=t):
                     blogs.append((x[0], f"{tx.lower()}.com/{x[2]}", x[4]))
-                for x in re.findall(r"(\{\{" + t + r"\|(.*?\|)?subdomain=([^\n{}|]*?)(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", c):
+                for x in find_calls(r"(\{\{" + t + r"\|(.*?\|)?subdomain=([^\n{}|]*?)(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", text, chunk, name=t):
                     blogs.append((x[0], f"{x[2]}.{tx.lower()}.com", x[4]))
 
                 for o1, o2, o3 in blogs:
                     if is_old_or_not_in_archive(o1, o2, archive):
                         continue
-                    text = text.replace(o3, "")
-            elif archive and "YouTube" in t:
-                for x in re.findall(r"(\{\{.*?\|video=([^\n{}|]*?)/?(&t=[0-9]+s)?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", c):
+                    replacements.append((o3, ""))
+            elif "YouTube" in t:
+                for x in find_calls(r"(\{\{.*?\|video=([^\n{}|]*?)/?(&t=[0-9]+s)?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", text, chunk, keyword="|video="):
                     if is_old_or_not_in_archive(x[0], x[1], archive):
                         continue
                     if x[2] and x[1].lower() in archive and f"{x[1]}{x[2]}".lower() not in archive:
-                        text = text.replace(x[2], "")
-                    text = text.replace(x[4], "")
-                for x in re.findall(r"(\{\{.*?YouTube\|(channel=)([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", c):
+                        replacements.append((x[2], ""))
+                    replacements.append((x[4], ""))
+                for x in find_calls(r"(\{\{.*?YouTube\|(channel=)([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", text, chunk, keyword="YouTube|channel="):
                     if is_old_or_not_in_archive(x[0], x[2], archive) or "video=" in x[0]:
                         continue
-                    text = text.replace(x[4], "")
-                for x in re.findall(r"(\{\{(.*?YouTube|ThisWeek|StarWarsShow|HighRepublicShow)\|(video=)?([^\n{}|]*?)/?(&t=[0-9]+s)?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", c):
+                    replacements.append((x[4], ""))
+                for x in find_calls(r"(\{\{(.*?YouTube|ThisWeek|StarWarsShow|HighRepublicShow)\|(video=)?([^\n{}|]*?)/?(&t=[0-9]+s)?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", text, chunk, keyword="|archive"):
                     if is_old_or_not_in_archive(x[0], x[3], archive):
                         continue
                     if x[4] and x[3].lower() in archive and f"{x[3]}{x[4]}".lower() not in archive:
-                        text = text.replace(x[4], "")
-                    text = text.replace(x[6], "")
-            elif archive and t == "SWE":
-                for x in re.findall(r"(\{\{" + t + r"\|(url=)?([^\n{}|]*?)/?\|([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]*?) ?)(\|[^\n{}]*?)? ?}})", c):
+                        replacements.append((x[4], ""))
+                    replacements.append((x[6], ""))
+            elif t == "SWE":
+                for x in find_calls(r"(\{\{" + t + r"\|(url=)?([^\n{}|]*?)/?\|([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]*?) ?)(\|[^\n{}]*?)? ?}})", text, chunk, name=t):
                     z = f"{x[2]}/{x[3]}"
                     if is_old_or_not_in_archive(x[0], z, archive):
                         continue
                     # elif "nolive=" in x[0] and x[7] != archive[x[2].lower()]:
                     #     continue
-                    text = text.replace(x[5], "")
-            elif archive and t == "Databank":
-                for x in re.findall(r"(\{\{" + t + r"\|(url=)?([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]*?) ?)(\|[^\n{}]*?)? ?}})", c):
+                    replacements.append((x[5], ""))
+            elif t == "Databank":
+                for x in find_calls(r"(\{\{" + t + r"\|(url=)?([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]*?) ?)(\|[^\n{}]*?)? ?}})", text, chunk, name=t):
                     if is_old_or_not_in_archive(x[0], x[2], archive):
                         continue
                     # elif "nolive=" in x[0] and x[7] != archive[x[2].lower()]:
                     #     continue
-                    text = text.replace(x[4], "")
-            elif archive:
-                for x in re.findall(r"(\{\{" + t + r"\|(subdomain=|username=)([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", c):
+                    replacements.append((x[4], ""))
+            else:
+                for x in find_calls(r"(\{\{" + t + r"\|(subdomain=|username=)([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", text, chunk, name=t):
                     if is_old_or_not_in_archive(x[0], x[2], archive) or "|url=" in x[0]:
                         continue
-                    text = text.replace(x[4], "")
-                for x in re.findall(r"(\{\{" + t + r"\|(.*?\|)?(url|id|a?l?t?link)=([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", c):
+                    replacements.append((x[4], ""))
+                for x in find_calls(r"(\{\{" + t + r"\|(.*?\|)?(url|id|a?l?t?link)=([^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", text, chunk, name=t):
                     if is_old_or_not_in_archive(x[0], x[3], archive) or x[3].lower() in YEARLY:
                         continue
                     # elif "nolive=" in x[0] and x[8] != archive[x[3].lower()]:
                     #     continue
-                    text = text.replace(x[5], "")
-                for x in re.findall(r"(\{\{" + t + r"\|((?!(url|id|a?l?t?link)=)[^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+?)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", c):
+                    replacements.append((x[5], ""))
+                for x in find_calls(r"(\{\{" + t + r"\|((?!(url|id|a?l?t?link)=)[^\n{}|]*?)/?(\|[^\n{}]*?)?( ?(\|archivedate=[0-9]+-[0-9-]+?)? ?\|archive(url|date)=([^\n{}|]+?) ?)(\|[^\n{}]*?)? ?}})", text, chunk, name=t):
                     if is_old_or_not_in_archive(x[0], x[1], archive) or x[1].lower() in YEARLY:
                         continue
                     # elif "nolive=" in x[0] and x[7] != archive[x[1].lower()]:
                     #     continue
-                    text = text.replace(x[4], "")
-    return text, archive_data
+                    replacements.append((x[4], ""))
+    return apply_replacements(text, replacements), archive_data
@@ -1,5 +1,6 @@
 import re
-from typing import List, Dict, Optional
+from bisect import bisect_left
+from typing import List, Dict, Optional, Tuple
 
 from pywikibot import Page
 from c4de.sources.domain import Item, ItemId
@@ -49,6 +50,128 @@ def check_targets(o: Item, target, by_target: Dict[str, List[Item]], other_targe
 SPECIAL_REMAP = ["Star Wars Kids Answer Quest"]
 
 
+class ItemIndex(dict):
+    """ The masterlist items by unique ID, along with lookups by template, target/parent set name and (flattened) card
+    name for the card, miniature and toy matching logic. Each lookup stores the items' positions, so that the matching
+    logic can still check the candidates in masterlist order. """
+    def __init__(self, data: Dict[str, Item]):
+        super().__init__(data)
+        self.lookup: Dict[tuple, List[Tuple[int, Item]]] = {}
+        self.set_names: Dict[str, Dict[str, List[Tuple[int, Item]]]] = {}
+        self.flat_minis: List[Tuple[str, int, Item]] = []
+        targets = {}
+        for n, x in enumerate(data.values()):
+            self.add(("template", x.template), n, x)
+            self.add(("target", x.target), n, x)
+            if x.special:
+                self.add(("special", x.template, x.special), n, x)
+            if x.card:
+                self.add(("card", x.template, x.card), n, x)
+                self.add(("flat", x.template, flatten_card(x.card)), n, x)
+                if x.template == "LEGOCite":
+                    self.add(("lego", x.template, x.card.replace("starfighter", "fighter")), n, x)
+                elif x.template == "SWMiniCite":
+                    self.flat_minis.append((flatten(x.card), n, x))
+            if x.text:
+                self.add(("text", x.template, x.text), n, x)
+            if x.url:
+                self.add(("url", x.template, x.url), n, x)
+            for t in {x.target, x.parent}:
+                if t:
+                    if x.template not in self.set_names:
+                        self.set_names[x.template] = {}
+                    if t not in self.set_names[x.template]:
+                        self.set_names[x.template][t] = []
+                    self.set_names[x.template][t].append((n, x))
+            if x.target:
+                for k in (x.template, None):
+                    if k not in targets:
+                        targets[k] = []
+                    targets[k].append((x.target, n, x))
+
+        self.target_prefixes = {}
+        for k, v in targets.items():
+            v.sort(key=lambda a: (a[0], a[1]))
+            self.target_prefixes[k] = ([a[0] for a in v], [(a[1], a[2]) for a in v])
+
+    def add(self, key: tuple, n, x: Item):
+        if key not in self.lookup:
+            self.lookup[key] = []
+        self.lookup[key].append((n, x))
+
+    def collect(self, found: Dict[int, Item], *keys):
+        for k in keys:
+            for n, x in self.lookup.get(k, []):
+                found[n] = x
+        return found
+
+    def find(self, *keys) -> List[Item]:
+        found = self.collect({}, *keys)
+        return [found[n] for n in sorted(found)]
+
+    def find_by_set_name(self, templates, set_name) -> Dict[int, Item]:
+        found = {}
+        for t in templates:
+            for name, entries in self.set_names.get(t, {}).items():
+                if set_name in name or name.replace(" - ", " ") == set_name.replace(" - ", " "):
+                    for n, x in entries:
+                        found[n] = x
+        return found
+
+    def find_by_target_prefix(self, template, set_name) -> Optional[Item]:
+        """ Returns the first item whose target matches the set name, or the first item whose target starts with it. """
+        keys, items = self.target_prefixes.get(template, ([], []))
+        i = bisect_left(keys, set_name)
+        exact, partial = None, None
+        while i < len(keys) and keys[i].startswith(set_name):
+            if keys[i] == set_name and (exact is None or items[i][0] < exact[0]):
+                exact = items[i]
+            elif partial is None or items[i][0] < partial[0]:
+                partial = items[i]
+            i += 1
+        return exact[1] if exact else (partial[1] if partial else None)
+
+
+def card_templates(set_name, o: Item):
+    if set_name == "Star Wars: The Power of the Force (1995 toy line)" and o.template in ["KennerCite", "HasbroCite"]:
+        return ["KennerCite", "HasbroCite"]
+    return [o.template]
+
+
+def card_candidates(o: Item, set_name, d: dict):
+    """ Returns the items that match_cards could match to the given card; only applies to an ItemIndex. """
+    if not isinstance(d, ItemIndex):
+        return d.values()
+    templates = card_templates(set_name, o)
+    if o.template == "SideshowCite":
+        return d.find(*(("template", t) for t in templates))
+
+    found = d.find_by_set_name(templates, set_name)
+    if o.mode == "Minis" and "bypass" not in o.original:
+        for t in templates:
+            d.collect(found, ("card", t, o.card), ("text", t, o.text), ("url", t, o.url))
+            if o.card:
+                d.collect(found, ("flat", t, flatten_card(o.card, True)))
+    return [found[n] for n in sorted(found)]
+
+
+def miniature_candidates(o: Item, oc: str, set_name, d: dict):
+    """ Returns the items that match_individual_miniature could match to the given miniature; only applies to an
+    ItemIndex. """
+    if not isinstance(d, ItemIndex):
+        return d.values()
+    found = {}
+    for t in card_templates(set_name, o):
+        d.collect(found, ("url", t, o.url))
+        if oc:
+            d.collect(found, ("flat", t, oc))
+    if o.template == "SWMiniCite" and oc:
+        for c, n, x in d.flat_minis:
+            if oc in c:
+                found[n] = x
+    return [found[n] for n in sorted(found)]
+
+
 def determine_id_for_item(
         o: Item, page: Page, data: Dict[str, Item], urls: Dict[str, List[Item]], by_target: Dict[str, List[Item]],
         other_data: Dict[str, Item], other_urls: Dict[str, List[Item]], other_targets: Dict[str, List[Item]],
@@ -121,7 +244,11 @@ def determine_id_for_item(
     if o.template == "LEGOCite" and o.special:
         for other, d in data_sets.items():
             alt = []
-            for s, x in d.items():
+            if isinstance(d, ItemIndex):
+                candidates = d.find(("special", "LEGOCite", o.special), ("lego", "LEGOCite", (o.card or '').replace("starfighter", "fighter")))
+            else:
+                candidates = d.values()
+            for x in candidates:
                 if x.template == "LEGOCite" and x.special == o.special:
                     return ItemId(o, x, False, other)
                 elif x.template == "LEGOCite" and compare_cleaned(x.card, o.card, r1="starfighter", s1="fighter"):
@@ -130,7 +257,7 @@ def determine_id_for_item(
                 return ItemId(o, alt[-1], False, other)
     elif o.template == "CalendarCite":
         for other, d in data_sets.items():
-            for s, x in d.items():
+            for x in (d.find(("target", o.target)) if isinstance(d, ItemIndex) else d.values()):
                 if x.target == o.target:
                     return ItemId(o, x, True, other)
 
@@ -153,7 +280,7 @@ def determine_id_for_item(
         exact, start, other_set = [], [], []
         if set_name is not None:
             for other, d in data_sets.items():
-                for s, x in d.items():
+                for x in card_candidates(o, set_name, d):
                     if do_card_templates_match(set_name, o, x) and x.canon == canon:
                         m = match_cards(o, x, set_name, other, exact, start)
                         if m:
@@ -291,7 +418,7 @@ def match_miniatures(o: Item, set_name, data_sets: Dict[bool, dict], canon, ref,
     oc = flatten_card(o.card or '', True)
     exact, other_set, close = [], [], []
     for other, d in data_sets.items():
-        for s, x in d.items():
+        for x in miniature_candidates(o, oc, set_name, d):
             if do_card_templates_match(set_name, o, x) and x.card:
                 # if x.canon != canon:
                 #     continue
@@ -450,6 +577,9 @@ def find_matching_set(mode, template, set_name, data: dict):
         if f"{t}|None|None|None|None|{x}" in data:
             return data[f"{t}|None|None|None|None|{x}"]
 
+    if isinstance(data, ItemIndex):
+        return data.find_by_target_prefix(template, set_name) if set_name else None
+
     partial = []
     for x, y in data.items():
         if (y.template == template or not template) and y.target and set_name:
@@ -712,6 +842,85 @@ def do_urls_match(url, template, d: Item, replace_page, log=False):
     return 0
 
 
+SPLIT_MARKERS = ["&month=", "?var=", "/index.html", "?page="]
+
+
+class UrlIndex(dict):
+    """ The masterlist items by exact URL, along with secondary indexes over the normalized URL forms that
+    do_urls_match recognizes, so that URLs without an exact match only need to check the items that might match them
+    rather than the full masterlist. """
+    def __init__(self, urls: Dict[str, List[Item]], data: Dict[str, Item]):
+        super().__init__(urls)
+        self.lookup: Dict[Tuple[str, str], List[Tuple[int, Item]]] = {}
+        archive = []
+        for n, d in enumerate(data.values()):
+            d_url = prep_url(d.url)
+            self.add("url", d_url, n, d)
+            alternates = [prep_url(d.alternate_url)] if d.alternate_url else []
+            if d.mode == "YT" and d.special:
+                alternates.append(prep_url(d.special))
+                self.add("special", prep_url(d.special), n, d)
+            if d_url.startswith("-"):
+                alternates.append(d_url[1:])
+            for a in alternates:
+                self.add("alt", a, n, d)
+            if d.template == "SonyCite":
+                for a in [d_url, *alternates]:
+                    self.add("sony", a.replace("&resource=features", ""), n, d)
+            if not d_url:
+                continue
+            self.add("lang", clean_language_prefix(d_url), n, d)
+            for x in SPLIT_MARKERS:
+                if x in d_url:
+                    self.add(x, d_url.split(x, 1)[0], n, d)
+            if "/news2" in d_url:
+                m = re.search(r"^(.*?)/.*?/(news[0-9]+)", d_url)
+                if m:
+                    self.add("news", f"{m.group(1)}|{m.group(2)}", n, d)
+            archive.append((d_url.replace(".html", ""), n))
+
+        archive.sort(key=lambda a: a[0])
+        items = list(data.values())
+        self.archive_keys = [a[0] for a in archive]
+        self.archive_items = [(a[1], items[a[1]]) for a in archive]
+
+    def add(self, kind, key, n, d: Item):
+        if (kind, key) not in self.lookup:
+            self.lookup[(kind, key)] = []
+        self.lookup[(kind, key)].append((n, d))
+
+    def candidates(self, url, template, check_sw) -> List[Item]:
+        """ Returns every item that do_urls_match could match to the given (prepared) URL, in masterlist order. """
+        keys = [("url", url), ("alt", url), ("lang", clean_language_prefix(url))]
+        for x in SPLIT_MARKERS:
+            keys.append((x, url.split(x, 1)[0]))
+        if re.search(r"indexp[0-9]\.html", url):
+            keys.append(("url", re.sub(r"indexp[0-9]+\.html", "index.html", url)))
+            keys.append(("url", re.sub(r"indexp([0-9]+)\.html", "index.html?page=\\1", url)))
+        if template == "SWArchive" and "/news2" in url:
+            m = re.search(r"^(.*?)/.*?/(news[0-9]+)", url)
+            if m:
+                keys.append(("news", f"{m.group(1)}|{m.group(2)}"))
+        if template == "SonyCite" and (url.startswith("players/") or url.startswith("en_US/players/")):
+            nu = url.replace("en_US/players/", "").replace("players/", "")
+            keys.append(("sony", nu.replace("&resource=features", "")))
+        if check_sw:
+            keys.append(("special", url))
+
+        found = {}
+        for k in keys:
+            for n, d in self.lookup.get(k, []):
+                found[n] = d
+        if template == "SWArchive":
+            prefix = url.replace(".html", "")
+            i = bisect_left(self.archive_keys, prefix)
+            while i < len(self.archive_keys) and self.archive_keys[i].startswith(prefix):
+                n, d = self.archive_items[i]
+                found[n] = d
+                i += 1
+        return [found[n] for n in sorted(found)]
+
+
 def add_or_remove_piece(u, fx):
     if fx.startswith("/"):
         return u.replace(fx, "") if u.endswith(fx) else f"{u}{fx}"
@@ -818,10 +1027,10 @@ def match_by_url(o: Item, url: str, data: Dict[str, Item], urls: Dict[str, List[
     if o.template == "SWArchive" and "_picview" in url:
         url = re.sub(r"_picview.*?$", ".html", url)
 
-    checked = []
+    checked = set()
     if urls.get(url):
         for d in urls[url]:
-            checked.append(d.full_id())
+            checked.add(d.full_id())
             y = evaluate_match(2, url, o, d, ad, is_old, check_sw, merge, possible, partial_matches, old_versions, new_versions, valid)
             if y:
                 return y
@@ -831,7 +1040,8 @@ def match_by_url(o: Item, url: str, data: Dict[str, Item], urls: Dict[str, List[
         print(f"URL fell through exact URL matching ({len(urls.get(url, []))}): {o.original}")
         return z
 
-    for k, d in data.items():
+    candidates = urls.candidates(url, o.template, check_sw) if isinstance(urls, UrlIndex) else data.values()
+    for d in candidates:
         if d.full_id() in checked:
             continue
         x = do_urls_match(url, o.template, d, replace_page)
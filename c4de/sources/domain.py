@@ -1,6 +1,7 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 import re
 import copy
+import sys
 
 
 SORT_MODES = {
@@ -14,19 +15,34 @@ SORT_MODES = {
 }
 
 
+def intern_str(s: Optional[str]):
+    return sys.intern(s) if s else s
+
+
 class Item:
     """
     :type date: str
     :type target: str
     :type text: str
     """
+    __slots__ = ("master_page", "mode", "sort_mode", "invalid", "original", "target", "text", "parent", "issue",
+                 "issue2", "card", "template", "url", "full_url", "alternate_url", "special", "subset", "collapsed",
+                 "ff_data", "is_appearance", "is_true_appearance", "ref_magazine", "tv", "is_abridged",
+                 "is_audiobook", "german_ad", "is_adaptation", "is_reprint", "external", "unlicensed", "has_content",
+                 "publisher_listing", "collection_type", "format_text", "set_format_text", "no_issue", "old_version",
+                 "is_exception", "unknown", "from_extra", "canon", "non_canon", "both_continuities",
+                 "original_printing", "index", "link_index", "canon_index", "legends_index", "timeline", "date",
+                 "override", "override_date", "original_date", "canon_override", "future", "archivedate",
+                 "parenthetical", "department", "check_both", "self_cite", "followed_redirect", "original_target",
+                 "date_ref", "extra_date", "ab", "repr", "crp", "extra", "bold", "master_text")
+
     def __init__(self, original: str, mode: str, is_app: bool, *, invalid=False, target: str = None, text: str = None,
                  parent: str = None, template: str = None, url: str = None, issue: str = None, subset: str=None,
                  card: str = None, special=None, collapsed=False, format_text: str = None, no_issue=False, ref_magazine=False,
                  full_url: str=None, publisher_listing=False, check_both=False, date="", archivedate="", issue2=None,
                  alternate_url=None):
         self.master_page = None
-        self.mode = "General" if mode == "TV" else mode
+        self.mode = intern_str("General" if mode == "TV" else mode)
         self.sort_mode = SORT_MODES.get(self.mode, 5)
         self.invalid = invalid
         self.original = self.strip(original)
@@ -36,18 +52,18 @@ class Item:
         if self.target and self.target[0].islower():
             self.target = f"{self.target[0].upper()}{self.target[1:]}"
         self.text = self.strip(text)
-        self.parent = self.strip(parent)
+        self.parent = intern_str(self.strip(parent))
         self.issue = self.strip(issue)
         self.issue2 = self.strip(issue2)
         self.card = self.strip(card)
-        self.template = self.strip(template)
+        self.template = intern_str(self.strip(template))
         self.url = self.strip(url)
         self.full_url = self.strip(full_url)
         self.alternate_url = self.strip(alternate_url)
         self.special = self.strip(special)
         self.subset = self.strip(subset)
         self.collapsed = collapsed
-        self.ff_data = {}
+        self.ff_data = None
 
         # media-type flags
         self.is_appearance = is_app
@@ -1,4 +1,7 @@
+import hashlib
 import json
+import os
+import pickle
 import re
 import traceback
 from datetime import datetime
@@ -6,9 +9,10 @@ from typing import Tuple, Optional, List, Dict
 
 from c4de.sources.cleanup import EXTRA
 from pywikibot import Page, Category
-from c4de.sources.domain import Item, FullListData
+from c4de.sources.determine import ItemIndex, UrlIndex
+from c4de.sources.domain import Item, FullListData, intern_str
 from c4de.sources.extract import extract_item, TEMPLATE_MAPPING
-from c4de.common import build_redirects, fix_redirects, log as _log
+from c4de.common import build_redirects, fix_redirects, latest_revision_ids, log as _log
 
 
 SUBPAGES = [
@@ -18,6 +22,14 @@ SUBPAGES = [
     "Canon/Miniatures", "Legends/Miniatures", "Reprint", "Soundtracks", "CardTrader", "LEGO"
 ]
 
+APPEARANCE_PAGES = ["Legends", "Canon", "Audiobook", "Unlicensed", "Audiobook/German", "Crossover", "LEGO"]
+APPEARANCE_EXTRA = ["Extra", "Series", "Collections", "Reprint"]
+TIMELINES = ["Timeline of canon media", "Timeline of Legends media"]
+MODULES = ["Module:FormattedTextLookup/Cards", "Module:CardMiniDB/shared", "Module:CardGameCite/data", "Module:Reprint/data"]
+
+SNAPSHOT_FILE = "c4de/data/sources_snapshot.pickle"
+SNAPSHOT_VERSION = 2
+
 LIST_AT_START = ["Star Wars: Galactic Defense", "Star Wars: Force Arena", "Star Wars: Starfighter Missions", "Unlock!: Star Wars Escape Game"]
 LIST_AT_END = ["Star Wars: Galaxy of Heroes"]
 
@@ -166,63 +178,232 @@ def load_auto_categories(site):
         return reload_auto_categories(site)
 
 
+def web_subpages():
+    return [*range(1990, datetime.now().year + 1), "Special", "Repost", "Current", "Unknown", "External", "Target",
+            "Publisher", "DB", "SWE", "Databank"]
+
+
+def master_list_pages(include_web=True) -> List[str]:
+    """ Lists every page that the appearances, sources and remap data is built from. """
+    pages = [f"Wookieepedia:Appearances/{sp}" for sp in [*APPEARANCE_PAGES, *APPEARANCE_EXTRA, "Remap"]]
+    pages += [f"Wookieepedia:Sources/{sp}" for sp in SUBPAGES]
+    if include_web:
+        pages += [f"Wookieepedia:Sources/Web/{sp}" for sp in web_subpages()]
+    return pages + TIMELINES + MODULES
+
+
+def extract_revision_ids(data: dict, results: Dict[str, int]):
+    pages = data.get("query", {}).get("pages", {})
+    for p in (pages.values() if isinstance(pages, dict) else pages):
+        results[p["title"]] = p.get("lastrevid", 0)
+
+
+def query_category_revision_ids(site, category: str) -> Dict[str, int]:
+    params = {"action": "query", "generator": "categorymembers", "gcmtitle": category, "gcmlimit": "max", "prop": "info"}
+    results = {}
+    while True:
+        data = site.simple_request(**params).submit()
+        extract_revision_ids(data, results)
+        if "continue" not in data:
+            return results
+        params.update(data["continue"])
+
+
+def collect_revision_ids(site, include_web=True) -> Dict[str, int]:
+    revisions = query_category_revision_ids(site, "Category:Wookieepedia Sources Project")
+    revisions.update(latest_revision_ids(site, [t for t in master_list_pages(include_web) if t not in revisions]))
+    return revisions
+
+
+def template_fingerprint(types: dict):
+    return hashlib.sha1(json.dumps(types, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class MasterListCache:
+    """ The parsed entries of each masterlist page, along with the revision IDs they were parsed from, so that a change
+    to a single page only requires that page to be reparsed. """
+    def __init__(self):
+        self.revisions = {}
+        self.templates = None
+        self.timelines = None
+        self.modules = None
+        self.remap = None
+        self.appearance_pages = {}
+        self.source_pages = {}
+        self.appearances = None
+        self.sources = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["appearances"] = None
+        state["sources"] = None
+        return state
+
+    def all_items(self):
+        for records, _, _ in self.appearance_pages.values():
+            for r in records:
+                yield r[0]
+        for items, _, _ in self.source_pages.values():
+            yield from items
+
+
+def refresh_master_lists(site, types, cache: MasterListCache, revisions: Dict[str, int], force=False) -> List[str]:
+    """ Reparses the masterlist pages whose revisions have changed since they were last parsed, and rebuilds the
+    appearances and sources data from the cached entries. Changes to the timelines or card modules require all
+    appearances or sources pages to be reparsed, respectively. Returns the list of reparsed pages. """
+    fingerprint = template_fingerprint(types)
+    force = force or cache.templates != fingerprint
+    changed = {t for t in master_list_pages() if force or t not in cache.revisions or revisions.get(t) != cache.revisions[t]}
+    if not changed and cache.appearances and cache.sources:
+        return []
+
+    if cache.timelines is None or any(t in changed for t in TIMELINES):
+        cache.timelines = load_timelines(site, types)
+        changed.update(f"Wookieepedia:Appearances/{sp}" for sp in appearance_subpages())
+    if cache.modules is None or any(t in changed for t in MODULES):
+        cache.modules = load_card_modules(site)
+        changed.update(f"Wookieepedia:Sources/{sp}" for sp in source_subpages())
+    if cache.remap is None or "Wookieepedia:Appearances/Remap" in changed:
+        cache.remap = load_remap(site)
+
+    reparsed = []
+    for sp in appearance_subpages():
+        if f"Wookieepedia:Appearances/{sp}" in changed or sp not in cache.appearance_pages:
+            entries = load_appearance_page(site, sp, False)
+            records, count = parse_appearance_entries(site, entries, types, cache.timelines)
+            cache.appearance_pages[sp] = (records, len(entries), count)
+            reparsed.append(f"Wookieepedia:Appearances/{sp}")
+    for sp in source_subpages():
+        if f"Wookieepedia:Sources/{sp}" in changed or sp not in cache.source_pages:
+            entries = load_source_page(site, sp, False)
+            items, count = parse_source_entries(entries, types, cache.modules)
+            cache.source_pages[sp] = (items, len(entries), count)
+            reparsed.append(f"Wookieepedia:Sources/{sp}")
+
+    if reparsed:
+        print(f"Reparsed {len(reparsed)} masterlist pages")
+    if cache.appearances is None or any(t.startswith("Wookieepedia:Appearances/") for t in reparsed):
+        pages = [cache.appearance_pages[sp] for sp in appearance_subpages()]
+        records = [r for p in pages for r in p[0]]
+        cache.appearances = build_appearance_data(records, sum(p[1] for p in pages), sum(p[2] for p in pages))
+    if cache.sources is None or any(t.startswith("Wookieepedia:Sources/") for t in reparsed):
+        pages = [cache.source_pages[sp] for sp in source_subpages()]
+        items = [x for p in pages for x in p[0]]
+        cache.sources = build_source_data(items, cache.modules, sum(p[1] for p in pages), sum(p[2] for p in pages))
+
+    cache.revisions = dict(revisions)
+    cache.templates = fingerprint
+    return reparsed
+
+
+def save_snapshot(cache: MasterListCache):
+    data = {"version": SNAPSHOT_VERSION, "cache": cache}
+    try:
+        with open(f"{SNAPSHOT_FILE}.tmp", "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{SNAPSHOT_FILE}.tmp", SNAPSHOT_FILE)
+        print(f"Saved sources snapshot for {len(cache.revisions)} pages")
+    except Exception as e:
+        print(f"Encountered {type(e)} while saving sources snapshot", e)
+
+
+def load_snapshot() -> MasterListCache:
+    """ Loads the parsed masterlist pages from the local snapshot; pages whose revisions have changed since the
+    snapshot was taken will be reparsed by refresh_master_lists. """
+    if not os.path.exists(SNAPSHOT_FILE):
+        return MasterListCache()
+    try:
+        with open(SNAPSHOT_FILE, "rb") as f:
+            data = pickle.load(f)
+    except Exception as e:
+        print(f"Encountered {type(e)} while loading sources snapshot", e)
+        return MasterListCache()
+    if data.get("version") != SNAPSHOT_VERSION:
+        return MasterListCache()
+
+    cache = data["cache"]
+    today = datetime.now().strftime("%Y-%m-%d")
+    for x in cache.all_items():
+        x.future = x.date and (x.date == 'Future' or x.date > today)
+    print(f"Loaded sources snapshot for {len(cache.revisions)} pages")
+    return cache
+
+
 # TODO: Split Appearances category by type
 
-def load_appearances(site, log, canon_only=False, legends_only=False):
-    data = []
-    pages = ["Legends", "Canon", "Audiobook", "Unlicensed", "Audiobook/German", "Crossover", "LEGO"]
-    other = ["Extra", "Series", "Collections", "Reprint"]
+def appearance_subpages(canon_only=False, legends_only=False):
     if canon_only:
-        pages = ["Canon", "Audiobook"]
+        return ["Canon", "Audiobook", *APPEARANCE_EXTRA]
     elif legends_only:
-        pages = ["Legends", "Audiobook"]
-    for sp in [*pages, *other]:
-        i = 0
-        collection_type = None
-        p = Page(site, f"Wookieepedia:Appearances/{sp}")
-        for line in p.get().splitlines():
-            if line and sp in ("Extra", "Series") and line.startswith("=="):
-                if "anthologies" in line:
-                    collection_type = "anthology"
-                elif "Individual issues" in line:
-                    collection_type = "individual"
-                elif "reprint magazine" in line:
-                    collection_type = "reprint"
-                elif "Toy lines" in line:
-                    collection_type = "toy"
-                elif "reprint" in line.lower():
-                    collection_type = "reprint"
-                else:
-                    collection_type = None
-            elif line and not line.startswith("=="):
-                if "/Header}}" in line or line.startswith("----"):
-                    continue
-                x = re.search(r"[*#](.*?)( \(.*?\))?:(<!--.*?-->)? (.*?)$", line)
-                if x:
-                    i += 1
-                    data.append({"index": i, "page": f"Appearances/{sp}", "date": x.group(1), "item": x.group(4),
-                                 "canon": "Canon" in sp, "extra": sp in other, "audiobook": "Audiobook" in sp,
-                                 "collectionType": collection_type, "master": sp == "Legends" or sp == "Canon"})
-                else:
-                    print(f"{p.title()}: Cannot parse line: {line}")
-        if log:
-            print(f"Loaded {i} appearances from Wookieepedia:Appearances/{sp}")
+        return ["Legends", "Audiobook", *APPEARANCE_EXTRA]
+    return [*APPEARANCE_PAGES, *APPEARANCE_EXTRA]
+
+
+def load_appearances(site, log, canon_only=False, legends_only=False):
+    data = []
+    for sp in appearance_subpages(canon_only, legends_only):
+        data += load_appearance_page(site, sp, log)
+    return data
+
 
+def load_appearance_page(site, sp, log):
+    data = []
+    i = 0
+    collection_type = None
+    p = Page(site, f"Wookieepedia:Appearances/{sp}")
+    for line in p.get().splitlines():
+        if line and sp in ("Extra", "Series") and line.startswith("=="):
+            if "anthologies" in line:
+                collection_type = "anthology"
+            elif "Individual issues" in line:
+                collection_type = "individual"
+            elif "reprint magazine" in line:
+                collection_type = "reprint"
+            elif "Toy lines" in line:
+                collection_type = "toy"
+            elif "reprint" in line.lower():
+                collection_type = "reprint"
+            else:
+                collection_type = None
+        elif line and not line.startswith("=="):
+            if "/Header}}" in line or line.startswith("----"):
+                continue
+            x = re.search(r"[*#](.*?)( \(.*?\))?:(<!--.*?-->)? (.*?)$", line)
+            if x:
+                i += 1
+                data.append({"index": i, "page": f"Appearances/{sp}", "date": x.group(1), "item": x.group(4),
+                             "canon": "Canon" in sp, "extra": sp in APPEARANCE_EXTRA, "audiobook": "Audiobook" in sp,
+                             "collectionType": collection_type, "master": sp == "Legends" or sp == "Canon"})
+            else:
+                print(f"{p.title()}: Cannot parse line: {line}")
+    if log:
+        print(f"Loaded {i} appearances from Wookieepedia:Appearances/{sp}")
     return data
 
 
+def source_subpages(include_web=True):
+    if not include_web:
+        return list(SUBPAGES)
+    return [*SUBPAGES, *(f"Web/{y}" for y in web_subpages())]
+
+
 def load_source_lists(site, log, include_web=True):
     data = []
-    for sp in SUBPAGES:
-        i = 0
-        skip = False
-        p = Page(site, f"Wookieepedia:Sources/{sp}")
-        lines = p.get().splitlines()
-        bad = []
-        for o, line in enumerate(lines):
-            # if skip:
-            #     skip = False
-            #     continue
+    for sp in source_subpages(include_web):
+        data += load_source_page(site, sp, log)
+    return data
+
+
+DB_PAGES = {"DB": "2011-09-13", "SWE": "2014-07-01", "Databank": "Current"}
+
+
+def load_source_page(site, sp, log):
+    data = []
+    i = 0
+    p = Page(site, f"Wookieepedia:Sources/{sp}")
+    y = sp.replace("Web/", "")
+    if sp in SUBPAGES:
+        for line in p.get().splitlines():
             if line and not line.startswith("==") and "/Header}}" not in line and not line.startswith("----"):
                 line = line.replace(" |reprint=", "|reprint=")
                 if "Miniatures" in sp or "RefMagazine" in sp or "CardSets" in sp or "CardTrader" in sp:
@@ -242,90 +423,69 @@ def load_source_lists(site, log, include_web=True):
                                  "canon": None if "/" not in sp else "Canon" in sp, "ref": x.group("r")})
                 else:
                     print(f"{p.title()}: Cannot parse line: {line}")
-        if log:
-            print(f"Loaded {i} sources from Wookieepedia:Sources/{sp}")
-    if not include_web:
-        return data
-
-    for y in [*range(1990, datetime.now().year + 1), "Special", "Repost"]:
-        i = 0
-        p = Page(site, f"Wookieepedia:Sources/Web/{y}")
-        if p.exists():
-            lines = p.get().splitlines()
-            for o, line in enumerate(lines):
-                if "/Header}}" in line or line.startswith("----"):
-                    continue
-                x = re.search(r"\*([RP]: )?(?P<d>.*?):(?P<r><ref.*?(</ref>|/>))? *(?P<t>.*?) ?†?( {{C\|1?=?(original|alternate): (?P<a>.*?)}})?( {{C\|int: (?P<i>.*?)}})?( {{C\|d: [0-9X-]+?}})? ?†?$", line)
-                if x:
-                    i += 1
-                    data.append({"index": i, "page": "Web/Repost" if y == "Special" else f"Web/{y}", "date": x.group("d"), "item": x.group("t"),
-                                 "alternate": x.group("a"), "int": x.group("i"), "ref": x.group("r")})
-                else:
-                    print(f"{p.title()}: Cannot parse line: {line}")
-            if log:
-                print(f"Loaded {i} sources from Wookieepedia:Sources/Web/{y}")
 
-    p = Page(site, f"Wookieepedia:Sources/Web/Current")
-    i = 0
-    for line in p.get().splitlines():
-        if "/Header}}" in line or line.startswith("----"):
-            continue
-        x = re.search(r"\*Current:(?P<r><ref.*?(</ref>|/>))? (?P<t>.*?)( †)?( {{C\|1?=?(original|alternate): (?P<a>.*?)}})? ?†?$", line)
-        if x:
-            i += 1
-            data.append({"index": i, "page": "Web/Current", "date": "Current", "item": x.group("t"),
-                         "alternate": x.group("a"), "ref": x.group("r")})
-        else:
-            print(f"{p.title()}: Cannot parse line: {line}")
-    if log:
-        print(f"Loaded {i} sources from Wookieepedia:Sources/Current")
+    elif y.isnumeric() or y in ("Special", "Repost"):
+        if not p.exists():
+            return data
+        for line in p.get().splitlines():
+            if "/Header}}" in line or line.startswith("----"):
+                continue
+            x = re.search(r"\*([RP]: )?(?P<d>.*?):(?P<r><ref.*?(</ref>|/>))? *(?P<t>.*?) ?†?( {{C\|1?=?(original|alternate): (?P<a>.*?)}})?( {{C\|int: (?P<i>.*?)}})?( {{C\|d: [0-9X-]+?}})? ?†?$", line)
+            if x:
+                i += 1
+                data.append({"index": i, "page": "Web/Repost" if y == "Special" else f"Web/{y}", "date": x.group("d"), "item": x.group("t"),
+                             "alternate": x.group("a"), "int": x.group("i"), "ref": x.group("r")})
+            else:
+                print(f"{p.title()}: Cannot parse line: {line}")
 
-    p = Page(site, f"Wookieepedia:Sources/Web/Unknown")
-    i = 0
-    for line in p.get().splitlines():
-        if "/Header}}" in line or line.startswith("----"):
-            continue
-        x = re.search(r"\*(.*?):( [0-9:-]+)? (.*?)( †)?( {{C\|1?=?(original|alternate): (.*?)}})?( \{\{C\|[Nn]on-canon}})?$", line)
-        if x:
-            i += 1
-            data.append({"index": i, "page": "Web/Unknown", "date": "Unknown", "item": x.group(3) + (x.group(8) or ''), "alternate": x.group(7), "official": x.group(1) == "OfficialSite"})
-        else:
-            print(f"{p.title()}: Cannot parse line: {line}")
-    if log:
-        print(f"Loaded {i} sources from Wookieepedia:Sources/Web/Unknown")
+    elif y == "Current":
+        for line in p.get().splitlines():
+            if "/Header}}" in line or line.startswith("----"):
+                continue
+            x = re.search(r"\*Current:(?P<r><ref.*?(</ref>|/>))? (?P<t>.*?)( †)?( {{C\|1?=?(original|alternate): (?P<a>.*?)}})? ?†?$", line)
+            if x:
+                i += 1
+                data.append({"index": i, "page": "Web/Current", "date": "Current", "item": x.group("t"),
+                             "alternate": x.group("a"), "ref": x.group("r")})
+            else:
+                print(f"{p.title()}: Cannot parse line: {line}")
 
-    for sp in ["External", "Target", "Publisher"]:
-        p = Page(site, f"Wookieepedia:Sources/Web/{sp}")
-        i = 0
+    elif y == "Unknown":
+        for line in p.get().splitlines():
+            if "/Header}}" in line or line.startswith("----"):
+                continue
+            x = re.search(r"\*(.*?):( [0-9:-]+)? (.*?)( †)?( {{C\|1?=?(original|alternate): (.*?)}})?( \{\{C\|[Nn]on-canon}})?$", line)
+            if x:
+                i += 1
+                data.append({"index": i, "page": "Web/Unknown", "date": "Unknown", "item": x.group(3) + (x.group(8) or ''), "alternate": x.group(7), "official": x.group(1) == "OfficialSite"})
+            else:
+                print(f"{p.title()}: Cannot parse line: {line}")
+
+    elif y in ("External", "Target", "Publisher"):
         for line in p.get().splitlines():
             if "/Header}}" in line or not line.strip():
                 continue
             x = re.search(r"[#*]([RP]: )?(?P<d>.*?):(?P<r><ref.*?(</ref>|/>))? (?P<t>.*?) ?†?( {{C\|1?=?(original|alternate): (?P<a>[^{}\[\]|]+?)}})?( {{C\|d: [0-9X-]+?}})?(?P<x> \{\{C\|[Nn]on-canon}})?$", line)
             if x:
                 i += 1
-                data.append({"index": i, "page": f"Web/{sp}", "date": x.group('d'), "item": x.group('t') + (x.group('x') or ''), "alternate": x.group('a')})
+                data.append({"index": i, "page": f"Web/{y}", "date": x.group('d'), "item": x.group('t') + (x.group('x') or ''), "alternate": x.group('a')})
             else:
                 print(f"{p.title()}: Cannot parse line: {line}")
-        if log:
-            print(f"Loaded {i} sources from Wookieepedia:Sources/{sp}")
 
-    db_pages = {"DB": "2011-09-13", "SWE": "2014-07-01", "Databank": "Current"}
-    for template, date in db_pages.items():
-        p = Page(site, f"Wookieepedia:Sources/Web/{template}")
-        i = 0
+    elif y in DB_PAGES:
         for line in p.get().splitlines():
             if "/Header}}" in line or not line.strip():
                 continue
             x = re.search(r"\*((?P<d>.*?):(?P<r><ref.*?(</ref>|/>))? )?(?P<t>{{.*?)( {{C\|1?=?(original|alternate): (?P<a>.*?)}})?$", line)
             if x:
                 i += 1
-                data.append({"index": 0, "page": f"Web/{template}", "date": date, "item": x.group("t"),
+                data.append({"index": 0, "page": f"Web/{y}", "date": DB_PAGES[y], "item": x.group("t"),
                              "extraDate": x.group("d"), "ref": x.group("r"), "alternate": x.group('a')})
             else:
                 print(f"{p.title()}: Cannot parse line: {line}")
-        if log:
-            print(f"Loaded {i} sources from Wookieepedia:Sources/Web/{template}")
 
+    if log:
+        print(f"Loaded {i} sources from {p.title()}")
     return data
 
 
@@ -371,14 +531,14 @@ def remove_flag(item: str, replacement: str):
 
 
 def store_data(x: Item, i: dict, old: str, extra: str, parenthetical: str, alternate: str, is_reprint: bool, today: str):
-    x.master_page = i['page']
+    x.master_page = intern_str(i['page'])
     x.canon = None if i.get('extra') else i.get('canon')
     x.from_extra = i.get('extra')
     if i['page'] == "Web/Target":
         x.original_date = i['date']
         x.date = "Target"
     else:
-        x.date = i['date']
+        x.date = intern_str(i['date'])
     x.future = x.date and (x.date == 'Future' or x.date > today)
     x.extra = extra or ''
     x.parenthetical = parenthetical
@@ -422,14 +582,13 @@ def record_reprints(reprints, x: Item):
         print(f"Unexpected state: reprint with no target: {x.original}")
 
 
-def load_full_sources(site, types, log, include_web=True) -> FullListData:
-    sources = load_source_lists(site, log, include_web)
+def load_card_modules(site):
     set_formatting = {}
-    for ln in Page(site, "Module:FormattedTextLookup/Cards").get().splitlines():
+    for ln in Page(site, MODULES[0]).get().splitlines():
         x = re.search(r"\[['\"](.*?)['\"]] ?= ?\"(.*?)\"", ln)
         if x:
             set_formatting[x.group(1)] = x.group(2)
-    for ln in Page(site, "Module:CardMiniDB/shared").get().splitlines():
+    for ln in Page(site, MODULES[1]).get().splitlines():
         x = re.search(r"\[['\"](.*?)['\"]] ?= ?\"('*)?\[\[(.*?)]]('*)?\"", ln)
         if x and "|Core Set" not in ln:
             link, _, fmt = x.group(3).partition("|")
@@ -439,29 +598,32 @@ def load_full_sources(site, types, log, include_web=True) -> FullListData:
                 set_formatting[link] = x.group(2) + link + x.group(4)
 
     italic_templates = []
-    for z in re.findall(r"([ \t]+([A-z]+) = \{[ \t]*((\n.*?)+?)\n[ \t]+},)",  Page(site, "Module:CardGameCite/data").get()):
+    for z in re.findall(r"([ \t]+([A-z]+) = \{[ \t]*((\n.*?)+?)\n[ \t]+},)",  Page(site, MODULES[2]).get()):
         if "noItalics" not in z[0]:
             italic_templates.append(z[1])
-    departments, all_departments, department_map = set(), {}, {}
-    for z in re.findall(r"\[\"(.*?)-([0-9]+)\"] = \{.*?issues ?= ?\{(.*?)}", Page(site, "Module:Reprint/data").get()):
+    all_departments = {}
+    for z in re.findall(r"\[\"(.*?)-([0-9]+)\"] = \{.*?issues ?= ?\{(.*?)}", Page(site, MODULES[3]).get()):
         a = z[0].replace(" (department)", "")
-        departments.add(z[0])
-        departments.add(a)
         all_departments[f"{a}|{z[1]}"] = re.findall(r'"(.*?)"', z[2])
 
     print(f"Loaded formatting text for {len(set_formatting)} sets")
+    return set_formatting, italic_templates, all_departments
 
+
+def load_full_sources(site, types, log, include_web=True) -> FullListData:
+    modules = load_card_modules(site)
+    sources = load_source_lists(site, log, include_web)
+    items, count = parse_source_entries(sources, types, modules)
+    return build_source_data(items, modules, len(sources), count)
+
+
+def parse_source_entries(sources: List[dict], types, modules) -> Tuple[List[Item], int]:
+    """ Extracts the items from the given masterlist entries. The results are not modified when building the
+    FullListData, so they can be reused if only some of the masterlist pages change. """
+    set_formatting, italic_templates, _ = modules
     count = 0
-    unique_sources = {}
-    full_sources = {}
-    target_sources = {}
-    both_continuities = set()
     today = datetime.now().strftime("%Y-%m-%d")
-    ff_data = {}
-    reprints = {}
-    card_suffixes = {}
-    by_parent = {}
-    urls = {}
+    results = []
     for i in sources:
         item = i['item']
         old = f"{i['item']}"
@@ -491,70 +653,89 @@ def load_full_sources(site, types, log, include_web=True) -> FullListData:
                 x.date_ref = i.get('ref')
                 x.extra_date = i.get('extraDate')
 
-                if x.parent:
-                    if x.parent not in by_parent:
-                        by_parent[x.parent] = []
-                    by_parent[x.parent].append(x)
-                if x.url:
-                    if x.url not in urls:
-                        urls[x.url] = []
-                    urls[x.url].append(x)
-                if x.alternate_url:
-                    if x.alternate_url not in urls:
-                        urls[x.alternate_url] = []
-                    urls[x.alternate_url].append(x)
-
                 if x.target in set_formatting:
                     x.set_format_text = set_formatting[x.target]
                 elif x.template in italic_templates:
                     x.set_format_text = "''" + x.target.split(" (")[0] + "''"
-
-                if x.master_page.endswith("CardSets") and x.parenthetical:
-                    if x.template not in card_suffixes:
-                        card_suffixes[x.template] = {}
-                    card_suffixes[x.template][x.target.replace(f" ({parenthetical})", "")] = x.target
-                elif x.is_card_or_mini() and x.card:
-                    if x.template in card_suffixes and x.parent in card_suffixes[x.template]:
-                        x.parent = card_suffixes[x.template][x.parent]
-
-                full_sources[x.full_id()] = x
-                unique_sources[x.unique_id()] = x
-                if x.target:
-                    check_for_both_continuities(x, target_sources, both_continuities)
-
-                if x.ff_data:
-                    if x.issue not in ff_data:
-                        ff_data[x.issue] = []
-                    ff_data[x.issue].append(x)
-
-                if x.target and x.issue and f"{x.target.replace(' (department)', '')}|{x.issue}" in all_departments:
-                    zx = x.target.replace(' (department)', '')
-                    for v in all_departments[f"{zx}|{x.issue}"]:
-                        if f"{zx}|{v}" in department_map:
-                            department_map[f"{zx}|{v}"].append(x)
-                        else:
-                            department_map[f"{zx}|{v}"] = [x]
-                elif x.target and x.parent and is_reprint and f"{x.target.replace(' (department)', '')}|{x.parent}" in department_map:
-                    zx = x.target.replace(' (department)', '')
-                    targets = department_map[f"{zx}|{x.parent}"]
-                    if len(targets) > 1:
-                        tx = [t for t in targets if x.format_text and (x.format_text == t.format_text or x.format_text.startswith(f"{t.format_text}: ") or x.format_text.startswith(f"{t.format_text}'"))]
-                        targets = tx or targets
-
-                    if targets:
-                        if f"{zx}|{targets[0].issue}" not in reprints:
-                            reprints[f"{zx}|{targets[0].issue}"] = []
-                        reprints[f"{zx}|{targets[0].issue}"].append(x)
-                        x.original_printing = targets[0]
-
-                elif is_reprint:
-                    record_reprints(reprints, x)
-
+                results.append(x)
             else:
                 print(f"Unrecognized: {item}")
                 count += 1
         except Exception as e:
             print(f"{type(e)}: {e} -> {item}")
+    return results, count
+
+
+def build_source_data(items: List[Item], modules, total, count) -> FullListData:
+    all_departments = modules[2]
+    unique_sources = {}
+    full_sources = {}
+    target_sources = {}
+    both_continuities = set()
+    ff_data = {}
+    reprints = {}
+    card_suffixes = {}
+    department_map = {}
+    by_parent = {}
+    urls = {}
+    for o in items:
+        x = o.copy()
+        try:
+            if x.parent:
+                if x.parent not in by_parent:
+                    by_parent[x.parent] = []
+                by_parent[x.parent].append(x)
+            if x.url:
+                if x.url not in urls:
+                    urls[x.url] = []
+                urls[x.url].append(x)
+            if x.alternate_url:
+                if x.alternate_url not in urls:
+                    urls[x.alternate_url] = []
+                urls[x.alternate_url].append(x)
+
+            if x.master_page.endswith("CardSets") and x.parenthetical:
+                if x.template not in card_suffixes:
+                    card_suffixes[x.template] = {}
+                card_suffixes[x.template][x.target.replace(f" ({x.parenthetical})", "")] = x.target
+            elif x.is_card_or_mini() and x.card:
+                if x.template in card_suffixes and x.parent in card_suffixes[x.template]:
+                    x.parent = card_suffixes[x.template][x.parent]
+
+            full_sources[x.full_id()] = x
+            unique_sources[x.unique_id()] = x
+            if x.target:
+                check_for_both_continuities(x, target_sources, both_continuities)
+
+            if x.ff_data:
+                if x.issue not in ff_data:
+                    ff_data[x.issue] = []
+                ff_data[x.issue].append(x)
+
+            if x.target and x.issue and f"{x.target.replace(' (department)', '')}|{x.issue}" in all_departments:
+                zx = x.target.replace(' (department)', '')
+                for v in all_departments[f"{zx}|{x.issue}"]:
+                    if f"{zx}|{v}" in department_map:
+                        department_map[f"{zx}|{v}"].append(x)
+                    else:
+                        department_map[f"{zx}|{v}"] = [x]
+            elif x.target and x.parent and x.is_reprint and f"{x.target.replace(' (department)', '')}|{x.parent}" in department_map:
+                zx = x.target.replace(' (department)', '')
+                targets = department_map[f"{zx}|{x.parent}"]
+                if len(targets) > 1:
+                    tx = [t for t in targets if x.format_text and (x.format_text == t.format_text or x.format_text.startswith(f"{t.format_text}: ") or x.format_text.startswith(f"{t.format_text}'"))]
+                    targets = tx or targets
+
+                if targets:
+                    if f"{zx}|{targets[0].issue}" not in reprints:
+                        reprints[f"{zx}|{targets[0].issue}"] = []
+                    reprints[f"{zx}|{targets[0].issue}"].append(x)
+                    x.original_printing = targets[0]
+
+            elif x.is_reprint:
+                record_reprints(reprints, x)
+        except Exception as e:
+            print(f"{type(e)}: {e} -> {x.original}")
     for k, v in ff_data.items():
         target_sources[f"FFData|{k}"] = v
     for k, v in reprints.items():
@@ -574,26 +755,30 @@ def load_full_sources(site, types, log, include_web=True) -> FullListData:
                 x = target_sources[k][0]
                 for i in v:
                     i.original_printing = x
-    _log(f"{count} out of {len(sources)} unmatched: {count / len(sources) * 100}")
-    return FullListData(unique_sources, full_sources, urls, target_sources, by_parent, set(), both_continuities, reprints)
+    _log(f"{count} out of {total} unmatched: {count / total * 100}")
+    return FullListData(ItemIndex(unique_sources), full_sources, UrlIndex(urls, unique_sources), target_sources, by_parent,
+                        set(), both_continuities, reprints)
+
+
+def load_timelines(site, types):
+    cx, canon, c_unknown = parse_new_timeline(Page(site, TIMELINES[0]), types)
+    lx, legends, l_unknown = parse_new_timeline(Page(site, TIMELINES[1]), types)
+    return cx, canon, c_unknown, lx, legends, l_unknown
 
 
 def load_full_appearances(site, types, log, canon_only=False, legends_only=False, log_match=True) -> FullListData:
     appearances = load_appearances(site, log, canon_only=canon_only, legends_only=legends_only)
-    cx, canon, c_unknown = parse_new_timeline(Page(site, "Timeline of canon media"), types)
-    lx, legends, l_unknown = parse_new_timeline(Page(site, "Timeline of Legends media"), types)
+    records, count = parse_appearance_entries(site, appearances, types, load_timelines(site, types), log_match)
+    return build_appearance_data(records, len(appearances), count)
+
+
+def parse_appearance_entries(site, appearances: List[dict], types, timelines, log_match=True) -> Tuple[List[tuple], int]:
+    """ Extracts the items from the given masterlist entries, and matches them against the media timelines. Each
+    result also records the item's original ID and target, which are used to detect duplicate entries. """
+    cx, canon, c_unknown, lx, legends, l_unknown = timelines
     count = 0
-    unique_appearances = {}
-    full_appearances = {}
-    target_appearances = {}
-    parentheticals = set()
-    both_continuities = set()
     today = datetime.now().strftime("%Y-%m-%d")
-    no_canon_index = []
-    no_legends_index = []
-    reprints = {}
-    by_parent = {}
-    urls = {}
+    results = []
     for i in appearances:
         item = i['item']
         old = f"{i['item']}"
@@ -610,17 +795,8 @@ def load_full_appearances(site, types, log, canon_only=False, legends_only=False
             if is_extra:
                 i['extra'] = True
             x = extract_item(remove_templates(item), True, i['page'], types, master=True)
-            if x and x.unique_id() in unique_appearances:
-                if x.template == "Film" or x.template == "TCW" or x.target == "Star Wars: The Clone Wars (film)":
-                    x.both_continuities = True
-                    both_continuities.add(x.target)
-                    continue
-                elif x.canon != unique_appearances[x.unique_id()].canon:
-                    x.both_continuities = True
-                    both_continuities.add(x.target)
-                    continue
-
             if x:
+                original_id, original_target = x.unique_id(), x.target
                 store_data(x, i, old, extra, parenthetical, alternate, is_reprint, today)
 
                 x.is_appearance = "{{c|source}}" not in old.lower()
@@ -636,25 +812,11 @@ def load_full_appearances(site, types, log, canon_only=False, legends_only=False
                 x.index = i['index']
                 if x.template == "SchAdv" or x.template == "EpIAdv":
                     x.original = f"''[[{x.target}]]''"
-
-                full_appearances[x.full_id()] = x
-                unique_appearances[x.unique_id()] = x
-                if x.parent:
-                    if x.parent not in by_parent:
-                        by_parent[x.parent] = []
-                    by_parent[x.parent].append(x)
-                if x.url:
-                    if x.url not in urls:
-                        urls[x.url] = []
-                    urls[x.url].append(x)
-                if x.alternate_url:
-                    if x.alternate_url not in urls:
-                        urls[x.alternate_url] = []
-                    urls[x.alternate_url].append(x)
                 if "Crossover" in i['page'] or "LEGO" in i['page']:
                     x.non_canon = True
                     x.both_continuities = True
 
+                c, l = False, False
                 if x.target:
                     x.is_adaptation = (lx.get(x.target, {}) or cx.get(x.target, {})).get("adaptation", False)
                     c, l = determine_index(x, f"{x.issue}-{x.target}" if x.target == "Galaxywide NewsNets" else x.target, i, canon, legends, c_unknown, l_unknown, log_match)
@@ -665,32 +827,72 @@ def load_full_appearances(site, types, log, canon_only=False, legends_only=False
                             c, l = determine_index(x, x.target, i, canon, legends, c_unknown, l_unknown, log_match)
                             if not c or not l:
                                 print(f"Reconnected {y.title()} redirect to {x.target}")
-                    if c:
-                        no_canon_index.append(x)
-                    if l:
-                        no_legends_index.append(x)
-
-                    if x.target.endswith(")") and not x.target.endswith("webcomic)"):
-                        parentheticals.add(x.target.rsplit(" (", 1)[0])
-                    if x.parent and x.parent.endswith(")") and not x.parent.endswith("webcomic)"):
-                        parentheticals.add(x.parent.rsplit(" (", 1)[0])
-
-                    check_for_both_continuities(x, target_appearances, both_continuities)
                 elif x.parent and "scenario=" not in x.original:
                     c, l = determine_index(x, x.parent, i, canon, legends, c_unknown, l_unknown, log_match)
-                    if c:
-                        no_canon_index.append(x)
-                    if l:
-                        no_legends_index.append(x)
-
-                if is_reprint:
-                    record_reprints(reprints, x)
+                results.append((x, original_id, original_target, c, l))
             else:
                 print(f"Unrecognized: {item}")
                 count += 1
         except Exception as e:
             traceback.print_exc()
             print(f"{type(e)}: {e}: {item}")
+    return results, count
+
+
+def build_appearance_data(records: List[tuple], total, count) -> FullListData:
+    unique_appearances = {}
+    full_appearances = {}
+    target_appearances = {}
+    parentheticals = set()
+    both_continuities = set()
+    no_canon_index = []
+    no_legends_index = []
+    reprints = {}
+    by_parent = {}
+    urls = {}
+    for o, original_id, original_target, c, l in records:
+        if original_id in unique_appearances:
+            if o.template == "Film" or o.template == "TCW" or original_target == "Star Wars: The Clone Wars (film)":
+                both_continuities.add(original_target)
+                continue
+            elif unique_appearances[original_id].canon is not None:
+                both_continuities.add(original_target)
+                continue
+
+        x = o.copy()
+        try:
+            full_appearances[x.full_id()] = x
+            unique_appearances[x.unique_id()] = x
+            if x.parent:
+                if x.parent not in by_parent:
+                    by_parent[x.parent] = []
+                by_parent[x.parent].append(x)
+            if x.url:
+                if x.url not in urls:
+                    urls[x.url] = []
+                urls[x.url].append(x)
+            if x.alternate_url:
+                if x.alternate_url not in urls:
+                    urls[x.alternate_url] = []
+                urls[x.alternate_url].append(x)
+
+            if c:
+                no_canon_index.append(x)
+            if l:
+                no_legends_index.append(x)
+            if x.target:
+                if x.target.endswith(")") and not x.target.endswith("webcomic)"):
+                    parentheticals.add(x.target.rsplit(" (", 1)[0])
+                if x.parent and x.parent.endswith(")") and not x.parent.endswith("webcomic)"):
+                    parentheticals.add(x.parent.rsplit(" (", 1)[0])
+
+                check_for_both_continuities(x, target_appearances, both_continuities)
+
+            if x.is_reprint:
+                record_reprints(reprints, x)
+        except Exception as e:
+            traceback.print_exc()
+            print(f"{type(e)}: {e}: {x.original}")
 
     for k, v in reprints.items():
         if k in target_appearances:
@@ -698,10 +900,10 @@ def load_full_appearances(site, types, log, canon_only=False, legends_only=False
             for i in v:
                 i.original_printing = x
 
-    _log(f"{count} out of {len(appearances)} unmatched: {count / len(appearances) * 100}")
+    _log(f"{count} out of {total} unmatched: {count / total * 100}")
     _log(f"{len(no_canon_index)} canon items found without index")
     _log(f"{len(no_legends_index)} Legends items found without index")
-    return FullListData(unique_appearances, full_appearances, urls, target_appearances, by_parent, parentheticals,
+    return FullListData(ItemIndex(unique_appearances), full_appearances, UrlIndex(urls, unique_appearances), target_appearances, by_parent, parentheticals,
                         both_continuities, reprints, no_canon_index, no_legends_index)
 
 
@@ -147,6 +147,48 @@ CORE_SETS = {
 DEPARTMENTS = ["A Certain Point of View", "Bantha Tracks", "Blaster", "Books", "Bounty Hunters", "Comics", "Comlink",
                "Crossword", "Games", "Jedi Archive", "Jedi Library", "Red Five", "Rogues Gallery", "Toys", "Versus"]
 
+# Patterns applied to every line by extract_item, compiled once at import time; the regex module's internal cache is
+# too small to hold every pattern used while parsing the masterlists, so inline patterns get recompiled constantly
+LISTING_RX = re.compile(r"\{\{(Series|Unknown)Listing.*?}} ?")
+EMPTY_PARAM_RX = re.compile(r"\|[a-z ]+=\|")
+BROKEN_TEMPLATE_RX = re.compile(r"{{([A-z]+)]]")
+UNDERSCORE_LINK_RX = re.compile(r"\[\[([^]|\n]+)_")
+VOLUME_RX = re.compile(r"\|volume=([0-9])\|([0-9]+)\|")
+COMMENT_RX = re.compile(r"<!--.*?-->")
+ANCHOR_RX = re.compile(r"^(.*?\[\[.*?[^ ])#(.*?)(\|.*?]].*?)$")
+AB_RX = re.compile(r" ?\{\{Ab\|.*?}}")
+REPRINT_RX = re.compile(r" ?\{\{[Rr]eprint\|.*?}}")
+SPACED_PARAM_RX = re.compile(r"[ ]+(\|[a-z _]+=)")
+ITALIC_LINK_RX = re.compile(r"''(\[[^\[].*?[^]]])''")
+PLAIN_URL_RX = re.compile(r"\[(https?://)(w?w?w?\.?web\.archive.org/web/([0-9]+)/)?(.*?\.[a-z]+/(.*?)) (.*?)]")
+PLAIN_LINK_RX = re.compile(r"\[(https?://)(w?w?w?\.?web\.archive.org/web/([0-9]+)/)?(.*?) (.*?)]")
+PARENT_CHILD_RX = re.compile(r"[\"']*?\[\[(?P<t>.*?)(\|.*?)?]],?[\"']*?,? ?([A-z]*? ?(published )?in |via|,[\"']*|-|–|—|&mdash;|&ndash;|:| \() ?(the )?['\"]*\[\[(?P<p>.*?)(\|.*?)?]]['\"]*?\)?")
+CHILD_OF_RX = re.compile(r"\[\[.*?]]['\"]*?[:,].*?\[\[(.*?)(\|.*?)?]]")
+OPEN_LINK_RX = re.compile(r"\[\[(.*?)(\|(.*?))?$")
+SIMPLE_LINK_RX = re.compile(r"\[\[(.*?)(\|(.*?))?]+")
+REFERENCE_MAGAZINE_RX = {i: re.compile(r"\{\{" + i + "\|([0-9]+)(\|(.*?))?(\|(.*?))?}}") for i in REFERENCE_MAGAZINES}
+REFERENCE_MAGAZINE_TEXT_RX = re.compile(r"'*?(\{\{(?!FactFile)[A-z0-9]+\|[0-9]+\|.*?)(\|.*?(\{\{'s?}})?.*?)?}}'*?")
+TEMPLATE_NAME_RX = re.compile(r'\{\{([^|\[}\n]+)[|}]')
+
+# Generic fall-through patterns, tried in order once no template-specific logic has matched
+LINK_PARAM_RX = re.compile(r"{{[^|\[}\n]+\|link=(.*?)\|.*?\|(.*?)(\|(.*?))?}}")
+SET_PARAM_RX = re.compile(r"\{\{[^|\[}\n]+\|(.*?\|)?set=(?P<set>.*?)\|(.*?\|)?((scenario|unit|pack)=(?P<scenario>.*?)\|?)?(.*?)}}")
+ISSUE_FIRST_RX = re.compile(r"{{[^|\[}\n]+\|(issue[0-9]?=)?(?P<issue>(Special |Special Edition |Digital Sampler Edition|Interview Special|Souvenir Special|Premiere Issue)?H?S? ?[0-9.]*)(\|issue[0-9]=.*?)?\|(story=|article=)?\[*(?P<article>.*?)(#.*?)?(\|(?P<text>.*?))?]*(\|.*?)?}}")
+ISSUE_SECOND_RX = re.compile(r"{{[^|\[}\n]+\|(story=|article=)?\[*(?P<article>.*?)(#.*?)?(\|(?P<text>.*?))?]*\|(issue[0-9]?=)?(?P<issue>(Special Edition |Souvenir Special|Premiere Issue)?H?S? ?[0-9.]*)(\|issue[0-9]=.*?)?(\|.*?)?}}")
+FORMATTED_PARAM_RX = re.compile(r"\{\{[^|\]\n]+\|([^|\n=}\]]+)\|([^|\n=}\]]+)}}")
+SINGLE_PARAM_RX = re.compile(r"\{\{[^|\]\n]+\|(\[\[.*?\|)?([^|\n}\]]+)]*?}}")
+SERIES_ISSUE_RX = re.compile(r"{{(?P<template>.*?)\|(.*?\|)?series=(?P<series>.*?)\|(.*?\|)?issue1=(?P<issue>[0-9]+)\|(.*?\|)?(adventure|story)=(?P<story>.*?)(\|.*?)?}")
+STORY_SERIES_RX = re.compile(r"{{(?P<template>.*?)\|(.*?\|)?(adventure|story)=(?P<story>.*?)\|(.*?\|)?issue1=(?P<issue>[0-9]+)\|(.*?\|)?series=(?P<series>.*?)(\|.*?)?}")
+BOOK_STORY_RX = re.compile(r"{{(?P<template>.*?)\|(.*?\|)?book[0-9]?=(?P<book>.*?)\|(.*?\|)?(adventure|story)=(?P<story>.*?)(\|.*?)?}")
+STORY_BOOK_RX = re.compile(r"{{(?P<template>.*?)\|(.*?\|)?(adventure|story)=(?P<story>.*?)\|(.*?\|)?book[0-9]?=(?P<book>.*?)(\|.*?)?}")
+STORY_BOOK_LOOSE_RX = re.compile(r"{{(?P<template>.*?)\|(.*?\|)?(adventure|story)=(?P<story>.*?)\|(.*?)?book[0-9]?=(?P<book>.*?)(\|.*?)?}")
+WEB_INT_RX = re.compile(r"{{[^|\[}\n]+\|(.*?\|)?url=(?P<url>.*?)\|.*?(text=(?P<t1>.*?)\|)?(.*?\|)?(?P<p>int|seriesl?i?n?k?)=(?P<int>.*?)(\|.*?text=(?P<t2>.*?))?(\|.*?)?}}")
+WEB_TEXT_RX = re.compile(r"{{[^|\[}\n]+\|(.*?\|)?(full_url|url|video)=(?P<url>.*?)\|(.*?\|)?(text|postname|thread)=(?P<text>.*?)(\|.*?)?}}")
+WEB_UNNAMED_TEXT_RX = re.compile(r"{{[^|\[}\n]+\|(.*?\|)?(full_url|url|video)=(?P<url>.*?)\|(blogspotname=.*?\|)?(?P<text>.*?)(\|.*?)?}}")
+WEB_UNNAMED_RX = re.compile(r"{{[^|\[}\n]+\|(date=.*?\|)?(subdomain=.*?\|)?(.*?)\|(.*?)(\|.*?)?}}")
+DASHED_LINKS_RX = re.compile(r"['\"]*\[\[(.*?)(\|.*?)?]]['\"]* ?[-—] ?['\"]*\[\[(.*?) ?([0-9]*?)(\|.*?)?]]")
+FORMATTED_PARAM_RETRY_RX = re.compile(r"\{\{[^|\]\n]+\|([A-Z][^|\n=}\]]+)\|([^|\n=}\]]+)}}")
+
 
 def convert_issue_to_template(s):
     m = re.search(r"(\[\[(.*?) ([0-9]+)(\|.*?)?]]'* ?{{C\|(.*?)}})", s)
@@ -224,33 +266,47 @@ def extract_item(z: str, a: bool, page, types, master=False) -> Optional[Item]:
     """
     z = z.replace("|1=", "|").replace("|s=y", "").replace("{{'s}}", "'s").replace("{{'}}", "'").replace("{{!}}", "|").replace("…", "&hellip;").replace("{{=}}", "=")
     if "SeriesListing" in z or "UnknownListing" in z:
-        z = re.sub(r"\{\{(Series|Unknown)Listing.*?}} ?", "", z)
-    z = re.sub(r"{{([A-z]+)]]", "{{\\1}}", re.sub(r"\|[a-z ]+=\|", "|", z)).replace(" ", " ")
-    while re.search(r"\[\[([^]|\n]+)_", z):
-        z = re.sub(r"\[\[([^]|\n]+)_", "[[\\1 ", z)
+        z = LISTING_RX.sub("", z)
+    if "=|" in z:
+        z = EMPTY_PARAM_RX.sub("|", z)
+    if "]]" in z:
+        z = BROKEN_TEMPLATE_RX.sub("{{\\1}}", z)
+    z = z.replace(" ", " ")
+    if "_" in z:
+        while UNDERSCORE_LINK_RX.search(z):
+            z = UNDERSCORE_LINK_RX.sub("[[\\1 ", z)
     while "  " in z:
         z = z.replace("  ", " ")
 
-    s = re.sub(r"\|volume=([0-9])\|([0-9]+)\|", "|\\1.\\2|", z).replace("|}}", "}}")
-    s = re.sub(r"<!--.*?-->", "", s)
-    s = re.sub(r"^(.*?\[\[.*?[^ ])#(.*?)(\|.*?]].*?)$", "\\1\\3", s).replace("|d=y", "")
-    s = re.sub(r" ?\{\{Ab\|.*?}}", "", s)
-    s = re.sub(r" ?\{\{[Rr]eprint\|.*?}}", "", s)
-    s = re.sub(r"^(Parent: )*", "", s)
-    s = re.sub(r"[ ]+(\|[a-z _]+=)", "\\1", s)
+    s = VOLUME_RX.sub("|\\1.\\2|", z) if "|volume=" in z else z
+    s = s.replace("|}}", "}}")
+    if "<!--" in s:
+        s = COMMENT_RX.sub("", s)
+    if "#" in s:
+        s = ANCHOR_RX.sub("\\1\\3", s)
+    s = s.replace("|d=y", "")
+    if "{{Ab|" in s:
+        s = AB_RX.sub("", s)
+    if "eprint|" in s:
+        s = REPRINT_RX.sub("", s)
+    while s.startswith("Parent: "):
+        s = s[8:]
+    if " |" in s:
+        s = SPACED_PARAM_RX.sub("\\1", s)
     if s.count("{") == 2 and s.count("}") == 1:
         s += "}"
     for i, j in COLLAPSE.items():
         if "{{" + i + "|" in s or "{{" + i + "}}" in s:
             return Item(z, "General", a, target=COLLAPSE[i], template=i, collapsed=True)
 
-    s = re.sub(r"''(\[[^\[].*?[^]]])''", "\\1", s)
+    if "''[" in s:
+        s = ITALIC_LINK_RX.sub("\\1", s)
     # Plaintext links not wrapped in WebCite or OfficialSite
     if s.count("[") == 1 and s.count("]") == 1 and "WebCite" not in s:
-        x = re.search(r"\[(https?://)(w?w?w?\.?web\.archive.org/web/([0-9]+)/)?(.*?\.[a-z]+/(.*?)) (.*?)]", s)
+        x = PLAIN_URL_RX.search(s)
         if x:
             return Item(z, "Basic", a, url=x.group(5), full_url=x.group(1) + x.group(4), text=x.group(6), archivedate=x.group(3))
-        x = re.search(r"\[(https?://)(w?w?w?\.?web\.archive.org/web/([0-9]+)/)?(.*?) (.*?)]", s)
+        x = PLAIN_LINK_RX.search(s)
         if x:
             return Item(z, "Basic", a, url=x.group(4), full_url=x.group(1) + x.group(4), text=x.group(5), archivedate=x.group(3))
 
@@ -262,19 +318,20 @@ def extract_item(z: str, a: bool, page, types, master=False) -> Optional[Item]:
         return Item(z, "General", a, invalid=True)
 
     # Parent/child items not listed in StoryCite or appropriate template
-    m = re.search(r"[\"']*?\[\[(?P<t>.*?)(\|.*?)?]],?[\"']*?,? ?([A-z]*? ?(published )?in |via|,[\"']*|-|–|—|&mdash;|&ndash;|:| \() ?(the )?['\"]*\[\[(?P<p>.*?)(\|.*?)?]]['\"]*?\)?", s)
-    if m:
-        return Item(z, "General", a, target=m.groupdict()['t'], parent=m.groupdict()['p'], check_both=True)
-    m = re.search(r"\[\[.*?]]['\"]*?[:,].*?\[\[(.*?)(\|.*?)?]]", s)
-    if m:
-        return Item(z, "General", a, target=m.group(1))
+    if s.count("[[") > 1:
+        m = PARENT_CHILD_RX.search(s)
+        if m:
+            return Item(z, "General", a, target=m.groupdict()['t'], parent=m.groupdict()['p'], check_both=True)
+        m = CHILD_OF_RX.search(s)
+        if m:
+            return Item(z, "General", a, target=m.group(1))
 
     # Simple wikilinks with no templates (also catches broken links)
     if s.count("[[") == 1 and s.count("{{") == 0:
         if s.count("]") == 0:
-            x = re.search(r"\[\[(.*?)(\|(.*?))?$", s)
+            x = OPEN_LINK_RX.search(s)
         else:
-            x = re.search(r"\[\[(.*?)(\|(.*?))?]+", s)
+            x = SIMPLE_LINK_RX.search(s)
         if x:
             return Item(z, "External" if x.group(1).startswith(":File") else "General", a, target=x.group(1), format_text=x.group(3))
 
@@ -283,12 +340,13 @@ def extract_item(z: str, a: bool, page, types, master=False) -> Optional[Item]:
         if x:
             return x
 
+    lower = s.lower()
     for i, k in REFERENCE_MAGAZINES.items():
-        if i.split('\\', 1)[0].lower() in s.lower():
-            m = re.search(r"\{\{" + i + "\|([0-9]+)(\|(.*?))?(\|(.*?))?}}", s)
+        if i.lower() in lower:
+            m = REFERENCE_MAGAZINE_RX[i].search(s)
             mode = types.get(i, "General")
-            zx = re.sub(r"'*?(\{\{(?!FactFile)[A-z0-9]+\|[0-9]+\|.*?)(\|.*?(\{\{'s?}})?.*?)?}}'*?", "\\1}}", s)
             if m:
+                zx = REFERENCE_MAGAZINE_TEXT_RX.sub("\\1}}", s)
                 target = k.replace("<x>", m.group(1))
                 if i in REFERENCE_MAGAZINE_ISSUES and m.group(1).isnumeric() and int(m.group(1)) > REFERENCE_MAGAZINE_ISSUES[i]:
                     target = target.replace(" (magazine)", "")
@@ -299,7 +357,7 @@ def extract_item(z: str, a: bool, page, types, master=False) -> Optional[Item]:
                 else:
                     return Item(zx, mode, a, parent=target, template=i, issue=m.group(1), text=m.group(2), collapsed=True, ref_magazine=True)
 
-    template = re_if(re.search(r'\{\{([^|\[}\n]+)[|}]', s), 1, '')
+    template = re_if(TEMPLATE_NAME_RX.search(s), 1, '')
     if template and template[0].islower():
         template = template[0].upper() + template[1:]
     tx = template.replace("_", " ").lower()
@@ -466,19 +524,20 @@ def extract_item(z: str, a: bool, page, types, master=False) -> Optional[Item]:
         return Item(z, mode, a, target="Star Wars Rebels: Spark of Rebellion", template=template)
 
     # InsiderCite and similar templates - link= parameter
-    m = re.search(r"{{[^|\[}\n]+\|link=(.*?)\|.*?\|(.*?)(\|(.*?))?}}", s)
+    m = LINK_PARAM_RX.search(s) if "|link=" in s else None
     if m:
         return Item(z, mode, a, target=fix_insider_departments(m.group(2), template), template=template, parent=m.group(1), issue=m.group(1), format_text=m.group(4))
 
     # Miniatures, toys or cards with set= parameter
-    m = re.search(r"\{\{[^|\[}\n]+\|(.*?\|)?set=(?P<set>.*?)\|(.*?\|)?((scenario|unit|pack)=(?P<scenario>.*?)\|?)?(.*?)}}", s)
+    m = SET_PARAM_RX.search(s) if "set=" in s else None
     if m:
         return Item(z, mode, a, target=m.group('set'), template=template, text=m.group('scenario'))
 
     # Magazine articles with issue as second parameter
-    m = re.search(r"{{[^|\[}\n]+\|(issue[0-9]?=)?(?P<issue>(Special |Special Edition |Digital Sampler Edition|Interview Special|Souvenir Special|Premiere Issue)?H?S? ?[0-9.]*)(\|issue[0-9]=.*?)?\|(story=|article=)?\[*(?P<article>.*?)(#.*?)?(\|(?P<text>.*?))?]*(\|.*?)?}}", s.replace("&#61;", "="))
+    unescaped = s.replace("&#61;", "=")
+    m = ISSUE_FIRST_RX.search(unescaped)
     if not m:
-        m = re.search(r"{{[^|\[}\n]+\|(story=|article=)?\[*(?P<article>.*?)(#.*?)?(\|(?P<text>.*?))?]*\|(issue[0-9]?=)?(?P<issue>(Special Edition |Souvenir Special|Premiere Issue)?H?S? ?[0-9.]*)(\|issue[0-9]=.*?)?(\|.*?)?}}", s.replace("&#61;", "="))
+        m = ISSUE_SECOND_RX.search(unescaped)
     if m and template != "StoryCite" and template != "SimpleCite":
         p = determine_parent_magazine(m, template, types)
         article = fix_insider_departments(m.group('article'), template)
@@ -492,7 +551,7 @@ def extract_item(z: str, a: bool, page, types, master=False) -> Optional[Item]:
                     no_issue=m.group('issue') is None, parent=parent)
 
     # Second parameter is formatted version of the target article
-    m = re.search(r"\{\{[^|\]\n]+\|([^|\n=}\]]+)\|([^|\n=}\]]+)}}", s)
+    m = FORMATTED_PARAM_RX.search(s)
     if m:
         if template == "Microfighters" or m.group(1).startswith("Star Wars: Visions Filmmaker Focus"):
             return Item(z, mode, a, target=m.group(1), template=template, text=m.group(2))
@@ -501,7 +560,7 @@ def extract_item(z: str, a: bool, page, types, master=False) -> Optional[Item]:
             return Item(z, mode, a, target=m.group(1), template=template)
 
     # Template-based use cases: collapse down to single value, or convert to identifiable target
-    m = re.search(r"\{\{[^|\]\n]+\|(\[\[.*?\|)?([^|\n}\]]+)]*?}}", s)
+    m = SINGLE_PARAM_RX.search(s)
     if m:
         i = m.group(2).strip()
         if template and template in PREFIXES:
@@ -512,9 +571,9 @@ def extract_item(z: str, a: bool, page, types, master=False) -> Optional[Item]:
             return Item(z, mode, a, target=i, template=template)
 
     # series, issue1 and story/adventure - only for Outlander. is there a better way?
-    m = re.search(r"{{(?P<template>.*?)\|(.*?\|)?series=(?P<series>.*?)\|(.*?\|)?issue1=(?P<issue>[0-9]+)\|(.*?\|)?(adventure|story)=(?P<story>.*?)(\|.*?)?}", s)
-    if not m:
-        m = re.search(r"{{(?P<template>.*?)\|(.*?\|)?(adventure|story)=(?P<story>.*?)\|(.*?\|)?issue1=(?P<issue>[0-9]+)\|(.*?\|)?series=(?P<series>.*?)(\|.*?)?}", s)
+    m = SERIES_ISSUE_RX.search(s) if "issue1=" in s else None
+    if m is None and "issue1=" in s:
+        m = STORY_SERIES_RX.search(s)
     if m:
         issue2 = re_if(re.search(r"\|issue2=([0-9]+)", s), 1)
         format_text = re_if(re.search(r"\|stext=(.*?)(\|.*?)}}", s), 1)
@@ -522,16 +581,16 @@ def extract_item(z: str, a: bool, page, types, master=False) -> Optional[Item]:
                     issue=m.group('issue'), issue2=issue2, format_text=format_text)
 
     # Extract book & adventure or story
-    m = re.search(r"{{(?P<template>.*?)\|(.*?\|)?book[0-9]?=(?P<book>.*?)\|(.*?\|)?(adventure|story)=(?P<story>.*?)(\|.*?)?}", s)
-    if not m:
-        m = re.search(r"{{(?P<template>.*?)\|(.*?\|)?(adventure|story)=(?P<story>.*?)\|(.*?\|)?book[0-9]?=(?P<book>.*?)(\|.*?)?}", s)
+    m = BOOK_STORY_RX.search(s) if "book" in s else None
+    if not m and "book" in s:
+        m = STORY_BOOK_RX.search(s)
     if not m and "book=" in s:
-        m = re.search(r"{{(?P<template>.*?)\|(.*?\|)?(adventure|story)=(?P<story>.*?)\|(.*?)?book[0-9]?=(?P<book>.*?)(\|.*?)?}", s)
+        m = STORY_BOOK_LOOSE_RX.search(s)
     if m:
         return Item(z, mode, a, target=m.group('story'), template=template, parent=m.group('book'))
 
     # Web article with int= parameter
-    m = re.search(r"{{[^|\[}\n]+\|(.*?\|)?url=(?P<url>.*?)\|.*?(text=(?P<t1>.*?)\|)?(.*?\|)?(?P<p>int|seriesl?i?n?k?)=(?P<int>.*?)(\|.*?text=(?P<t2>.*?))?(\|.*?)?}}", s)
+    m = WEB_INT_RX.search(s) if "url=" in s else None
     if m:
         text = m.group('t1') or m.group('t2')
         if m.group('p') and m.group('p').startswith('series'):
@@ -539,11 +598,9 @@ def extract_item(z: str, a: bool, page, types, master=False) -> Optional[Item]:
         return Item(z, mode, a, target=m.group('int'), template=template, url=m.group('url'), text=text)
 
     # Web articles without int= parameter
-    m = re.search(r"{{[^|\[}\n]+\|(.*?\|)?(full_url|url|video)=(?P<url>.*?)\|(.*?\|)?(text|postname|thread)=(?P<text>.*?)(\|.*?)?}}", s)
-    if not m:
-        m = re.search(r"{{[^|\[}\n]+\|(.*?\|)?(full_url|url|video)=(?P<url>.*?)\|(blogspotname=.*?\|)?(?P<text>.*?)(\|.*?)?}}", s)
-    if not m:
-        m = re.search(r"{{[^|\[}\n]+\|(.*?\|)?(full_url|url|video)=(?P<url>.*?)\|(.*?\|)?(text|postname|thread)=(?P<text>.*?)(\|.*?)?}}", s)
+    m = None
+    if "url=" in s or "video=" in s:
+        m = WEB_TEXT_RX.search(s) or WEB_UNNAMED_TEXT_RX.search(s)
     if m:
         text = m.group('text') or ''
         if text and "series=" in s:
@@ -552,19 +609,19 @@ def extract_item(z: str, a: bool, page, types, master=False) -> Optional[Item]:
 
     # Web templates without named parameters
     if mode == "Web" or mode == "External" or mode == "Publisher" or mode == "Commercial":
-        m = re.search(r"{{[^|\[}\n]+\|(date=.*?\|)?(subdomain=.*?\|)?(.*?)\|(.*?)(\|.*?)?}}", s)
+        m = WEB_UNNAMED_RX.search(s)
         if m:
             y = re_if(re.search(r"\|int=(.*?)[|}]", s), 1)
             return Item(z, mode, a, template=template, url=m.group(3), text=m.group(4), target=y)
 
-    m = re.search(r"['\"]*\[\[(.*?)(\|.*?)?]]['\"]* ?[-—] ?['\"]*\[\[(.*?) ?([0-9]*?)(\|.*?)?]]", s)
+    m = DASHED_LINKS_RX.search(s) if s.count("[[") > 1 else None
     if m and m.group(4):
         return Item(z, mode, a, target=m.group(1), template="", parent=m.group(3), issue=m.group(4))
     elif m:
         return Item(z, mode, a, target=m.group(3), template="", parent=m.group(1))
 
     # Second parameter is formatted version of the target article (retry)
-    m = re.search(r"\{\{[^|\]\n]+\|([A-Z][^|\n=}\]]+)\|([^|\n=}\]]+)}}", s)
+    m = FORMATTED_PARAM_RETRY_RX.search(s)
     if m:
         return Item(z, mode, a, target=m.group(1), template=template)
 
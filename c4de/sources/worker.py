@@ -0,0 +1,295 @@
+import os
+import re
+import threading
+import traceback
+from multiprocessing.connection import Listener, Client
+
+from pywikibot import Site, Page, Category
+
+from c4de.blocking import ReadWriteLock, reads, writes
+from c4de.common import log, error_log
+from c4de.sources.analysis import get_analysis_from_page
+from c4de.sources.build import analyze_target_page
+from c4de.sources.engine import load_auto_categories, load_template_types, reload_auto_categories, reload_templates, \
+    collect_revision_ids, load_snapshot, save_snapshot, refresh_master_lists, LIST_AT_END, LIST_AT_START
+from c4de.sources.index import create_index, prepare_ordered_list
+from c4de.sources.infoboxer import load_infoboxes, reload_infoboxes
+from c4de.sources.parsing import fix_template_redirects
+from c4de.sources.updates import handle_results, search_for_missing
+
+# the worker's address and authkey can also be given through these environment variables; the authkey has no default,
+# and should be a secret of its own rather than the bot's Discord token
+WORKER_ADDRESS_VARIABLE = "C4DE_WORKER_ADDRESS"
+WORKER_KEY_VARIABLE = "C4DE_WORKER_KEY"
+DEFAULT_WORKER_ADDRESS = "localhost:6010"
+# maximum number of connections handled at once; further clients wait to be accepted
+WORKER_CONNECTIONS = 4
+
+# the engine methods that the bot may call on a worker process
+ENGINE_OPERATIONS = {"is_loaded", "build", "rebuild_changed_sources", "reload_infoboxes", "reload_templates",
+                     "reload_auto_categories", "analyze", "analyze_nomination", "build_index", "build_ordered_list",
+                     "search_missing"}
+
+
+class SourcesWorkerError(Exception):
+    pass
+
+
+def worker_settings(key: str = None, address: str = None):
+    """ Returns the sources worker's authkey and (host, port) address, taking each from the environment if it isn't
+    given. """
+    key = key or os.environ.get(WORKER_KEY_VARIABLE)
+    if not key:
+        raise SourcesWorkerError("No sources worker key is configured; set WORKER_KEY in local_token.py, or "
+                                 f"{WORKER_KEY_VARIABLE}")
+    host, _, port = (address or os.environ.get(WORKER_ADDRESS_VARIABLE) or DEFAULT_WORKER_ADDRESS).rpartition(":")
+    return key.encode(), (host or "localhost", int(port))
+
+
+class SourcesEngine:
+    """ Holds the loaded masterlists and template data, and runs the analysis, index and rebuild operations on them.
+    The bot either uses one directly, or talks to one running in a separate worker process through SourcesClient;
+    either way, pages are passed by title and only strings and numbers are returned.
+
+    Operations can be called from several threads at once. Builds and reloads replace the loaded data one attribute at
+    a time, so they hold the lock exclusively, while analyses share it.
+
+    :type site: Site
+    :type appearances: FullListData
+    :type sources: FullListData
+    """
+
+    def __init__(self, site):
+        self.site = site
+        self.source_rev_ids = {}
+        self.source_cache = None
+        self.infoboxes = {}
+        self.templates = {}
+        self.disambigs = []
+        self.appearances = None
+        self.sources = None
+        self.remap = None
+        self.auto_cats = []
+        self.lock = ReadWriteLock()
+
+    def is_loaded(self):
+        return self.appearances is not None
+
+    @writes
+    def build(self, force=False):
+        self.templates = load_template_types(self.site)
+        self.auto_cats = load_auto_categories(self.site)
+        self.infoboxes = load_infoboxes(self.site)
+        self.disambigs = [p.title() for p in Category(self.site, "Disambiguation pages").articles() if "(disambiguation)" not in p.title()]
+        self.refresh_sources(force=force)
+
+        self.build_missing_page()
+
+    def refresh_sources(self, force=False, revisions=None):
+        self.source_rev_ids = revisions if revisions is not None else collect_revision_ids(self.site)
+        if self.source_cache is None:
+            self.source_cache = load_snapshot()
+        reparsed = refresh_master_lists(self.site, self.templates, self.source_cache, self.source_rev_ids, force)
+        self.appearances = self.source_cache.appearances
+        self.sources = self.source_cache.sources
+        self.remap = self.source_cache.remap
+        if reparsed:
+            save_snapshot(self.source_cache)
+        return reparsed
+
+    def build_missing_page(self):
+        skip = LIST_AT_END + LIST_AT_START
+        skip += [c.title() for c in Category(self.site, "Category:Real-world attractions").articles(recurse=True)]
+        skip += [c.title() for c in Category(self.site, "Category:Real-world arcade games").articles()]
+        # skip += [c.title() for c in Category(self.site, "Category:Mobile games").articles(recurse=True)]
+        skip += [c.title() for c in Category(self.site, "Category:Web-based games").articles()]
+        skip += [c.title() for c in Category(self.site, "Category:Commercials").articles()]
+        skip += [c.title() for c in Category(self.site, "Category:RPGA adventures").articles()]
+
+        page = Page(self.site, "User:C4-DE Bot/Canon Missing")
+        text = "" if not page.exists() else page.get()
+        pages1, pages2 = [], []
+        for i in self.appearances.no_canon_index:
+            (pages2 if i.target in skip else pages1).append(i)
+
+        new_text = "\n".join(f"#{x.date}: {x.original}" for x in pages1)
+        if pages2:
+            new_text += "\n\n==Other==\n"
+            new_text += "\n".join(f"#{x.date}: {x.original}" for x in pages2)
+
+        if new_text != text:
+            page.put(new_text, "Recording items missing from the canon media timeline", botflag=False)
+
+        page = Page(self.site, "User:C4-DE Bot/Legends Missing")
+        text = "" if not page.exists() else page.get()
+        pages1, pages2 = [], []
+        for i in self.appearances.no_legends_index:
+            (pages2 if i.target in skip else pages1).append(i)
+
+        ex_rpg = [c.title() for c in Category(self.site, "Category:West End Games adventure supplements").articles()]
+        main, fiction, rpg = [], [], []
+        for x in pages1:
+            if x.target in ex_rpg:
+                rpg.append(f"#{x.date}: {x.original}")
+            elif x.template in ["WEGCite", "DarkStryder", "JournalCite", "GamerCite", "LivingForce", "WizCite", "WizardsCite", "FFG", "FFGXW", "DoD"]:
+                rpg.append(f"#{x.date}: {x.original}")
+                # rpg.append(f"#{x.date}: {x.timeline or 'N/A'}: {x.original}")
+            else:
+                main.append(f"#{x.date}: {x.original}")
+                # main.append(f"#{x.date}: {x.timeline or 'N/A'}: {x.original}")
+
+        nt = ["\n".join(main)]
+        if rpg:
+            nt.append("==RPG==\n" + "\n".join(rpg))
+        if pages2:
+            nt.append("==Other==\n" + "\n".join(f"#{x.date}: {x.original}" for x in pages2))
+        new_text = re.sub(r"\|reprint=[A-z0-9]+", "", "\n\n".join(nt))
+        if new_text != text:
+            page.put(new_text, "Recording items missing from the Legends media timeline", botflag=False)
+
+    def have_sources_changed(self, revisions=None):
+        revisions = revisions if revisions is not None else collect_revision_ids(self.site)
+        changed = [t for t, r in revisions.items() if self.source_rev_ids.get(t) != r]
+        if changed:
+            log(f"Found changes to {len(changed)} source pages: {', '.join(changed)}")
+        return changed
+
+    @writes
+    def rebuild_changed_sources(self):
+        revisions = collect_revision_ids(self.site)
+        if self.have_sources_changed(revisions) and self.refresh_sources(revisions=revisions):
+            self.build_missing_page()
+
+    @writes
+    def reload_infoboxes(self):
+        log("Loading infoboxes")
+        self.infoboxes = reload_infoboxes(self.site)
+
+    @writes
+    def reload_templates(self):
+        self.templates = reload_templates(self.site)
+
+    @writes
+    def reload_auto_categories(self):
+        self.auto_cats = reload_auto_categories(self.site)
+
+    def target_page(self, title) -> Page:
+        target = Page(self.site, title)
+        return target.getRedirectTarget() if target.isRedirectPage() else target
+
+    @reads
+    def analyze(self, title, include_date=False, use_index=True):
+        return analyze_target_page(self.target_page(title), self.infoboxes, self.templates, self.disambigs,
+                                   self.appearances, self.sources, self.auto_cats, self.remap,
+                                   save=True, include_date=include_date, use_index=use_index)
+
+    @reads
+    def analyze_nomination(self, title, old_text: str):
+        target = Page(self.site, title)
+        old_text, redirects = fix_template_redirects(target, old_text)
+        results = analyze_target_page(target, self.infoboxes, self.templates, self.disambigs, self.appearances,
+                                      self.sources, self.auto_cats, self.remap, old_text=old_text,
+                                      save=True, include_date=False, use_index=True, redirects=redirects)
+        return old_text, results
+
+    @reads
+    def build_index(self, title):
+        """ Creates or updates the index for the given page, returning the index page's title and the previous
+        revision ID of the index, if there was one. """
+        target = self.target_page(title)
+        analysis = get_analysis_from_page(target, self.infoboxes, self.templates, self.disambigs, self.appearances,
+                                          self.sources, self.auto_cats, self.remap, False, False)
+        result, old_id = create_index(self.site, target, analysis, self.appearances.target, self.sources.target, True)
+        return result.title(), old_id
+
+    @reads
+    def build_ordered_list(self, title):
+        target = self.target_page(title)
+        analysis = get_analysis_from_page(target, self.infoboxes, self.templates, self.disambigs, self.appearances,
+                                          self.sources, self.auto_cats, self.remap, False, False)
+
+        results = prepare_ordered_list(analysis)
+        page = Page(self.site, f"User:C4-DE Bot/Timeline Request")
+        text = f"This is an listing of all Appearances and Sources for [[{target.title()}]], ordered by chronological release date.\n"
+        text += "\n".join(results)
+        page.put(text, "Completing ordering request", botflag=False)
+
+    @reads
+    def search_missing(self):
+        results, _, collections = search_for_missing(self.site, self.appearances, self.sources)
+        handle_results(self.site, results, collections)
+
+
+class SourcesClient:
+    """ Calls the engine operations on a sources worker process. Each call uses its own connection, so calls from
+    different threads can run at the same time; the worker handles up to WORKER_CONNECTIONS connections at once, and
+    the engine's lock keeps rebuilds exclusive of analyses. """
+
+    def __init__(self, authkey: bytes, address: tuple):
+        self.address = address
+        self.authkey = authkey
+
+    def call(self, operation, *args, **kwargs):
+        with Client(self.address, authkey=self.authkey) as conn:
+            conn.send((operation, args, kwargs))
+            status, result = conn.recv()
+        if status == "error":
+            raise SourcesWorkerError(result)
+        return result
+
+    def __getattr__(self, name):
+        if name not in ENGINE_OPERATIONS:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+
+def handle_connection(engine: SourcesEngine, conn, slots: threading.BoundedSemaphore = None):
+    try:
+        respond(engine, conn)
+    finally:
+        if slots:
+            slots.release()
+
+
+def respond(engine: SourcesEngine, conn):
+    with conn:
+        try:
+            operation, args, kwargs = conn.recv()
+        except EOFError:
+            return
+        try:
+            if operation not in ENGINE_OPERATIONS:
+                raise SourcesWorkerError(f"Unknown operation: {operation}")
+            result = ("ok", getattr(engine, operation)(*args, **kwargs))
+        except Exception as e:
+            traceback.print_exc()
+            result = ("error", f"{type(e).__name__}: {e}")
+        try:
+            conn.send(result)
+        except Exception as e:
+            error_log(f"Unable to send {operation} result: {type(e)}: {e}", tb=False)
+
+
+def serve(engine: SourcesEngine, authkey: bytes, address: tuple, connections=WORKER_CONNECTIONS):
+    """ Serves engine operations to the bot until interrupted. Only clients holding the authkey can connect. """
+    slots = threading.BoundedSemaphore(connections)
+    with Listener(address, authkey=authkey) as listener:
+        log(f"Sources worker listening on {address[0]}:{address[1]}")
+        while True:
+            slots.acquire()
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                slots.release()
+                error_log(f"Rejected sources worker connection: {type(e)}: {e}", tb=False)
+                continue
+            threading.Thread(target=handle_connection, args=(engine, conn, slots), daemon=True).start()
+
+
+def run_worker(authkey: bytes, address: tuple):
+    site = Site(user="C4-DE Bot")
+    site.login()
+    engine = SourcesEngine(site)
+    log("Loading sources engine")
+    engine.build()
+    serve(engine, authkey, address)
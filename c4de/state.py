@@ -0,0 +1,117 @@
+import json
+import os
+import sqlite3
+from threading import Lock
+
+from c4de.common import log, error_log
+
+STATE_DB = "c4de/data/state.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS caches (name TEXT PRIMARY KEY, migrated TEXT);
+CREATE TABLE IF NOT EXISTS entries (
+    cache TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (cache, key)
+) WITHOUT ROWID;
+"""
+
+
+def flatten(data: dict, depth: int, prefix=()):
+    """ Splits a nested cache into rows, descending into dicts up to the given depth. Each key is the JSON-encoded
+    path to the value, so integer keys (e.g. Discord message IDs) survive the round trip. """
+    for k, v in data.items():
+        path = (*prefix, k)
+        if depth > 1 and isinstance(v, dict) and v:
+            yield from flatten(v, depth - 1, path)
+        else:
+            yield json.dumps(path, separators=(",", ":")), v
+
+
+def unflatten(rows):
+    data = {}
+    for key, value in rows:
+        *parents, last = json.loads(key)
+        target = data
+        for p in parents:
+            target = target.setdefault(p, {})
+        target[last] = json.loads(value)
+    return data
+
+
+class StateStore:
+    """ Stores the bot's caches in a single SQLite database in WAL mode, with one row per cache entry. Saving a cache
+    only writes the rows whose values changed since the last save, in one transaction, so an interrupted write leaves
+    the previous state intact.
+
+    :type conn: sqlite3.Connection
+    :type written: dict[str, dict[str, str]]
+    """
+
+    def __init__(self, path=STATE_DB):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.lock = Lock()
+        self.written = {}
+
+    def migrate(self, cache, legacy_file, depth):
+        """ Imports the old JSON cache file the first time the cache is loaded. """
+        if self.conn.execute("SELECT 1 FROM caches WHERE name = ?", (cache,)).fetchone():
+            return
+        data = {}
+        if legacy_file and os.path.exists(legacy_file):
+            try:
+                with open(legacy_file, "r") as f:
+                    data = json.load(f)
+                log(f"Migrating {legacy_file} to {cache} state")
+            except Exception as e:
+                error_log(f"Encountered {type(e)} while migrating {legacy_file}", e)
+                raise
+        rows = [(cache, k, json.dumps(v, separators=(",", ":"))) for k, v in flatten(data, depth)]
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("INSERT OR REPLACE INTO entries (cache, key, value) VALUES (?, ?, ?)", rows)
+            self.conn.execute("INSERT INTO caches (name, migrated) VALUES (?, datetime('now'))", (cache,))
+
+    def load(self, cache, legacy_file=None, depth=1) -> dict:
+        """ Loads the given cache, migrating it from its old JSON file if it has never been loaded before. """
+        with self.lock:
+            self.migrate(cache, legacy_file, depth)
+            rows = self.conn.execute("SELECT key, value FROM entries WHERE cache = ?", (cache,)).fetchall()
+            self.written[cache] = dict(rows)
+            return unflatten(rows)
+
+    def save(self, cache, data: dict, depth=1, convert=None):
+        """ Upserts the entries that changed since the cache was last loaded or saved, and deletes removed entries.
+        Returns False if the changes couldn't be written. """
+        current = {}
+        for k, v in flatten(data, depth):
+            current[k] = json.dumps(convert(v) if convert else v, separators=(",", ":"))
+
+        with self.lock:
+            previous = self.written.get(cache, {})
+            changed = [(cache, k, v) for k, v in current.items() if previous.get(k) != v]
+            removed = [(cache, k) for k in previous if k not in current]
+            if not changed and not removed:
+                return True
+            try:
+                with self.conn:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    if changed:
+                        self.conn.executemany(
+                            "INSERT INTO entries (cache, key, value) VALUES (?, ?, ?) "
+                            "ON CONFLICT (cache, key) DO UPDATE SET value = excluded.value", changed)
+                    if removed:
+                        self.conn.executemany("DELETE FROM entries WHERE cache = ? AND key = ?", removed)
+            except sqlite3.Error as e:
+                error_log(f"Encountered {type(e)} while saving {cache} state", e)
+                return False
+            self.written[cache] = current
+            return True
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
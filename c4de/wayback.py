@@ -0,0 +1,256 @@
+import re
+import sqlite3
+import time
+from threading import Event, Lock, Thread
+from urllib.parse import urlparse
+
+import requests
+
+from c4de.common import USER_AGENT, log, error_log
+
+WAYBACK_QUEUE_DB = "c4de/data/wayback_queue.db"
+WAYBACK_ENDPOINT = "https://web.archive.org"
+WAYBACK_WORKERS = 4
+# minimum number of seconds between starting two jobs for URLs on the same site
+HOST_INTERVAL = 10
+BASE_BACKOFF = 30
+MAX_BACKOFF = 3600
+MAX_ATTEMPTS = 6
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+MISSING = "missing"
+FAILED = "failed"
+RETRY = "retry"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    url TEXT NOT NULL,
+    start TEXT NOT NULL,
+    host TEXT NOT NULL,
+    save INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    archivedate TEXT,
+    error TEXT,
+    updated TEXT,
+    PRIMARY KEY (url, start)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, next_attempt);
+"""
+
+
+class WaybackThrottled(Exception):
+    pass
+
+
+def host_of(url):
+    host = urlparse(url if "://" in url else f"https://{url}").netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def snapshot_timestamp(url):
+    x = re.search(r"/web/([0-9]+)/", url or "")
+    return x.group(1) if x else None
+
+
+class WaybackQueue:
+    """ Durable queue of URLs to look up or save in the Wayback Machine. Jobs are stored in a SQLite database, so a
+    backlog survives restarts, and are worked through by a small pool of threads. Jobs for URLs on the same site are
+    started at least HOST_INTERVAL seconds apart; failed attempts are retried with exponential backoff, up to
+    MAX_ATTEMPTS times, and all workers pause when the Wayback Machine reports that it's overwhelmed.
+
+    The endpoint can be pointed at a local stand-in that serves /web/<timestamp>/<url> and /save/<url>.
+
+    :type conn: sqlite3.Connection
+    :type next_slot: dict[str, float]
+    """
+
+    def __init__(self, path=WAYBACK_QUEUE_DB, endpoint=WAYBACK_ENDPOINT, workers=WAYBACK_WORKERS,
+                 host_interval=HOST_INTERVAL, timeout=60):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.endpoint = endpoint.rstrip("/")
+        self.workers = workers
+        self.host_interval = host_interval
+        self.timeout = timeout
+        self.lock = Lock()
+        self.stop = Event()
+        self.next_slot = {}
+        self.paused_until = 0
+        self.throttled = 0
+        # jobs that were in progress when the bot last stopped
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET status = ? WHERE status = ?", (PENDING, RUNNING))
+
+    def enqueue(self, url, start=None, save=True):
+        """ Adds the URL to the queue, unless it has already been archived. If save is False, the job only checks for
+        an existing archive. URLs that previously failed, or weren't found, are tried again, and a job that's still
+        pending is upgraded to a save if one is requested. """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (url, start, host, save, status, updated) VALUES (?, ?, ?, ?, ?, datetime('now')) "
+                "ON CONFLICT (url, start) DO UPDATE SET status = excluded.status, save = MAX(save, excluded.save), "
+                "attempts = 0, next_attempt = 0, error = NULL, updated = excluded.updated "
+                "WHERE status IN (?, ?)",
+                (url, start or "", host_of(url), int(save), PENDING, FAILED, MISSING))
+            self.conn.execute(
+                "UPDATE jobs SET save = MAX(save, ?) WHERE url = ? AND start = ? AND status = ?",
+                (int(save), url, start or "", PENDING))
+
+    def result(self, url, start=None):
+        """ Returns the status of the URL's job, and either its archivedate or its last error message. """
+        with self.lock:
+            row = self.conn.execute("SELECT status, archivedate, error FROM jobs WHERE url = ? AND start = ?",
+                                    (url, start or "")).fetchone()
+        if not row:
+            return None, None
+        return row[0], row[1] if row[0] == DONE else row[2]
+
+    def counts(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def run(self):
+        """ Works through the queue until no pending jobs remain. Interrupted jobs are picked up again the next time
+        the queue is opened. """
+        self.stop.clear()
+        threads = [Thread(target=self.worker, name=f"wayback-{i}", daemon=True) for i in range(self.workers)]
+        for t in threads:
+            t.start()
+        try:
+            while any(t.is_alive() for t in threads):
+                for t in threads:
+                    t.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stop.set()
+            raise
+        log(f"Wayback queue finished: {self.counts()}")
+
+    def worker(self):
+        while not self.stop.is_set():
+            job, wait = self.claim()
+            if job:
+                self.process(*job)
+            elif wait is None:
+                return
+            else:
+                self.stop.wait(wait)
+
+    def claim(self):
+        """ Marks the next job that's due, and whose site isn't being rate-limited, as running. Returns the job, or
+        how long to wait before trying again, or None for both if the queue is empty. """
+        with self.lock:
+            now = time.time()
+            if now < self.paused_until:
+                return None, self.paused_until - now
+            busy = [h for h, t in self.next_slot.items() if t > now]
+            row = self.conn.execute(
+                f"SELECT url, start, host, save, attempts FROM jobs WHERE status = ? AND next_attempt <= ? "
+                f"AND host NOT IN ({', '.join('?' for _ in busy)}) ORDER BY next_attempt LIMIT 1",
+                (PENDING, now, *busy)).fetchone()
+            if row:
+                self.next_slot[row[2]] = now + self.host_interval
+                with self.conn:
+                    self.conn.execute("UPDATE jobs SET status = ? WHERE url = ? AND start = ?", (RUNNING, row[0], row[1]))
+                return row, None
+
+            pending, running = self.conn.execute(
+                "SELECT MIN(CASE WHEN status = ? THEN next_attempt END), SUM(status = ?) FROM jobs",
+                (PENDING, RUNNING)).fetchone()
+            if pending is None and not running:
+                return None, None
+            wait = [1.0]
+            if pending is not None:
+                wait.append(pending - now)
+            if busy:
+                wait.append(min(self.next_slot[h] for h in busy) - now)
+            return None, max(0.1, min(wait))
+
+    def process(self, url, start, host, save, attempts):
+        try:
+            status, value = self.attempt(url, start or None, bool(save))
+            with self.lock:
+                self.throttled = 0
+        except WaybackThrottled:
+            with self.lock:
+                now = time.time()
+                # requests that were already in flight when the pause began don't extend it
+                delay = None
+                if now >= self.paused_until:
+                    delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** self.throttled)
+                    self.throttled += 1
+                    self.paused_until = now + delay
+            if delay:
+                log(f"Wayback Machine is overwhelmed; pausing archive requests for {delay}s")
+            status, value = RETRY, "Too many save requests, server is overwhelmed"
+        except (TimeoutError, ConnectionError, requests.exceptions.RequestException) as e:
+            status, value = RETRY, f"{type(e).__name__} while archiving"
+        except Exception as e:
+            error_log(url, type(e), e)
+            status, value = RETRY, str(e)
+
+        if status == RETRY:
+            attempts += 1
+            if attempts >= MAX_ATTEMPTS:
+                status = FAILED
+                log(f"Giving up on archiving {url} after {attempts} attempts: {value}")
+            next_attempt = time.time() + min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (attempts - 1))
+            status = PENDING if status == RETRY else status
+        else:
+            next_attempt = 0
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, attempts = ?, next_attempt = ?, archivedate = ?, error = ?, "
+                "updated = datetime('now') WHERE url = ? AND start = ?",
+                (status, attempts, next_attempt, value if status == DONE else None, None if status == DONE else value,
+                 url, start))
+
+    def get(self, path):
+        r = requests.get(f"{self.endpoint}/{path}", timeout=self.timeout, headers={"User-Agent": USER_AGENT})
+        if r.status_code == 429:
+            raise WaybackThrottled()
+        return r
+
+    def find_archive(self, url, start=None):
+        """ Returns the timestamp of the closest existing snapshot of the URL, ignoring snapshots from the same year as
+        the given start timestamp. """
+        x = f"{start}/" if start else ""
+        r = self.get(f"web/{x}{url}")
+        # anything other than a snapshot or a 404 is a transient error, not an answer
+        if r.status_code not in (200, 404):
+            raise requests.exceptions.HTTPError(f"Lookup failed with status {r.status_code}", response=r)
+        z = snapshot_timestamp(r.url)
+        if z and z != start and not (start and start[:4] == z[:4]):
+            return z
+        return None
+
+    def attempt(self, url, start, save):
+        z = self.find_archive(url, start)
+        if z:
+            log(f"URL is archived already: {z} -> {url}")
+            return DONE, z
+        elif not save:
+            return MISSING, "No archive has been recorded for this site"
+
+        log(f"Archiving in the wayback: {url}")
+        r = self.get(f"save/{url}")
+        z = snapshot_timestamp(r.url) or snapshot_timestamp(r.headers.get("Content-Location"))
+        if z:
+            log(f"Successful archive: {z} -> {url}")
+            return DONE, z
+        elif r.status_code >= 400:
+            return RETRY, f"Save request failed with status {r.status_code}"
+
+        # the save went through, but the new snapshot wasn't reported
+        z = self.find_archive(url)
+        return (DONE, z) if z else (RETRY, "Saved snapshot could not be found")
+
+    def close(self):
+        self.stop.set()
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,8 @@
+import local_token
+from c4de.sources.worker import run_worker, worker_settings
+
+try:
+    # the worker's own key (and optionally its address) is kept in local_token.py, separate from the Discord token
+    run_worker(*worker_settings(getattr(local_token, "WORKER_KEY", None), getattr(local_token, "WORKER_ADDRESS", None)))
+except KeyboardInterrupt:
+    pass
@@ -1,8 +1,16 @@
+import sys
+
+import local_token
 from c4de.core import C4DE_Bot
-from local_token import TOKEN
+from c4de.sources.worker import SourcesClient, worker_settings
 
 try:
-    client = C4DE_Bot()
-    client.run(TOKEN)
+    # with --worker, the sources engine is used from a running run-sources-worker.py process
+    worker = None
+    if "--worker" in sys.argv:
+        worker = SourcesClient(*worker_settings(getattr(local_token, "WORKER_KEY", None),
+                                                getattr(local_token, "WORKER_ADDRESS", None)))
+    client = C4DE_Bot(sources_worker=worker)
+    client.run(local_token.TOKEN)
 except KeyboardInterrupt:
     pass
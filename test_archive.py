@@ -19,25 +19,15 @@ def task():
     to_check = build_to_check(site, data)
     to_check = {k: v for k, v in to_check.items() if v}
 
-    current = sum(len(v) for k, v in to_check.items())
-    prev = -1
-    attempts = 0
-    while current != prev and attempts < 5:
-        prev = current
-        # old_info = populate_archives(to_check, skip=True)
-        old_info = populate_archives(to_check, skip=bool(attempts))
-        attempts += 1
-        for k, v in old_info.items():
-            if v:
-                for t in data:
-                    if k in data[t]:
-                        y = data[t].get(k, {})
-                        y['value'] = v
-                        data[t][k] = y
-                        print(k, t, v, k in to_check.get(t, []))
-                        if t in to_check and k in to_check[t]:
-                            to_check[t].pop(k)
-        current = sum(len(v) for k, v in to_check.items())
+    # retries and rate limiting are handled by the Wayback queue, which also resumes an interrupted run
+    new_info = populate_archives(to_check)
+    for k, v in new_info.items():
+        for t in data:
+            if k in data[t]:
+                y = data[t].get(k, {})
+                y['value'] = v
+                data[t][k] = y
+                print(k, t, v)
 
     add_data_to_archive(site, data, archives, True)
 